@@ -13,13 +13,29 @@ except ImportError:
     pass
 
 import json
-from typing import Dict, List
-from services.llm_client import SimpleLLMClient, ChatMessage
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from services.llm_client import ChatMessage, get_llm_client
 from core.context_builder import ContextBuilder
 from core.tool_executor import ToolExecutor
 from utils.event_emitter import get_event_emitter
 
 
+# 后台thinking线程池（进程级）：推测式thinking在后台运行，父子Agent的thinking互不排队
+_thinking_executor: Optional[ThreadPoolExecutor] = None
+_thinking_executor_lock = threading.Lock()
+
+
+def _get_thinking_executor() -> ThreadPoolExecutor:
+    global _thinking_executor
+    if _thinking_executor is None:
+        with _thinking_executor_lock:
+            if _thinking_executor is None:
+                _thinking_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="thinking")
+    return _thinking_executor
+
+
 class AgentExecutor:
     """Agent执行器 - 正确的XML上下文架构"""
     
@@ -44,8 +60,8 @@ class AgentExecutor:
         requested_model = agent_config.get("model_type", "claude-3-7-sonnet-20250219")
         self.model_type = requested_model
         
-        # 初始化LLM客户端
-        self.llm_client = SimpleLLMClient()
+        # 获取LLM客户端（进程内共享，子Agent不再重复解析配置和建立连接）
+        self.llm_client = get_llm_client()
         self.llm_client.set_tools_config(config_loader.all_tools)
         
         # 验证并调整模型
@@ -83,6 +99,12 @@ class AgentExecutor:
         self.first_thinking_done = False
         self.thinking_interval = 10  # 每10轮工具调用触发一次thinking
         self.tool_call_counter = 0
+        self._last_thinking_counter = 0  # 上次周期thinking时的工具调用计数（一批可能执行多个工具）
+        # 推测式thinking：周期thinking在后台基于历史快照运行，Agent继续行动，结果就绪后再合并
+        self.speculative_thinking = bool(agent_config.get("speculative_thinking", False))
+        self._pending_thinking = None  # (future, 快照中最后一条action)
+        # 同一响应中并行安全工具的最大并发数（1表示全部顺序执行）
+        self.max_parallel_tools = max(1, int(agent_config.get("max_parallel_tools", 4)))
     
     def run(self, task_id: str, user_input: str) -> Dict:
         """执行Agent任务"""
@@ -107,6 +129,7 @@ class AgentExecutor:
             self.latest_thinking = loaded_data.get("latest_thinking", "")
             self.first_thinking_done = loaded_data.get("first_thinking_done", False)
             self.tool_call_counter = loaded_data.get("tool_call_counter", 0)
+            self._last_thinking_counter = self.tool_call_counter - self.tool_call_counter % self.thinking_interval
             start_turn = loaded_data.get("current_turn", 0) + 1
             safe_print(f"📂 已加载对话历史，从第 {start_turn + 1} 轮继续")
             safe_print(f"   渲染历史: {len(self.action_history)}条, 完整轨迹: {len(self.action_history_fact)}条")
@@ -192,6 +215,9 @@ class AgentExecutor:
             safe_print(f"\n--- 第 {turn + 1}/{self.max_turns} 轮执行 ---")
             
             try:
+                # 合并已完成的后台thinking
+                self._merge_speculative_thinking(task_id, user_input, turn)
+                
                 # 每轮开始前保存状态
                 self._save_state(task_id, user_input, turn)
                 
@@ -221,7 +247,9 @@ class AgentExecutor:
                     model=self.model_type,
                     system_prompt=full_system_prompt,
                     tool_list=self.available_tools,
-                    tool_choice="required"  # 强制工具调用
+                    tool_choice="required",  # 强制工具调用
+                    cache_breakpoints=self.context_builder.cache_breakpoints,  # 稳定前缀（提示词缓存）
+                    parallel_tool_calls=self.max_parallel_tools > 1  # 允许一次返回多个工具调用
                 )
                 
                 if llm_response.status != "success":
@@ -230,7 +258,7 @@ class AgentExecutor:
                         "output": f"LLM调用失败",
                         "error_information": llm_response.error_information
                     }
-                    self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
+                    self._finish_agent(task_id, str(error_result))
                     return error_result
                 
                 safe_print(f"📥 LLM输出: {llm_response.output[:100]}...")
@@ -269,102 +297,36 @@ class AgentExecutor:
                             "output": thinking_result if thinking_result else "多次未调用工具",
                             "error_information": "Agent拒绝调用工具"
                         }
-                        self.hierarchy_manager.pop_agent(self.agent_id, str(error_result))
+                        self._finish_agent(task_id, str(error_result))
                         return error_result
                 
                 # 重置计数器（成功调用了工具）
                 max_tool_try = 0
                 
-                # 执行所有工具调用
-                for tool_call in llm_response.tool_calls:
-                    safe_print(f"\n🔧 执行工具: {tool_call.name}")
-                    safe_print(f"📋 参数: {tool_call.arguments}")
-                    
-                    # 发送工具调用事件（JSONL模式）
-                    emitter = get_event_emitter()
-                    if emitter.enabled:
-                        import json
-                        params_str = json.dumps(tool_call.arguments, ensure_ascii=False, indent=2)
-                        emitter.token(f"调用工具: {tool_call.name}\n参数: {params_str}")
-                    
-                    # ✅ 在保存 pending 之前，为 level != 0 的工具添加 uuid
-                    arguments_with_uuid = self._add_uuid_if_needed(tool_call.name, tool_call.arguments)
-                    
-                    # ✅ 先标记为pending（保存带 uuid 的参数）
-                    pending_tool = {
-                        "id": tool_call.id,
-                        "name": tool_call.name,
-                        "arguments": arguments_with_uuid,
-                        "status": "pending"
-                    }
-                    self.pending_tools.append(pending_tool)
-                    self._save_state(task_id, user_input, turn)  # 保存pending状态
-                    
-                    # 执行工具（使用带 uuid 的参数）
-                    tool_result = self.tool_executor.execute(
-                        tool_call.name,
-                        arguments_with_uuid,
-                        task_id
-                    )
-                    
-                    # ✅ 执行后从pending移除
-                    self.pending_tools = [t for t in self.pending_tools if t["id"] != tool_call.id]
-                    
-                    safe_print(f"✅ 结果: {tool_result.get('status', 'unknown')}")
-                    
-                    # 发送工具结果事件（JSONL模式）
-                    emitter = get_event_emitter()
-                    if emitter.enabled:
-                        status = tool_result.get('status', 'unknown')
-                        output_preview = tool_result.get('output', '')[:100]
-                        emitter.token(f"工具 {tool_call.name} 完成: {status} - {output_preview}...")
-                    
-                    # 记录动作到历史（使用带 uuid 的参数）
-                    action_record = {
-                        "tool_name": tool_call.name,
-                        "arguments": arguments_with_uuid,
-                        "result": tool_result
-                    }
-                    
-                    # 添加到完整轨迹（永不压缩）
-                    self.action_history_fact.append(action_record)
-                    
-                    # 添加到渲染历史（会被压缩）
-                    self.action_history.append(action_record)
-                    
-                    self.hierarchy_manager.add_action(self.agent_id, action_record)
-                    
-                    # 工具执行后保存状态
-                    self._save_state(task_id, user_input, turn)
-                    
-                    # 增加工具调用计数
-                    self.tool_call_counter += 1
+                # 执行所有工具调用（相邻的并行安全工具并发执行，其余按顺序执行）
+                for batch in self._plan_tool_batches(llm_response.tool_calls):
+                    final_result = self._execute_tool_batch(batch, task_id, user_input, turn)
                     
                     # 如果是final_output，返回结果
-                    if tool_call.name == "final_output":
+                    if final_result is not None:
                         safe_print(f"\n{'='*80}")
                         safe_print(f"✅ Agent完成: {self.agent_name}")
-                        safe_print(f"📊 状态: {tool_result.get('status', 'unknown')}")
+                        safe_print(f"📊 状态: {final_result.get('status', 'unknown')}")
                         safe_print(f"{'='*80}\n")
                         
-                        self.hierarchy_manager.pop_agent(self.agent_id, tool_result.get("output", ""))
-                        return tool_result
+                        self._finish_agent(task_id, final_result.get("output", ""))
+                        return final_result
                 
                 # 检查是否该触发thinking（每N轮工具调用）
-                if self.tool_call_counter % self.thinking_interval == 0:
+                if self.tool_call_counter - self._last_thinking_counter >= self.thinking_interval:
+                    self._last_thinking_counter = self.tool_call_counter
                     safe_print(f"[{self.agent_name}] 第{self.tool_call_counter}轮工具调用，触发thinking分析")
-                    thinking_result = self._trigger_thinking(task_id, user_input, is_first=False)
-                    if thinking_result:
-                        self.latest_thinking = thinking_result
-                        self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
-                        self._save_state(task_id, user_input, turn)
-                        
-                        # 发送 thinking 事件（完整内容）
-                        emitter = get_event_emitter()
-                        if emitter.enabled:
-                            emitter.token(f"[{self.agent_name}] 进度分析: {thinking_result}")
-                        safe_print(f"[{self.agent_name}] Thinking分析已更新")
-                        self.action_history=[]
+                    if self.speculative_thinking:
+                        self._start_speculative_thinking(task_id, user_input, turn)
+                    else:
+                        thinking_result = self._trigger_thinking(task_id, user_input, is_first=False)
+                        if thinking_result:
+                            self._apply_progress_thinking(task_id, user_input, turn, thinking_result)
             
             except Exception as e:
                 import traceback
@@ -418,9 +380,128 @@ class AgentExecutor:
             "output": "执行超过最大轮次限制",
             "error_information": f"Max turns {self.max_turns} exceeded"
         }
-        self.hierarchy_manager.pop_agent(self.agent_id, str(timeout_result))
+        self._finish_agent(task_id, str(timeout_result))
         return timeout_result
     
+    def _finish_agent(self, task_id: str, result: str):
+        """Agent结束：出栈并释放对话存储中该Agent的日志状态"""
+        self.hierarchy_manager.pop_agent(self.agent_id, result)
+        self.conversation_storage.release(task_id, self.agent_id)
+    
+    def _is_parallel_safe(self, tool_name: str) -> bool:
+        """工具是否可与其他调用并发执行（level_0_tools.yaml中的parallel_safe属性）"""
+        return bool(self.config_loader.all_tools.get(tool_name, {}).get("parallel_safe", False))
+    
+    def _plan_tool_batches(self, tool_calls: List) -> List[List]:
+        """
+        将一次LLM响应中的工具调用按原顺序分批
+        
+        相邻的并行安全工具合并为一批并发执行；其他工具（写文件、执行命令、子Agent、final_output等）单独成批，
+        保证有副作用的调用与前后调用之间的顺序不变。
+        """
+        batches = []
+        for tool_call in tool_calls:
+            if (
+                self.max_parallel_tools > 1
+                and self._is_parallel_safe(tool_call.name)
+                and batches
+                and all(self._is_parallel_safe(t.name) for t in batches[-1])
+            ):
+                batches[-1].append(tool_call)
+            else:
+                batches.append([tool_call])
+        return batches
+    
+    def _execute_tool_batch(self, batch: List, task_id: str, user_input: str, turn: int):
+        """
+        执行一批工具调用，结果按原顺序写入动作历史
+        
+        Returns:
+            如果执行了final_output则返回其结果，否则返回None
+        """
+        # ✅ 先全部标记为pending（保存带 uuid 的参数），一次保存
+        pending_batch = [self._begin_tool_call(tool_call) for tool_call in batch]
+        self._save_state(task_id, user_input, turn)  # 保存pending状态
+        
+        if len(batch) == 1:
+            # 执行工具（使用带 uuid 的参数）
+            pending_tool = pending_batch[0]
+            tool_result = self.tool_executor.execute(pending_tool["name"], pending_tool["arguments"], task_id)
+            self._finish_tool_call(pending_tool, tool_result, task_id, user_input, turn)
+            return tool_result if pending_tool["name"] == "final_output" else None
+        
+        safe_print(f"⚡ 并发执行 {len(batch)} 个工具调用")
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(len(batch), self.max_parallel_tools)) as pool:
+            futures = [
+                pool.submit(self.tool_executor.execute, pending_tool["name"], pending_tool["arguments"], task_id)
+                for pending_tool in pending_batch
+            ]
+            # 按原顺序逐个记录，每个完成后单独保存（中断时未记录的仍为pending，可恢复）
+            for pending_tool, future in zip(pending_batch, futures):
+                self._finish_tool_call(pending_tool, future.result(), task_id, user_input, turn)
+        return None
+    
+    def _begin_tool_call(self, tool_call) -> Dict:
+        """打印/发送调用事件，并将工具调用加入pending列表"""
+        safe_print(f"\n🔧 执行工具: {tool_call.name}")
+        safe_print(f"📋 参数: {tool_call.arguments}")
+        
+        # 发送工具调用事件（JSONL模式）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            params_str = json.dumps(tool_call.arguments, ensure_ascii=False, indent=2)
+            emitter.token(f"调用工具: {tool_call.name}\n参数: {params_str}")
+        
+        # ✅ 在保存 pending 之前，为 level != 0 的工具添加 uuid
+        arguments_with_uuid = self._add_uuid_if_needed(tool_call.name, tool_call.arguments)
+        
+        pending_tool = {
+            "id": tool_call.id,
+            "name": tool_call.name,
+            "arguments": arguments_with_uuid,
+            "status": "pending"
+        }
+        self.pending_tools.append(pending_tool)
+        return pending_tool
+    
+    def _finish_tool_call(self, pending_tool: Dict, tool_result: Dict, task_id: str, user_input: str, turn: int):
+        """将工具结果记录到动作历史，从pending移除并保存状态"""
+        tool_name = pending_tool["name"]
+        
+        # ✅ 执行后从pending移除
+        self.pending_tools = [t for t in self.pending_tools if t is not pending_tool]
+        
+        safe_print(f"✅ 结果: {tool_result.get('status', 'unknown')}")
+        
+        # 发送工具结果事件（JSONL模式）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            status = tool_result.get('status', 'unknown')
+            output_preview = tool_result.get('output', '')[:100]
+            emitter.token(f"工具 {tool_name} 完成: {status} - {output_preview}...")
+        
+        # 记录动作到历史（使用带 uuid 的参数）
+        action_record = {
+            "tool_name": tool_name,
+            "arguments": pending_tool["arguments"],
+            "result": tool_result
+        }
+        
+        # 添加到完整轨迹（永不压缩）
+        self.action_history_fact.append(action_record)
+        
+        # 添加到渲染历史（会被压缩）
+        self.action_history.append(action_record)
+        
+        self.hierarchy_manager.add_action(self.agent_id, action_record)
+        
+        # 工具执行后保存状态
+        self._save_state(task_id, user_input, turn)
+        
+        # 增加工具调用计数
+        self.tool_call_counter += 1
+    
     def _add_uuid_if_needed(self, tool_name: str, arguments: Dict) -> Dict:
         """
         为 level != 0 的工具添加 uuid 后缀到 task_input
@@ -469,10 +550,6 @@ class AgentExecutor:
             分析结果
         """
         try:
-            from services.thinking_agent import ThinkingAgent
-            
-            thinking_agent = ThinkingAgent()
-            
             # 构建完整的系统提示词
             full_system_prompt = self.context_builder.build_context(
                 task_id,
@@ -481,28 +558,7 @@ class AgentExecutor:
                 task_input,
                 action_history=self.action_history
             )
-            
-            if is_first:
-                # 首次thinking - 初始规划
-                return thinking_agent.analyze_first_thinking(
-                    task_description=task_input,
-                    agent_system_prompt=full_system_prompt,  # 传入完整的prompt
-                    available_tools=self.available_tools,
-                    tools_config=self.config_loader.all_tools  # 传递工具配置
-                )
-            else:
-                return thinking_agent.analyze_first_thinking(
-                    task_description=task_input,
-                    agent_system_prompt=full_system_prompt,  # 传入完整的prompt
-                    available_tools=self.available_tools,
-                    tools_config=self.config_loader.all_tools  # 传递工具配置
-                )
-                # 进度分析（full_system_prompt已包含<历史动作>）
-                # return thinking_agent.analyze_progress(
-                #     task_description=task_input,
-                #     agent_system_prompt=full_system_prompt,  # 已包含完整上下文
-                #     tool_call_counter=self.tool_call_counter
-                # )
+            return self._run_thinking(full_system_prompt, task_input)
         except Exception as e:
             raise Exception(str(e))
             # safe_print(f"⚠️ Thinking触发失败: {e}")
@@ -510,6 +566,101 @@ class AgentExecutor:
             # traceback.print_exc()
             # return ""
     
+    def _run_thinking(self, full_system_prompt: str, task_input: str) -> str:
+        """基于已构建的完整上下文调用Thinking Agent（首次规划与周期分析使用同一方式）"""
+        from services.thinking_agent import ThinkingAgent
+        
+        thinking_agent = ThinkingAgent(self.llm_client)
+        return thinking_agent.analyze_first_thinking(
+            task_description=task_input,
+            agent_system_prompt=full_system_prompt,  # 传入完整的prompt
+            available_tools=self.available_tools,
+            tools_config=self.config_loader.all_tools  # 传递工具配置
+        )
+        # 进度分析（full_system_prompt已包含<历史动作>）
+        # return thinking_agent.analyze_progress(
+        #     task_description=task_input,
+        #     agent_system_prompt=full_system_prompt,  # 已包含完整上下文
+        #     tool_call_counter=self.tool_call_counter
+        # )
+    
+    def _apply_progress_thinking(self, task_id: str, user_input: str, turn: int,
+                                 thinking_result: str, keep_actions: List[Dict] = None):
+        """
+        应用周期thinking结果：更新进度思考并重置渲染用的动作历史
+        
+        Args:
+            keep_actions: 重置后保留的动作（推测式thinking快照之后新产生、thinking尚未看到的动作）
+        """
+        self.latest_thinking = thinking_result
+        self.hierarchy_manager.update_thinking(self.agent_id, thinking_result)
+        self.action_history = list(keep_actions or [])
+        self._save_state(task_id, user_input, turn)
+        
+        # 发送 thinking 事件（完整内容）
+        emitter = get_event_emitter()
+        if emitter.enabled:
+            emitter.token(f"[{self.agent_name}] 进度分析: {thinking_result}")
+        safe_print(f"[{self.agent_name}] Thinking分析已更新")
+    
+    def _start_speculative_thinking(self, task_id: str, task_input: str, turn: int):
+        """
+        在后台启动周期thinking（基于当前历史的快照），Agent继续执行下一轮
+        
+        上一次后台thinking尚未合并时先等待其完成并合并，避免两次thinking交叠
+        """
+        if self._pending_thinking is not None:
+            safe_print(f"[{self.agent_name}] ⏳ 等待上一次后台thinking完成...")
+            self._merge_speculative_thinking(task_id, task_input, turn, wait=True)
+        
+        # 上下文在当前线程构建（快照），LLM调用在后台线程进行
+        full_system_prompt = self.context_builder.build_context(
+            task_id,
+            self.agent_id,
+            self.agent_name,
+            task_input,
+            action_history=self.action_history
+        )
+        snapshot_last = self.action_history[-1] if self.action_history else None
+        future = _get_thinking_executor().submit(self._run_thinking, full_system_prompt, task_input)
+        self._pending_thinking = (future, snapshot_last)
+        safe_print(f"[{self.agent_name}] 🧠 thinking已在后台启动（快照 {len(self.action_history)} 条动作），继续执行")
+    
+    def _merge_speculative_thinking(self, task_id: str, task_input: str, turn: int, wait: bool = False):
+        """
+        合并已完成的后台thinking
+        
+        thinking基于快照生成，因此只丢弃快照内的动作，保留快照之后新执行的动作；
+        若快照之后历史已被压缩替换（找不到快照位置），则保留当前全部历史
+        
+        Args:
+            wait: 未完成时是否等待
+        """
+        if self._pending_thinking is None:
+            return
+        future, snapshot_last = self._pending_thinking
+        if not wait and not future.done():
+            return
+        self._pending_thinking = None
+        
+        try:
+            thinking_result = future.result()
+        except Exception as e:
+            safe_print(f"⚠️ 后台thinking失败，保留当前历史继续执行: {e}")
+            return
+        if not thinking_result:
+            return
+        
+        keep_actions = self.action_history
+        if snapshot_last is not None:
+            for index, action in enumerate(self.action_history):
+                if action is snapshot_last:
+                    keep_actions = self.action_history[index + 1:]
+                    break
+        
+        safe_print(f"[{self.agent_name}] 🧠 合并后台thinking，保留快照之后的 {len(keep_actions)} 条动作")
+        self._apply_progress_thinking(task_id, task_input, turn, thinking_result, keep_actions)
+    
     def _compress_action_history_if_needed(self):
         """检查并压缩历史动作（如果超过上下文窗口限制）"""
         if not self.action_history:
@@ -5,9 +5,19 @@ from utils.windows_compat import safe_print
 上下文构造器 - 构建新的XML结构化上下文
 """
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
+import asyncio
+import os
 import json
 
+from utils.conversation_storage import ConversationStorage
+from utils.token_counter import get_encoding
+from services.llm_client import run_coroutine
+
+
+# general_prompts.yaml 模板缓存（进程级）：{文件路径: (mtime_ns, system_prompt_xml)}
+_general_prompt_templates: Dict[str, tuple] = {}
+
 
 class ContextBuilder:
     """构建XML结构化的Agent上下文（完整）"""
@@ -30,12 +40,97 @@ class ContextBuilder:
         self.llm_client = llm_client
         self.max_context_window = max_context_window
         
-        # 初始化tiktoken
-        try:
-            import tiktoken
-            self.encoding = tiktoken.get_encoding("cl100k_base")
-        except ImportError:
-            self.encoding = None
+        # 进程内共享的tiktoken编码器
+        self.encoding = get_encoding()
+        
+        # 分段缓存：{段名: (输入key, 渲染结果)}，只有输入变化的段才重新构建
+        self._section_cache: Dict[str, tuple] = {}
+        # 单个动作的渲染缓存：{id(action): (action, 渲染结果)}
+        self._action_block_cache: Dict[int, tuple] = {}
+        # 共享上下文缓存：(文件签名, context)
+        self._shared_context_cache: Optional[tuple] = None
+        self._cache_stats: Dict[str, Dict[str, int]] = {}
+        # 最近一次build_context结果中稳定前缀的断点位置（字符偏移）
+        self.cache_breakpoints: List[int] = []
+    
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        获取各段缓存的命中统计
+        
+        Returns:
+            {段名: {"hits": 命中次数, "misses": 未命中次数}}
+        """
+        return {section: dict(stats) for section, stats in self._cache_stats.items()}
+    
+    def _record_cache(self, section: str, hit: bool):
+        """记录一次缓存命中/未命中"""
+        stats = self._cache_stats.setdefault(section, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+    
+    def _section_cached(self, section: str, key) -> bool:
+        """该段是否已按 key 缓存（不计入命中统计）"""
+        entry = self._section_cache.get(section)
+        return entry is not None and entry[0] == key
+    
+    def _cached_section(self, section: str, key, build: Callable[[], str]) -> str:
+        """
+        按输入key缓存某一段的渲染结果
+        
+        Args:
+            section: 段名
+            key: 该段的全部输入（可比较），变化时重新构建
+            build: 构建函数
+        """
+        entry = self._section_cache.get(section)
+        if entry is not None and entry[0] == key:
+            self._record_cache(section, True)
+            return entry[1]
+        
+        self._record_cache(section, False)
+        value = build()
+        self._section_cache[section] = (key, value)
+        return value
+    
+    def _get_shared_context(self):
+        """
+        获取共享上下文（未变化时复用上次的结果）
+        
+        HierarchyManager提供内存版本号时以版本号为签名，否则退回文件签名
+        
+        Returns:
+            (context, 签名)，签名为None表示无法判断是否变化
+        """
+        signature = None
+        version = getattr(self.hierarchy_manager, "version", None)
+        context_file = getattr(self.hierarchy_manager, "context_file", None)
+        if version is not None:
+            # 先合并其他进程的修改再读版本号；版本未变化时不复制上下文
+            # （未命中时取到的快照可能比版本号新，下次只会多一次未命中）
+            signature = ("version", self.hierarchy_manager.get_version())
+            cached = self._shared_context_cache
+            if cached is not None and cached[0] == signature:
+                self._record_cache("shared_context", True)
+                return cached[1], signature
+            self._record_cache("shared_context", False)
+            context = self.hierarchy_manager.get_context()
+            self._shared_context_cache = (signature, context)
+            return context, signature
+        if context_file is not None:
+            try:
+                stat = os.stat(context_file)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature = None
+        
+        cached = self._shared_context_cache
+        if signature is not None and cached is not None and cached[0] == signature:
+            self._record_cache("shared_context", True)
+            return cached[1], signature
+        
+        self._record_cache("shared_context", False)
+        context = self.hierarchy_manager.get_context()
+        self._shared_context_cache = (signature, context) if signature is not None else None
+        return context, signature
     
     def build_context(self, task_id: str, agent_id: str, agent_name: str, task_input: str, 
                      action_history: List[Dict] = None) -> str:
@@ -52,9 +147,8 @@ class ContextBuilder:
         Returns:
             完整的XML结构化上下文字符串（包含通用提示词）
         """
-        context_data = self.hierarchy_manager.get_context()
+        context_data, context_signature = self._get_shared_context()
         current = context_data.get("current", {})
-        history = context_data.get("history", [])
         
         # 使用传入的action_history
         if action_history is not None:
@@ -63,44 +157,83 @@ class ContextBuilder:
         # 1️⃣ 读取通用系统提示词（general_prompts.yaml，包含<智能体经验>）
         general_system_prompt = self._load_general_system_prompt(agent_name)
         
-        # 2️⃣ 构建各个动态部分
-        user_latest_input = self._build_user_latest_input(current)
-        user_agent_history = self._build_user_agent_history(task_id, current)
-        structured_call_info = self._build_structured_call_info(current, agent_id)
+        # 2️⃣ 构建各个动态部分（依赖共享上下文的段在文件未变化时直接复用）
+        def cache_key(*extra):
+            # 无法获取文件签名时不缓存
+            return (context_signature, *extra) if context_signature is not None else object()
+        
+        # 需要LLM压缩的段（历史交互、结构化调用信息）先在同一事件循环中并发压缩，之后各段直接使用压缩结果
+        stale_sections = [
+            section for section, key in (
+                ("user_agent_history", cache_key(task_id)),
+                ("structured_call_info", cache_key(agent_id)),
+            )
+            if not self._section_cached(section, key)
+        ]
+        if stale_sections:
+            self._compress_sections(task_id, agent_id, current, context_data, stale_sections)
+        
+        user_latest_input = self._cached_section(
+            "user_latest_input", cache_key(),
+            lambda: self._build_user_latest_input(current)
+        )
+        user_agent_history = self._cached_section(
+            "user_agent_history", cache_key(task_id),
+            lambda: self._build_user_agent_history(task_id, current, context_data)
+        )
+        structured_call_info = self._cached_section(
+            "structured_call_info", cache_key(agent_id),
+            lambda: self._build_structured_call_info(current, agent_id)
+        )
         current_thinking = self._build_current_thinking(task_id, agent_id, current)
         action_history_xml = self._build_action_history(task_id, agent_id)
         
-        # 3️⃣ 组装完整上下文（通用部分在最前面）
-        full_context = f"""{general_system_prompt}
-
-<用户最新输入>
-{user_latest_input}
-</用户最新输入>
-
-<用户-智能体历史交互>
-{user_agent_history}
-</用户-智能体历史交互>
+        # 3️⃣ 组装完整上下文：按变化频率从低到高排列，使前缀尽量在多轮之间保持一致（供应商侧提示词缓存）
+        # 通用部分 + 本Agent任务 + 用户输入：Agent运行期间不变
+        stable_context = f"""{general_system_prompt}
 
 <当前运行智能体名称>
 {agent_name}
 </当前运行智能体名称>
 
-<结构化调用信息>
-{structured_call_info}
-</结构化调用信息>
-
 <当前智能体任务>
 {task_input}
 </当前智能体任务>
 
+<用户-智能体历史交互>
+{user_agent_history}
+</用户-智能体历史交互>
+
+<用户最新输入>
+{user_latest_input}
+</用户最新输入>
+"""
+        # 调用关系：只在子Agent启动/完成时变化
+        call_info_context = f"""
+<结构化调用信息>
+{structured_call_info}
+</结构化调用信息>
+"""
+        # 进度思考：每次thinking后变化
+        thinking_context = f"""
 <当前进度思考>
 {current_thinking}
 </当前进度思考>
-
+"""
+        # 历史动作：每轮变化
+        action_context = f"""
 <历史动作>
 {action_history_xml}
 </历史动作>
 """
+        full_context = stable_context + call_info_context + thinking_context + action_context
+        
+        # 记录各稳定段的结束位置（字符偏移），供LLM客户端标记缓存断点
+        self.cache_breakpoints = [
+            len(stable_context),
+            len(stable_context) + len(call_info_context),
+            len(stable_context) + len(call_info_context) + len(thinking_context),
+        ]
         
         return full_context
     
@@ -114,19 +247,33 @@ class ContextBuilder:
         Returns:
             格式化后的通用系统提示词（XML格式）
         """
-        # 读取general_prompts.yaml
-        import yaml
+        # 读取general_prompts.yaml（按文件修改时间缓存解析结果）
         from pathlib import Path
         
         agent_system_name = self.config_loader.agent_system_name
         prompts_file = Path(self.config_loader.config_root) / "agent_library" / agent_system_name / "general_prompts.yaml"
         
-        if not prompts_file.exists():
+        try:
+            mtime_ns = prompts_file.stat().st_mtime_ns
+        except OSError:
             return ""
         
-        with open(prompts_file, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
-            system_prompt_xml = data.get("system_prompt_xml", "")
+        return self._cached_section(
+            "general_prompt", (str(prompts_file), mtime_ns, agent_name),
+            lambda: self._format_general_system_prompt(prompts_file, mtime_ns, agent_name)
+        )
+    
+    def _format_general_system_prompt(self, prompts_file, mtime_ns: int, agent_name: str) -> str:
+        """解析（或复用已解析的）general_prompts.yaml并填入Agent变量"""
+        cached = _general_prompt_templates.get(str(prompts_file))
+        if cached is not None and cached[0] == mtime_ns:
+            system_prompt_xml = cached[1]
+        else:
+            import yaml
+            with open(prompts_file, 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f)
+                system_prompt_xml = data.get("system_prompt_xml", "")
+            _general_prompt_templates[str(prompts_file)] = (mtime_ns, system_prompt_xml)
         
         # 格式化变量
         prompts = self.agent_config.get("prompts", {})
@@ -154,18 +301,20 @@ class ContextBuilder:
         
         return "\n".join(result)
     
-    def _build_user_agent_history(self, task_id: str, current: Dict = None) -> str:
+    def _build_user_agent_history(self, task_id: str, current: Dict = None, context: Dict = None) -> str:
         """
         检查并压缩用户-智能体历史交互（只在启动时执行一次）
         
         Args:
             task_id: 任务ID
             current: 当前任务数据（包含用户输入）
+            context: 已加载的共享上下文（可选，避免重复读取）
         
         Returns:
             压缩后的历史交互文本（已包含<用户-智能体历史交互>标签）
         """
-        context = self.hierarchy_manager.get_context()
+        if context is None:
+            context = self.hierarchy_manager.get_context()
         if current is None:
             current = context.get("current", {})
         history = context.get("history", [])
@@ -180,29 +329,72 @@ class ContextBuilder:
             safe_print("使用已有的压缩历史交互")
             return compressed_history
         
-        safe_print("未到历史交互压缩阈值")
-        if len(str(history)) < 5000:
+        if self._user_agent_history_to_compress(current, context) is None:
+            safe_print("未到历史交互压缩阈值")
             return str(history)
         
-        # 提取当前任务的用户输入
-        current_task = ""
-        instructions = current.get("instructions", [])
-        if instructions:
-            # 将所有用户输入拼接起来
-            user_inputs = [instr.get("instruction", "") for instr in instructions]
-            current_task = "\n".join(user_inputs)
+        # 未在 build_context 中预先压缩时（单独调用）在此压缩
+        self._compress_sections(task_id, None, current, context, ("user_agent_history",))
+        return current["_compressed_user_agent_history"]
+    
+    @staticmethod
+    def _user_agent_history_to_compress(current: Dict, context: Dict):
+        """
+        需要压缩的历史交互
         
-        safe_print("首次压缩历史交互...")
-        compressed_result = self._compress_user_agent_history_with_llm(history, task_id, current_task)
+        Returns:
+            (history, 当前任务的用户输入)；无历史、已有压缩结果或未到阈值时返回None
+        """
+        history = context.get("history", [])
+        if not history or current.get("_compressed_user_agent_history"):
+            return None
+        if len(str(history)) < 5000:
+            return None
+        # 将当前任务的所有用户输入拼接起来
+        user_inputs = [instr.get("instruction", "") for instr in current.get("instructions", [])]
+        return history, "\n".join(user_inputs)
+    
+    def _compress_sections(self, task_id: str, agent_id: Optional[str], current: Dict, context: Dict,
+                           sections) -> None:
+        """
+        压缩需要LLM压缩的段（历史交互、结构化调用信息），多个段在同一事件循环中并发压缩
         
-        context["current"]["_compressed_user_agent_history"] = compressed_result
-        self.hierarchy_manager._save_context(context)
+        结果写入 current 和共享上下文（一次保存），之后各段直接使用已有的压缩结果
         
-        return compressed_result
+        Args:
+            sections: 要检查的段名（"user_agent_history"、"structured_call_info"）
+        """
+        jobs = {}
+        if "user_agent_history" in sections:
+            pending = self._user_agent_history_to_compress(current, context)
+            if pending is not None:
+                safe_print("首次压缩历史交互...")
+                jobs["_compressed_user_agent_history"] = (
+                    self._acompress_user_agent_history_with_llm, (pending[0], task_id, pending[1])
+                )
+        if "structured_call_info" in sections and agent_id is not None:
+            call_tree = self._call_tree_to_compress(current, agent_id)
+            if call_tree is not None:
+                safe_print(f"检测到较大的结构化调用信息（{len(current.get('agents_status', {}))}个agents），启动压缩...")
+                jobs[f"_compressed_structured_call_info_{agent_id}"] = (
+                    self._acompress_structured_call_info_with_llm, (call_tree, agent_id)
+                )
+        if not jobs:
+            return
+        
+        async def compress_all():
+            return await asyncio.gather(*(func(*args) for func, args in jobs.values()))
+        
+        results = run_coroutine(compress_all())
+        saved = self.hierarchy_manager.get_context()
+        for key, result in zip(jobs, results):
+            current[key] = result
+            saved["current"][key] = result
+        self.hierarchy_manager._save_context(saved)
     
-    def _compress_user_agent_history_with_llm(self, history: List[Dict], task_id: str, current_task: str = "") -> str:
+    async def _acompress_user_agent_history_with_llm(self, history: List[Dict], task_id: str, current_task: str = "") -> str:
         """
-        使用LLM压缩历史交互（直接返回LLM输出，不解析）
+        使用LLM压缩历史交互（直接返回LLM输出，不解析；异步，可与其他压缩并发）
         
         Args:
             history: 历史任务列表
@@ -279,7 +471,7 @@ class ContextBuilder:
         
         history_messages = [ChatMessage(role="user", content=prompt)]
         
-        response = self.llm_client.chat(
+        response = await self.llm_client.achat(
             history=history_messages,
             model=self.llm_client.compressor_models[0],  # 使用压缩专用模型
             system_prompt="你是一个专业的内容总结助手。请简洁明了地总结历史交互信息。",
@@ -302,10 +494,7 @@ class ContextBuilder:
         支持压缩机制：当agent数量超过阈值时，使用LLM压缩
         注意：每个agent的压缩结果单独缓存（因为is_current标记不同）
         """
-        hierarchy = current.get("hierarchy", {})
-        agents_status = current.get("agents_status", {})
-        
-        if not agents_status:
+        if not current.get("agents_status"):
             return "(无调用关系)"
         
         # 检查是否已有该agent的压缩结果（每个agent单独缓存）
@@ -315,6 +504,28 @@ class ContextBuilder:
             safe_print(f"使用已有的压缩结构化调用信息 (agent: {current_agent_id})")
             return compressed_call_info
         
+        tree = self._structured_call_tree(current, current_agent_id)
+        if tree is None:
+            return "(无调用关系)"
+        call_tree, call_tree_json = tree
+        
+        if not self._call_tree_needs_compression(current, call_tree_json):
+            return call_tree_json
+        
+        # 未在 build_context 中预先压缩时（单独调用）在此压缩
+        self._compress_sections(None, current_agent_id, current, None, ("structured_call_info",))
+        return current[cache_key]
+    
+    def _structured_call_tree(self, current: Dict, current_agent_id: str):
+        """
+        构建调用树（JSON结构，添加已访问集合防止循环）
+        
+        Returns:
+            (call_tree, 易读的JSON字符串)；没有根Agent时返回None
+        """
+        hierarchy = current.get("hierarchy", {})
+        agents_status = current.get("agents_status", {})
+        
         # 找到根Agent（Level 0）
         root_agents = [
             aid for aid, info in hierarchy.items()
@@ -322,9 +533,8 @@ class ContextBuilder:
         ]
         
         if not root_agents:
-            return "(无调用关系)"
+            return None
         
-        # 构建JSON结构（添加已访问集合防止循环）
         call_tree = []
         visited = set()  # 防止循环引用
         for root_id in root_agents:
@@ -334,30 +544,27 @@ class ContextBuilder:
             if tree_node:
                 call_tree.append(tree_node)
         
-        # 转换为易读的JSON字符串
-        call_tree_json = json.dumps(call_tree, indent=2, ensure_ascii=False)
-        
-        # 检查是否需要压缩（agent数量超过10个，或JSON长度超过8000字符）
-        agent_count = len(agents_status)
-        if agent_count > 10 or len(call_tree_json) > 8000:  # 测试用：原值 agent_count > 10 or len > 8000
-            safe_print(f"检测到较大的结构化调用信息（{agent_count}个agents，{len(call_tree_json)}字符），启动压缩...")
-            compressed_result = self._compress_structured_call_info_with_llm(
-                call_tree, current_agent_id
-            )
-            
-            # 保存压缩结果（针对当前agent）
-            cache_key = f"_compressed_structured_call_info_{current_agent_id}"
-            context = self.hierarchy_manager.get_context()
-            context["current"][cache_key] = compressed_result
-            self.hierarchy_manager._save_context(context)
-            
-            return compressed_result
-        
-        return call_tree_json
+        return call_tree, json.dumps(call_tree, indent=2, ensure_ascii=False)
+    
+    @staticmethod
+    def _call_tree_needs_compression(current: Dict, call_tree_json: str) -> bool:
+        """agent数量超过10个，或JSON长度超过8000字符时需要压缩"""
+        return len(current.get("agents_status", {})) > 10 or len(call_tree_json) > 8000
+    
+    def _call_tree_to_compress(self, current: Dict, current_agent_id: str) -> Optional[List[Dict]]:
+        """需要压缩的调用树；无调用关系、已有该agent的压缩结果或未到阈值时返回None"""
+        if not current.get("agents_status"):
+            return None
+        if current.get(f"_compressed_structured_call_info_{current_agent_id}"):
+            return None
+        tree = self._structured_call_tree(current, current_agent_id)
+        if tree is None or not self._call_tree_needs_compression(current, tree[1]):
+            return None
+        return tree[0]
     
-    def _compress_structured_call_info_with_llm(self, call_tree: List[Dict], current_agent_id: str) -> str:
+    async def _acompress_structured_call_info_with_llm(self, call_tree: List[Dict], current_agent_id: str) -> str:
         """
-        使用LLM压缩结构化调用信息
+        使用LLM压缩结构化调用信息（异步，可与其他压缩并发）
         
         Args:
             call_tree: Agent调用树结构
@@ -392,7 +599,7 @@ Agent调用树数据：
         
         messages = [ChatMessage(role="user", content=prompt)]
         
-        response = self.llm_client.chat(
+        response = await self.llm_client.achat(
             history=messages,
             model=self.llm_client.compressor_models[0],  # 使用压缩专用模型
             system_prompt="你是一个专业的内容总结助手。请简洁明了地总结Agent调用树信息。",
@@ -560,28 +767,10 @@ Agent调用树数据：
     
     def _build_current_thinking(self, task_id: str, agent_id: str, current: Dict) -> str:
         """构建当前进度思考（从文件读取最新的thinking）"""
-        # 从_actions.json文件读取（使用正确的路径）
-        from pathlib import Path
-        import json
-        import hashlib
-        import os
-        
-        # 使用与ConversationStorage相同的路径生成逻辑
-        conversations_dir = Path.home() / "mla_v3" / "conversations"
-        task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
-        task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
-        task_name = f"{task_hash}_{task_folder}"
-        filepath = conversations_dir / f"{task_name}_{agent_id}_actions.json"
-        
-        try:
-            if filepath.exists():
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    thinking = data.get("latest_thinking", "")
-                    if thinking:
-                        return thinking
-        except Exception as e:
-            safe_print(f"⚠️ 读取thinking失败: {e}")
+        # 从对话存储读取（本进程正在写入时直接取内存中的值）
+        thinking = ConversationStorage().get_latest_thinking(task_id, agent_id)
+        if thinking:
+            return thinking
         
         # 备用：从share_context读取
         agents_status = current.get("agents_status", {})
@@ -597,70 +786,65 @@ Agent调用树数据：
         # 优先使用传入的action_history
         action_history = self.current_action_history
         
-        # 如果没有传入，从文件读取
+        # 如果没有传入，从对话存储读取
         if not action_history:
-            from pathlib import Path
-            import json
-            import hashlib
-            import os
-            
-            # 使用与ConversationStorage相同的路径生成逻辑
-            conversations_dir = Path.home() / "mla_v3" / "conversations"
-            task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
-            task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
-            task_name = f"{task_hash}_{task_folder}"
-            filepath = conversations_dir / f"{task_name}_{agent_id}_actions.json"
-            
-            try:
-                if filepath.exists():
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        action_history = data.get("action_history", [])
-            except Exception as e:
-                safe_print(f"⚠️ 读取action_history失败: {e}")
+            data = ConversationStorage().read_actions(task_id, agent_id)
+            if data:
+                action_history = data.get("action_history", [])
         
         if not action_history:
             return "(无历史动作)"
         
-        # 构建XML格式的动作历史
+        # 构建XML格式的动作历史（每个动作的渲染结果按对象缓存，只渲染新增动作）
         actions_xml = []
+        block_cache = {}
         for action in action_history:
-            tool_name = action.get("tool_name", "")
-            
-            # 检查是否是历史总结
-            if tool_name == "_historical_summary":
-                # 渲染为<已压缩信息>
-                summary_text = action.get("result", {}).get("output", "")
-                actions_xml.append(f"<已压缩信息>\n{summary_text}\n</已压缩信息>")
-                continue
-            
-            # 普通action
-            arguments = action.get("arguments", {})
-            result = action.get("result", {})
-            
-            # 构建单个动作的XML
-            # action_xml = f"<action>\n"
-            # action_xml += f"  <tool_name>{tool_name}</tool_name>\n"
-            action_xml = f"action:\n"
-            action_xml += f"  tool_name:{tool_name}\n"            
-            # 添加参数
-            for param_name, param_value in arguments.items():
-                # 转义XML特殊字符
-                param_value_str = str(param_value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                #action_xml += f"  <tool_use:{param_name}>{param_value_str}</tool_use:{param_name}>\n"
-                action_xml += f"  {param_name}:{param_value_str}\n"
-            
-            # 添加结果（JSON格式）
-            try:
-                result_json = json.dumps(result, ensure_ascii=False, indent=2)
-                action_xml += f"  <result>\n{result_json}\n  </result>\n"
-            except:
-                action_xml += f"  <result>{str(result)}</result>\n"
-            
-            # action_xml += "</action>"
+            cached = self._action_block_cache.get(id(action))
+            if cached is not None and cached[0] is action:
+                self._record_cache("action_block", True)
+                action_xml = cached[1]
+            else:
+                self._record_cache("action_block", False)
+                action_xml = self._render_action(action)
+            block_cache[id(action)] = (action, action_xml)
             actions_xml.append(action_xml)
         
+        # 只保留当前历史中的动作（压缩/重置后的旧动作随之释放）
+        self._action_block_cache = block_cache
+        
         return "\n\n".join(actions_xml)
+    
+    def _render_action(self, action: Dict) -> str:
+        """渲染单个动作"""
+        tool_name = action.get("tool_name", "")
+        
+        # 检查是否是历史总结
+        if tool_name == "_historical_summary":
+            # 渲染为<已压缩信息>
+            summary_text = action.get("result", {}).get("output", "")
+            return f"<已压缩信息>\n{summary_text}\n</已压缩信息>"
+        
+        # 普通action
+        arguments = action.get("arguments", {})
+        result = action.get("result", {})
+        
+        # 构建单个动作的XML
+        # action_xml = f"<action>\n"
+        # action_xml += f"  <tool_name>{tool_name}</tool_name>\n"
+        action_xml = f"action:\n"
+        action_xml += f"  tool_name:{tool_name}\n"            
+        # 添加参数
+        for param_name, param_value in arguments.items():
+            # 转义XML特殊字符
+            param_value_str = str(param_value).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            #action_xml += f"  <tool_use:{param_name}>{param_value_str}</tool_use:{param_name}>\n"
+            action_xml += f"  {param_name}:{param_value_str}\n"
+        
+        # 添加结果（保持原有的 str(result) 渲染，与 agent 循环中一直使用的提示词格式一致）
+        action_xml += f"  <result>{str(result)}</result>\n"
+        
+        # action_xml += "</action>"
+        return action_xml
 
 
 if __name__ == "__main__":
@@ -7,15 +7,32 @@ from utils.windows_compat import safe_print
 """
 
 import os
+import copy
 import json
+import atexit
 import threading
+from contextlib import contextmanager
 from typing import Dict, List, Optional
 from datetime import datetime
 from pathlib import Path
 
+from utils.state_store import get_state_store
+
 
 class HierarchyManager:
-    """Agent层级管理器"""
+    """
+    Agent层级管理器
+
+    栈和共享上下文以内存中的状态为准：修改只更新内存并标记为脏，
+    由后台定时器合并后写盘（临时文件+重命名，保证原子性）；
+    /resume 依赖的持久化点（新指令、入栈、出栈、归档）同步落盘。
+    
+    启用SQLite后端（MLA_STATE_BACKEND=sqlite）时状态保存在工作区数据库中，
+    入栈/出栈等修改在跨进程的写事务中完成（先合并其他进程的修改再写入）。
+    """
+    
+    # 异步写盘的合并延迟（秒）：延迟期间的多次修改只写一次
+    WRITE_DELAY = 0.5
     
     def __init__(self, task_id: str):
         """
@@ -25,7 +42,9 @@ class HierarchyManager:
             task_id: 任务ID
         """
         self.task_id = task_id
-        self.lock = threading.Lock()
+        self.lock = threading.RLock()
+        # 保证写盘顺序（后取的快照不会被先取的快照覆盖）
+        self._write_lock = threading.Lock()
         
         # 文件路径 - 使用用户主目录（跨平台）
         conversations_dir = Path.home() / "mla_v3" / "conversations"
@@ -41,40 +60,98 @@ class HierarchyManager:
         self.stack_file = conversations_dir / f'{task_name}_stack.json'
         self.context_file = conversations_dir / f'{task_name}_share_context.json'
         
-        # 初始化文件
-        self._initialize_files()
+        # 内存状态
+        self._stack: List[Dict] = []
+        self._context: Dict = {}
+        self._stack_dirty = False
+        self._context_dirty = False
+        # 状态版本号：每次修改递增，供ContextBuilder判断共享上下文是否变化
+        self.version = 0
+        # 本进程最后一次读/写的文件签名，用于发现其他进程的修改
+        self._disk_signatures: Dict[Path, Optional[tuple]] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        
+        # SQLite状态库（未启用时为None，使用JSON文件）
+        self._store = get_state_store(task_id)
+        
+        # 初始化文件并加载到内存
+        if self._store is not None:
+            self._load_from_store()
+        else:
+            self._initialize_files()
+            self._stack = self._read_stack_file()
+            self._context = self._read_context_file()
+    
+    def _load_from_store(self):
+        """从状态库加载；库为空时从已有的JSON文件迁移"""
+        if self._store.is_empty():
+            self._initialize_files()
+            self._stack = self._read_stack_file()
+            self._context = self._read_context_file()
+            self._context.setdefault("task_id", self.task_id)
+            with self._store.transaction():
+                self._store.save_stack(self._stack)
+                self._store.save_context(self._context)
+        else:
+            self._stack = self._store.load_stack()
+            self._context = self._store.load_context()
     
     def _initialize_files(self):
         """初始化栈文件和共享上下文文件"""
         # 初始化栈文件
         if not self.stack_file.exists():
-            with open(self.stack_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "stack": [],
-                    "created_at": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
+            self._atomic_write(self.stack_file, json.dumps({
+                "stack": [],
+                "created_at": datetime.now().isoformat()
+            }, indent=2, ensure_ascii=False))
         
         # 初始化共享上下文文件
         if not self.context_file.exists():
-            with open(self.context_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "task_id": self.task_id,
-                    "current": {
-                        "instructions": [],
-                        "hierarchy": {},
-                        "agents_status": {},
-                        "start_time": datetime.now().isoformat(),
-                        "last_updated": datetime.now().isoformat()
-                    },
-                    "agent_time_history": {},
-                    "history": [],
-                    "created_at": datetime.now().isoformat(),
+            self._atomic_write(self.context_file, json.dumps({
+                "task_id": self.task_id,
+                "current": {
+                    "instructions": [],
+                    "hierarchy": {},
+                    "agents_status": {},
+                    "start_time": datetime.now().isoformat(),
                     "last_updated": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
+                },
+                "agent_time_history": {},
+                "history": [],
+                "created_at": datetime.now().isoformat(),
+                "last_updated": datetime.now().isoformat()
+            }, indent=2, ensure_ascii=False))
     
-    def _load_stack(self) -> List[Dict]:
-        """加载当前栈状态"""
+    @staticmethod
+    def _file_signature(path: Path) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+    
+    def _atomic_write(self, path: Path, text: str, durable: bool = False):
+        """写入临时文件后重命名，读者不会看到写了一半的文件"""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                try:
+                    tmp_path.unlink()
+                except OSError:
+                    pass
+        self._disk_signatures[path] = self._file_signature(path)
+    
+    def _read_stack_file(self) -> List[Dict]:
+        """从文件读取栈状态"""
         try:
+            self._disk_signatures[self.stack_file] = self._file_signature(self.stack_file)
             with open(self.stack_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 return data.get("stack", [])
@@ -82,20 +159,10 @@ class HierarchyManager:
             safe_print(f"⚠️ 加载栈文件失败: {e}")
             return []
     
-    def _save_stack(self, stack: List[Dict]):
-        """保存栈状态"""
-        try:
-            with open(self.stack_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "stack": stack,
-                    "last_updated": datetime.now().isoformat()
-                }, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            safe_print(f"⚠️ 保存栈文件失败: {e}")
-    
-    def _load_context(self) -> Dict:
-        """加载共享上下文"""
+    def _read_context_file(self) -> Dict:
+        """从文件读取共享上下文"""
         try:
+            self._disk_signatures[self.context_file] = self._file_signature(self.context_file)
             with open(self.context_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
@@ -111,14 +178,153 @@ class HierarchyManager:
                 "history": []
             }
     
+    def _refresh_from_disk(self):
+        """
+        文件被其他进程（如另一个CLI/Web UI实例）修改过时重新加载
+        
+        只比较文件签名（一次stat），未变化时不解析JSON；
+        本进程有未落盘的修改时以内存为准。
+        SQLite后端通过 PRAGMA data_version 判断是否有其他进程提交过修改。
+        """
+        if self._store is not None:
+            if self._store.changed_externally() and not (self._stack_dirty or self._context_dirty):
+                self._stack = self._store.load_stack()
+                self._context = self._store.load_context()
+                self.version += 1
+            return
+        changed = False
+        if not self._stack_dirty and self._file_signature(self.stack_file) != self._disk_signatures.get(self.stack_file):
+            self._stack = self._read_stack_file()
+            changed = True
+        if not self._context_dirty and self._file_signature(self.context_file) != self._disk_signatures.get(self.context_file):
+            self._context = self._read_context_file()
+            changed = True
+        if changed:
+            self.version += 1
+    
+    def _load_stack(self) -> List[Dict]:
+        """获取当前栈状态（内存）"""
+        with self.lock:
+            self._refresh_from_disk()
+            return list(self._stack)
+    
+    def _save_stack(self, stack: List[Dict]):
+        """更新栈状态（异步写盘）"""
+        with self.lock:
+            self._stack = stack
+            self._stack_dirty = True
+            self.version += 1
+            self._schedule_flush()
+    
+    def _load_context(self) -> Dict:
+        """获取共享上下文（内存）"""
+        with self.lock:
+            self._refresh_from_disk()
+            return self._context
+    
     def _save_context(self, context: Dict):
-        """保存共享上下文"""
-        try:
+        """更新共享上下文（异步写盘）"""
+        with self.lock:
             context["last_updated"] = datetime.now().isoformat()
-            with open(self.context_file, 'w', encoding='utf-8') as f:
-                json.dump(context, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            safe_print(f"⚠️ 保存共享上下文失败: {e}")
+            self._context = context
+            self._context_dirty = True
+            self.version += 1
+            self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """安排一次延迟写盘（已安排时不重复安排，多次修改合并为一次写入）"""
+        if self._flush_timer is not None:
+            return
+        timer = threading.Timer(self.WRITE_DELAY, self._flush_from_timer)
+        timer.daemon = True
+        self._flush_timer = timer
+        timer.start()
+    
+    def _flush_from_timer(self):
+        with self.lock:
+            self._flush_timer = None
+        self.flush()
+    
+    @contextmanager
+    def _mutation(self):
+        """
+        修改状态的临界区
+        
+        JSON后端只持有进程内锁；SQLite后端还持有跨进程写事务：
+        进入时合并其他进程的修改，退出时在同一事务中写入。
+        """
+        with self.lock:
+            if self._store is None:
+                yield
+                return
+            with self._store.transaction():
+                self._refresh_from_disk()
+                yield
+                self._write_store()
+    
+    def _write_store(self):
+        """将脏状态写入SQLite状态库（调用方持有self.lock）"""
+        with self._store.transaction():
+            if self._stack_dirty:
+                self._store.save_stack(self._stack)
+            if self._context_dirty:
+                self._store.save_context(self._context)
+        self._stack_dirty = False
+        self._context_dirty = False
+    
+    def flush(self, durable: bool = False):
+        """
+        将内存中的脏状态写盘
+        
+        Args:
+            durable: 是否fsync（/resume依赖的持久化点使用）
+        """
+        if self._store is not None:
+            with self.lock:
+                if self._stack_dirty or self._context_dirty:
+                    try:
+                        self._write_store()
+                    except Exception as e:
+                        safe_print(f"⚠️ 保存层级状态失败，稍后重试: {e}")
+                        self._schedule_flush()
+            return
+        
+        with self._write_lock:
+            with self.lock:
+                if not (self._stack_dirty or self._context_dirty):
+                    return
+                try:
+                    stack_text = json.dumps({
+                        "stack": self._stack,
+                        "last_updated": datetime.now().isoformat()
+                    }, indent=2, ensure_ascii=False) if self._stack_dirty else None
+                    context_text = json.dumps(
+                        self._context, indent=2, ensure_ascii=False
+                    ) if self._context_dirty else None
+                except Exception as e:
+                    # 序列化期间状态被外部并发修改，稍后重试
+                    safe_print(f"⚠️ 序列化层级状态失败，稍后重试: {e}")
+                    self._schedule_flush()
+                    return
+                self._stack_dirty = False
+                self._context_dirty = False
+            
+            try:
+                if stack_text is not None:
+                    self._atomic_write(self.stack_file, stack_text, durable)
+            except Exception as e:
+                safe_print(f"⚠️ 保存栈文件失败: {e}")
+                with self.lock:
+                    self._stack_dirty = True
+                    self._schedule_flush()
+            try:
+                if context_text is not None:
+                    self._atomic_write(self.context_file, context_text, durable)
+            except Exception as e:
+                safe_print(f"⚠️ 保存共享上下文失败: {e}")
+                with self.lock:
+                    self._context_dirty = True
+                    self._schedule_flush()
     
     def start_new_instruction(self, instruction: str) -> str:
         """
@@ -130,7 +336,7 @@ class HierarchyManager:
         Returns:
             指令ID
         """
-        with self.lock:
+        with self._mutation():
             import hashlib
             context = self._load_context()
             
@@ -156,10 +362,13 @@ class HierarchyManager:
             
             context["current"]["instructions"].append(instruction_entry)
             self._save_context(context)
-            
-            safe_print(f"📝 新指令已添加: {instruction_id} -> {instruction[:50]}...")
-            
-            return instruction_id
+        
+        # 持久化点：/resume 需要知道已登记的指令
+        self.flush(durable=True)
+        
+        safe_print(f"📝 新指令已添加: {instruction_id} -> {instruction[:50]}...")
+        
+        return instruction_id
     
     def push_agent(self, agent_name: str, user_input: str) -> str:
         """
@@ -172,7 +381,7 @@ class HierarchyManager:
         Returns:
             生成的agent_id
         """
-        with self.lock:
+        with self._mutation():
             import hashlib
             
             # 生成agent_id
@@ -239,10 +448,13 @@ class HierarchyManager:
             }
             
             self._save_context(context)
-            
-            safe_print(f"📚 Agent入栈: {agent_name} (ID: {agent_id}, Level: {level})")
-            
-            return agent_id
+        
+        # 持久化点：/resume 依赖 running 状态的Agent续跑
+        self.flush(durable=True)
+        
+        safe_print(f"📚 Agent入栈: {agent_name} (ID: {agent_id}, Level: {level})")
+        
+        return agent_id
     
     def pop_agent(self, agent_id: str, final_output: str = ""):
         """
@@ -252,7 +464,7 @@ class HierarchyManager:
             agent_id: Agent ID
             final_output: 最终输出内容
         """
-        with self.lock:
+        with self._mutation():
             stack = self._load_stack()
             
             # 从栈中移除
@@ -279,18 +491,21 @@ class HierarchyManager:
             
             # 检查是否所有Agent都完成，如果是则移动current到history
             self._check_and_complete_if_all_done()
-            
-            safe_print(f"📚 Agent出栈: {agent_id}")
+        
+        # 持久化点：已完成Agent的final_output和归档结果
+        self.flush(durable=True)
+        
+        safe_print(f"📚 Agent出栈: {agent_id}")
     
     def update_thinking(self, agent_id: str, thinking: str):
         """
-        更新Agent的thinking（只保留最新的）
+        更新Agent的thinking（只保留最新的，异步写盘）
         
         Args:
             agent_id: Agent ID
             thinking: thinking内容
         """
-        with self.lock:
+        with self._mutation():
             context = self._load_context()
             
             if agent_id in context["current"]["agents_status"]:
@@ -310,12 +525,28 @@ class HierarchyManager:
         # action_history由ConversationStorage管理
         pass
     
+    def get_version(self) -> int:
+        """
+        当前状态版本号（先合并其他进程的修改，不复制上下文）
+        
+        供调用方在版本未变化时复用已取得的上下文快照
+        """
+        with self.lock:
+            self._refresh_from_disk()
+            return self.version
+    
     def get_context(self) -> Dict:
-        """获取完整的共享上下文"""
-        return self._load_context()
+        """
+        获取完整的共享上下文
+        
+        返回在锁内深拷贝的快照：调用方修改快照不影响内存中的状态，
+        需要保存时调用 _save_context 以递增版本号并写盘
+        """
+        with self.lock:
+            return copy.deepcopy(self._load_context())
     
     def _check_and_complete_if_all_done(self):
-        """检查是否所有Agent都完成，如果是则移动current到history"""
+        """检查是否所有Agent都完成，如果是则移动current到history（调用方持有self.lock）"""
         context = self._load_context()
         current_agents = context.get("current", {}).get("agents_status", {})
         
@@ -384,6 +615,20 @@ def get_hierarchy_manager(task_id: str) -> HierarchyManager:
         return _managers_cache[task_id]
 
 
+def flush_all_managers():
+    """将所有层级管理器的未落盘修改写盘（进程退出时调用）"""
+    with _cache_lock:
+        managers = list(_managers_cache.values())
+    for manager in managers:
+        try:
+            manager.flush(durable=True)
+        except Exception as e:
+            safe_print(f"⚠️ 层级状态写盘失败 ({manager.task_id}): {e}")
+
+
+atexit.register(flush_all_managers)
+
+
 if __name__ == "__main__":
     # 测试层级管理器
     manager = HierarchyManager("test_task")
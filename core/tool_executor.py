@@ -6,13 +6,89 @@ from utils.windows_compat import safe_print
 参考原项目tool_utils.py的逻辑
 """
 
+import os
+import socket
+import threading
 import requests
 import yaml
 import json
 import time
 import uuid
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+
+class _UnixSocketConnection(HTTPConnection):
+    """通过Unix域套接字连接的HTTP连接（主机名仅用于Host头）"""
+    
+    def __init__(self, *args, socket_path: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+    
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout if isinstance(self.timeout, (int, float)) else None)
+        sock.connect(self.socket_path)
+        return sock
+
+
+class _UnixSocketConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _UnixSocketConnection
+
+
+class _UnixSocketAdapter(HTTPAdapter):
+    """把挂载前缀下的所有请求转发到同一个Unix域套接字（保持连接复用）"""
+    
+    def __init__(self, socket_path: str, pool_size: int):
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+        self._unix_pool = _UnixSocketConnectionPool(
+            "localhost", maxsize=pool_size, socket_path=socket_path
+        )
+    
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._unix_pool
+    
+    def get_connection(self, url, proxies=None):
+        return self._unix_pool
+    
+    def close(self):
+        super().close()
+        self._unix_pool.close()
+
+
+# 进程级共享的toolServer会话（按地址/套接字/连接池大小复用，保持keep-alive）
+_sessions: Dict[tuple, requests.Session] = {}
+# 已在toolServer中确认存在的任务工作空间：{(服务器地址, task_id)}
+_ready_tasks = set()
+_transport_lock = threading.Lock()
+
+
+def get_tool_server_session(base_url: str, pool_size: int = 16, socket_path: Optional[str] = None) -> requests.Session:
+    """
+    获取访问toolServer的共享会话
+    
+    Args:
+        base_url: toolServer地址
+        pool_size: 连接池大小（同时保持的keep-alive连接数）
+        socket_path: 同机部署时的Unix域套接字路径（存在时优先使用）
+    """
+    use_socket = bool(socket_path) and hasattr(socket, "AF_UNIX") and os.path.exists(socket_path)
+    key = (base_url, pool_size, socket_path if use_socket else None)
+    
+    with _transport_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if use_socket:
+                session.mount(base_url, _UnixSocketAdapter(socket_path, pool_size))
+            _sessions[key] = session
+        return session
 
 
 class ToolExecutor:
@@ -37,20 +113,30 @@ class ToolExecutor:
         self.hierarchy_manager = hierarchy_manager
         self.task_cache = {}  # 缓存已创建的任务
         
-        # 从tool_config.yaml读取toolServer URL
+        # 从tool_config.yaml读取toolServer URL和连接配置
         self.tools_server_url = self._load_tools_server_url()
+        self.session = get_tool_server_session(
+            self.tools_server_url,
+            pool_size=self.transport_config.get("pool_size", 16),
+            socket_path=self.transport_config.get("socket_path")
+        )
         
         # 权限管理：task_id → auto_mode 映射
         self.task_permissions = {}  # {task_id: {"auto_mode": True/False}}
     
     def _load_tools_server_url(self) -> str:
-        """从配置文件加载工具服务器URL"""
+        """从配置文件加载工具服务器URL（同时读取连接池/套接字配置到transport_config）"""
+        self.transport_config = {}
         try:
             project_root = Path(__file__).parent.parent
             config_path = project_root / "config" / "run_env_config" / "tool_config.yaml"
             
             with open(config_path, 'r', encoding='utf-8') as f:
                 config = yaml.safe_load(f)
+                self.transport_config = {
+                    "pool_size": int(config.get('tools_server_pool_size', 16)),
+                    "socket_path": config.get('tools_server_socket') or None
+                }
                 url = config.get('tools_server', 'http://127.0.0.1:8001/')
                 # 移除末尾的斜杠
                 return url.rstrip('/')
@@ -68,9 +154,12 @@ class ToolExecutor:
         return self.task_permissions.get(task_id, {}).get("auto_mode", True)
     
     def _ensure_task_exists(self, task_id: str):
-        """确保任务在toolServer中存在"""
+        """确保任务在toolServer中存在（每个进程每个工作空间只检查一次）"""
         if task_id in self.task_cache:
             return
+        if (self.tools_server_url, task_id) in _ready_tasks:
+            self.task_cache[task_id] = True
+            return
         
         try:
             # URL 编码 task_id（避免路径中的特殊字符和双斜杠问题）
@@ -79,26 +168,32 @@ class ToolExecutor:
             
             # 检查任务状态（确保 URL 格式正确）
             status_url = f"{self.tools_server_url}/api/task/{encoded_task_id}/status"
-            response = requests.get(status_url, timeout=5)
+            response = self.session.get(status_url, timeout=5)
             
             if response.status_code == 200:
-                self.task_cache[task_id] = True
+                self._mark_task_ready(task_id)
                 return
             
             # 任务不存在，创建它
             create_url = f"{self.tools_server_url}/api/task/create"
             params = {"task_id": task_id, "task_name": f"MLA-V3-{task_id}"}
-            create_response = requests.post(create_url, params=params, timeout=10)
+            create_response = self.session.post(create_url, params=params, timeout=10)
             
             if create_response.status_code == 200:
                 safe_print(f"✅ 任务 '{task_id}' 已在toolServer中创建")
-                self.task_cache[task_id] = True
+                self._mark_task_ready(task_id)
             else:
                 safe_print(f"⚠️ 创建任务失败: {create_response.text}")
         
         except Exception as e:
             safe_print(f"⚠️ 检查/创建任务时出错: {e}")
     
+    def _mark_task_ready(self, task_id: str):
+        """记录任务工作空间已存在（进程内共享）"""
+        self.task_cache[task_id] = True
+        with _transport_lock:
+            _ready_tasks.add((self.tools_server_url, task_id))
+    
     def _request_tool_confirmation(self, tool_name: str, arguments: Dict[str, Any], task_id: str) -> bool:
         """
         请求工具执行确认
@@ -120,7 +215,7 @@ class ToolExecutor:
                 "arguments": arguments
             }
             
-            response = requests.post(create_url, json=create_payload, timeout=5)
+            response = self.session.post(create_url, json=create_payload, timeout=5)
             if response.status_code != 200:
                 safe_print(f"⚠️  创建确认请求失败，默认拒绝执行")
                 return False
@@ -139,7 +234,7 @@ class ToolExecutor:
                 elapsed += check_interval
                 
                 try:
-                    status_response = requests.get(status_url, timeout=5)
+                    status_response = self.session.get(status_url, timeout=5)
                     if status_response.status_code == 200:
                         result = status_response.json()
                         
@@ -245,7 +340,7 @@ class ToolExecutor:
             safe_print(f"   🔗 调用toolServer: {tool_name}")
             
             # 发送请求
-            response = requests.post(
+            response = self.session.post(
                 execute_url,
                 json=payload,
                 headers=headers,
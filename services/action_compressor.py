@@ -7,13 +7,11 @@ from utils.windows_compat import safe_print
 """
 
 import json
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Tuple
 
-try:
-    import tiktoken
-    HAS_TIKTOKEN = True
-except ImportError:
-    HAS_TIKTOKEN = False
+from services.llm_client import run_coroutine
+from utils.token_counter import TokenLedger, count_tokens, get_encoding
 
 
 class ActionCompressor:
@@ -28,20 +26,20 @@ class ActionCompressor:
         """
         self.llm_client = llm_client
         
-        # 初始化tiktoken
-        if HAS_TIKTOKEN:
-            self.encoding = tiktoken.get_encoding("cl100k_base")
-        else:
-            self.encoding = None
+        # 分段压缩的并发度（map阶段同时进行的LLM调用数）和树形归并的扇入（每次合并的段数）
+        config = getattr(llm_client, "config", None) or {}
+        self.max_parallel_chunks = max(1, int(config.get("compressor_fan_out", 4)))
+        self.reduce_fan_in = max(2, int(config.get("compressor_reduce_fan_in", 4)))
+        
+        # 进程内共享的tiktoken编码器
+        self.encoding = get_encoding()
+        
+        # 动作历史token账本：每条action只计数一次，压缩检查不再重新序列化整个历史
+        self.ledger = TokenLedger(lambda action: self._actions_to_xml([action]))
     
     def count_tokens(self, text: str) -> int:
         """统计token数"""
-        if self.encoding:
-            return len(self.encoding.encode(text))
-        else:
-            chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-            other_chars = len(text) - chinese_chars
-            return int(chinese_chars / 1.5 + other_chars / 4)
+        return count_tokens(text)
     
     def compress_if_needed(
         self,
@@ -52,7 +50,22 @@ class ActionCompressor:
         save_callback=None  # 添加保存回调，确保压缩后立即保存
     ) -> List[Dict]:
         """
-        检查并压缩历史动作
+        检查并压缩历史动作（同步入口，内部运行 acompress_if_needed）
+        """
+        return run_coroutine(self.acompress_if_needed(
+            action_history, max_context_window, thinking=thinking, task_input=task_input
+        ))
+    
+    async def acompress_if_needed(
+        self,
+        action_history: List[Dict],
+        max_context_window: int,
+        thinking: str = "",
+        task_input: str = "",
+        save_callback=None  # 添加保存回调，确保压缩后立即保存
+    ) -> List[Dict]:
+        """
+        检查并压缩历史动作（异步）
         
         策略：
         1. 保留最新1条action（完整或压缩大字段）
@@ -74,15 +87,18 @@ class ActionCompressor:
         # 如果只有一条
         if len(action_history) == 1:
             # 检查是否需要压缩字段
-            return [self._compress_action_fields(action_history[0], max_context_window // 2)]
+            return [await self._acompress_action_fields(action_history[0], max_context_window // 2)]
         
         # 分离最新和历史
         recent_action = action_history[-1]
         historical_actions = action_history[:-1]
         
-        # 计算整体token数
-        total_text = self._actions_to_xml(action_history)
-        total_tokens = self.count_tokens(total_text+thinking+task_input)
+        # 计算整体token数（账本增量累计，只对新增action计数）
+        total_tokens = (
+            self.ledger.total(action_history)
+            + self.ledger.count_text("thinking", thinking)
+            + self.ledger.count_text("task_input", task_input)
+        )
         
         # 如果不超限，不压缩
         if total_tokens <= max_context_window - 20000:
@@ -94,21 +110,23 @@ class ActionCompressor:
         # 1. 历史 → 基于 thinking 和 task_input 智能总结为5k tokens
         # 2. 最新 → 压缩为max_window的50%
         
-        summary_action = self._summarize_historical_xml(
-            self._actions_to_xml(historical_actions),
-            target_tokens=5000,  # 历史总结固定5k tokens
-            thinking=thinking,
-            task_input=task_input,
-            max_context_window=max_context_window
-        )
-        
-        # 压缩最新action的大字段（50% of max_window）
-        compressed_recent = self._compress_action_fields(
-            recent_action,
-            int(max_context_window * 0.5),  # 80000 * 0.5 = 40000 tokens
-            thinking=thinking,
-            task_input=task_input,
-            max_context_window=max_context_window
+        # 历史总结与最新action压缩互不依赖，并发执行
+        summary_action, compressed_recent = await asyncio.gather(
+            self._asummarize_historical_xml(
+                self._actions_to_xml(historical_actions),
+                target_tokens=5000,  # 历史总结固定5k tokens
+                thinking=thinking,
+                task_input=task_input,
+                max_context_window=max_context_window
+            ),
+            # 压缩最新action的大字段（50% of max_window）
+            self._acompress_action_fields(
+                recent_action,
+                int(max_context_window * 0.5),  # 80000 * 0.5 = 40000 tokens
+                thinking=thinking,
+                task_input=task_input,
+                max_context_window=max_context_window
+            )
         )
         
         result = [summary_action, compressed_recent]
@@ -143,7 +161,7 @@ class ActionCompressor:
         
         return "\n\n".join(xml_parts)
     
-    def _summarize_historical_xml(
+    async def _asummarize_historical_xml(
         self, 
         xml_text: str, 
         target_tokens: int = 5000,
@@ -190,10 +208,10 @@ class ActionCompressor:
             
             if xml_tokens > available_tokens:
                 safe_print(f"   📦 数据量过大({xml_tokens} tokens)，启用分段压缩")
-                return self._chunked_summarize(xml_text, target_tokens, thinking, task_input, available_tokens)
+                return await self._achunked_summarize(xml_text, target_tokens, thinking, task_input, available_tokens)
             
             # 数据量合适，直接压缩
-            return self._single_summarize(xml_text, target_tokens, thinking, task_input, context_info)
+            return await self._asingle_summarize(xml_text, target_tokens, thinking, task_input, context_info)
         
         except Exception as e:
             safe_print(f"⚠️ 总结失败: {e}")
@@ -205,7 +223,7 @@ class ActionCompressor:
                 "result": {"status": "success", "output": "[历史动作已省略]", "_is_summary": True}
             }
     
-    def _single_summarize(
+    async def _asingle_summarize(
         self,
         xml_text: str,
         target_tokens: int,
@@ -249,7 +267,7 @@ class ActionCompressor:
         
         history = [ChatMessage(role="user", content=prompt)]
         
-        response = self.llm_client.chat(
+        response = await self.llm_client.achat(
             history=history,
             model=self.llm_client.compressor_models[0],
             system_prompt=f"你是整体上下文构造专家。目标：将内容压缩到{target_tokens} tokens以内。",
@@ -269,7 +287,7 @@ class ActionCompressor:
             }
         }
     
-    def _chunked_summarize(
+    async def _achunked_summarize(
         self,
         xml_text: str,
         target_tokens: int,
@@ -279,6 +297,7 @@ class ActionCompressor:
     ) -> Dict:
         """
         分段压缩（数据量过大时使用）
+        map-reduce：各段并发总结，段数较多时再树形归并
         
         Args:
             xml_text: 完整的XML文本
@@ -290,8 +309,6 @@ class ActionCompressor:
         Returns:
             压缩后的summary action
         """
-        from services.llm_client import ChatMessage
-        
         # 按action分割xml_text
         # 简单方法：按 </action> 分割
         action_blocks = xml_text.split('</action>')
@@ -327,13 +344,10 @@ class ActionCompressor:
         if thinking:
             context_info += f"\n<当前进度与计划>\n{thinking}\n</当前进度与计划>\n"
         
-        # 对每个chunk进行压缩
-        chunk_summaries = []
-        target_per_chunk = target_tokens // len(chunks)
-        
+        # map：各段并发压缩（每段目标按最终参与合并的段数分配）
+        target_per_chunk = target_tokens // min(len(chunks), self.reduce_fan_in)
+        jobs = []
         for i, chunk in enumerate(chunks):
-            safe_print(f"      压缩第 {i+1}/{len(chunks)} 段...")
-            
             prompt = f"""你是智能历史信息压缩助手。这是分段压缩任务的第 {i+1}/{len(chunks)} 段。
 
 {context_info}
@@ -356,32 +370,24 @@ class ActionCompressor:
    - 突出重要成果
 
 请直接输出本段的压缩总结（中文）："""
-            
-            history = [ChatMessage(role="user", content=prompt)]
-            
-            try:
-                response = self.llm_client.chat(
-                    history=history,
-                    model=self.llm_client.compressor_models[0],
-                    system_prompt=f"你是内容压缩专家。目标：将本段压缩到{target_per_chunk} tokens以内。",
-                    tool_list=[],  # 空列表表示不使用工具
-                    tool_choice="none"  # 明确表示不调用工具（压缩任务）
-                )
-                
-                if response.status == "success":
-                    chunk_summaries.append(f"[段{i+1}] {response.output}")
-                    safe_print(f"         ✅ 第{i+1}段压缩成功")
-                else:
-                    chunk_summaries.append(f"[段{i+1}] [压缩失败]")
-                    safe_print(f"         ⚠️ 第{i+1}段压缩失败: {response.output}")
-            except Exception as e:
-                chunk_summaries.append(f"[段{i+1}] [压缩异常]")
-                safe_print(f"         ❌ 第{i+1}段压缩异常: {e}")
+            system_prompt = f"你是内容压缩专家。目标：将本段压缩到{target_per_chunk} tokens以内。"
+            jobs.append((prompt, system_prompt, chunk, target_per_chunk))
+        
+        safe_print(f"      并发压缩 {len(chunks)} 段（并发度 {min(len(chunks), self.max_parallel_chunks)}）...")
+        chunk_summaries = [
+            f"[段{i+1}] {summary}"
+            for i, summary in enumerate(await self._acompress_chunks(jobs, "      "))
+        ]
+        
+        # reduce：段数超过扇入时逐层合并
+        chunk_summaries, levels = await self._atree_reduce(
+            chunk_summaries, target_tokens, context_info, "历史动作总结", "      "
+        )
         
         # 合并所有段的总结
         final_summary = "\n\n".join(chunk_summaries)
         
-        safe_print(f"      ✅ 分段压缩完成，共{len(chunks)}段")
+        safe_print(f"      ✅ 分段压缩完成，共{len(chunks)}段，归并{levels}层")
         
         return {
             "tool_name": "_historical_summary",
@@ -395,7 +401,98 @@ class ActionCompressor:
             }
         }
     
-    def _compress_action_fields(
+    async def _acompress_chunks(self, jobs: List[Tuple[str, str, str, int]], indent: str = "") -> List[str]:
+        """
+        并发执行一组压缩调用（map阶段和每层归并共用，并发度 max_parallel_chunks），结果保持输入顺序
+        单段失败时该段使用首尾保留法兜底，不影响其他段
+        
+        Args:
+            jobs: [(prompt, system_prompt, 原文, 目标token数), ...]
+            indent: 日志缩进
+            
+        Returns:
+            与jobs一一对应的压缩结果
+        """
+        from services.llm_client import ChatMessage
+        
+        semaphore = asyncio.Semaphore(self.max_parallel_chunks)
+        
+        async def run(index: int, job: Tuple[str, str, str, int]) -> str:
+            prompt, system_prompt, source, target = job
+            async with semaphore:
+                try:
+                    response = await self.llm_client.achat(
+                        history=[ChatMessage(role="user", content=prompt)],
+                        model=self.llm_client.compressor_models[0],
+                        system_prompt=system_prompt,
+                        tool_list=[],  # 空列表表示不使用工具
+                        tool_choice="none"  # 明确表示不调用工具（压缩任务）
+                    )
+                    if response.status == "success":
+                        safe_print(f"{indent}   ✅ 第{index+1}段压缩成功")
+                        return response.output
+                    safe_print(f"{indent}   ⚠️ 第{index+1}段压缩失败，使用fallback: {response.output}")
+                except Exception as e:
+                    safe_print(f"{indent}   ❌ 第{index+1}段压缩异常，使用fallback: {e}")
+            return self._fallback_compress(source, target)
+        
+        return list(await asyncio.gather(*(run(i, job) for i, job in enumerate(jobs))))
+    
+    async def _atree_reduce(
+        self,
+        parts: List[str],
+        target_tokens: int,
+        context_info: str,
+        content_type: str,
+        indent: str = ""
+    ) -> Tuple[List[str], int]:
+        """
+        树形归并：段数超过 reduce_fan_in 时，每 reduce_fan_in 段合并为一段（同层并发），
+        直到剩余段数不超过扇入。延迟随树深度（log(段数)）增长，而不是随段数增长
+        
+        Args:
+            parts: 按时间顺序排列的分段结果
+            target_tokens: 最终目标token数
+            context_info: 任务需求/进度上下文
+            content_type: 内容类型描述
+            indent: 日志缩进
+            
+        Returns:
+            (归并后的分段结果, 归并层数)
+        """
+        levels = 0
+        fan_in = self.reduce_fan_in
+        while len(parts) > fan_in:
+            levels += 1
+            groups = [parts[i:i + fan_in] for i in range(0, len(parts), fan_in)]
+            target_per_group = target_tokens // min(len(groups), fan_in)
+            safe_print(f"{indent}🌲 第{levels}层归并: {len(parts)} 段 → {len(groups)} 段")
+            
+            jobs = []
+            for i, group in enumerate(groups):
+                merged = "\n\n---\n\n".join(group)
+                prompt = f"""你是智能内容压缩助手。以下是按时间顺序排列的 {len(group)} 段{content_type}（第 {i+1}/{len(groups)} 组），请合并为一段连贯的总结。
+
+{context_info}
+
+<待合并内容>
+{merged}
+</待合并内容>
+
+合并要求：
+1. **目标长度**: 严格控制在 {target_per_group} tokens 以内
+2. **保持顺序**: 按时间顺序组织，去除各段之间的重复信息
+3. **优先保留**: 关键结果、重要数据、文件路径
+4. **格式要求**: 保持连贯性，使用总结而非截断
+
+请直接输出合并后的内容："""
+                system_prompt = f"压缩专家。目标：将多段内容合并压缩到{target_per_group} tokens。"
+                jobs.append((prompt, system_prompt, merged, target_per_group))
+            
+            parts = await self._acompress_chunks(jobs, indent)
+        return parts, levels
+    
+    async def _acompress_action_fields(
         self, 
         action: Dict, 
         max_field_tokens: int,
@@ -427,7 +524,7 @@ class ActionCompressor:
                 
                 if v_tokens > max_field_tokens:
                     safe_print(f"   🤖 LLM压缩arguments.{k}: {v_tokens} tokens → {max_field_tokens} tokens")
-                    compressed_v = self._llm_compress_field(
+                    compressed_v = await self._allm_compress_field(
                         v_str, 
                         max_field_tokens, 
                         action.get("tool_name", "unknown"),
@@ -452,7 +549,7 @@ class ActionCompressor:
                 args_summary = ", ".join([f"{k}={v}" for k, v in compressed_action.get("arguments", {}).items()])
                 field_context = f"工具 '{action.get('tool_name')}' 的执行结果 (参数: {args_summary})"
                 
-                compressed_output = self._llm_compress_field(
+                compressed_output = await self._allm_compress_field(
                     output, 
                     max_field_tokens, 
                     action.get("tool_name", "unknown"),
@@ -467,7 +564,7 @@ class ActionCompressor:
         
         return compressed_action
     
-    def _llm_compress_field(
+    async def _allm_compress_field(
         self, 
         text: str, 
         target_tokens: int, 
@@ -531,7 +628,7 @@ class ActionCompressor:
             # 如果文本过大，使用分段压缩
             if text_tokens > available_tokens:
                 safe_print(f"      📦 字段过大({text_tokens} tokens)，启用分段压缩")
-                return self._chunked_compress_field(
+                return await self._achunked_compress_field(
                     text, target_tokens, tool_name, content_type, focus,
                     thinking, task_input, field_context, available_tokens
                 )
@@ -568,7 +665,7 @@ class ActionCompressor:
             
             history = [ChatMessage(role="user", content=prompt)]
             
-            response = self.llm_client.chat(
+            response = await self.llm_client.achat(
                 history=history,
                 model=self.llm_client.compressor_models[0],
                 system_prompt=f"你是智能内容压缩助手。目标：将{content_type}压缩到{target_tokens} tokens，同时保留核心信息。",
@@ -589,7 +686,7 @@ class ActionCompressor:
             # fallback：首尾保留
             return self._fallback_compress(text, target_tokens)
     
-    def _chunked_compress_field(
+    async def _achunked_compress_field(
         self,
         text: str,
         target_tokens: int,
@@ -602,7 +699,7 @@ class ActionCompressor:
         chunk_size_tokens: int
     ) -> str:
         """
-        分段压缩字段内容
+        分段压缩字段内容（各段并发压缩，段数较多时树形归并）
         
         Args:
             text: 原始文本
@@ -618,8 +715,6 @@ class ActionCompressor:
         Returns:
             压缩后的文本
         """
-        from services.llm_client import ChatMessage
-        
         # 按段落或固定字符数分割文本
         # 简单策略：按\n\n分割段落，如果段落太大则按字符数分割
         paragraphs = text.split('\n\n')
@@ -666,13 +761,10 @@ class ActionCompressor:
         if field_context:
             context_info += f"\n<字段来源>\n这是最新动作中 {field_context} 的内容\n</字段来源>\n"
         
-        # 压缩每个chunk
-        chunk_results = []
-        target_per_chunk = target_tokens // len(chunks)
-        
+        # map：各段并发压缩
+        target_per_chunk = target_tokens // min(len(chunks), self.reduce_fan_in)
+        jobs = []
         for i, chunk in enumerate(chunks):
-            safe_print(f"         压缩字段第 {i+1}/{len(chunks)} 段...")
-            
             prompt = f"""你是智能内容压缩助手。这是分段压缩的第 {i+1}/{len(chunks)} 段{content_type}。
 
 {context_info}
@@ -688,32 +780,21 @@ class ActionCompressor:
 4. **格式要求**: 保持连贯性，使用总结而非截断
 
 请直接输出本段的压缩结果："""
-            
-            history = [ChatMessage(role="user", content=prompt)]
-            
-            try:
-                response = self.llm_client.chat(
-                    history=history,
-                    model=self.llm_client.compressor_models[0],
-                    system_prompt=f"压缩专家。目标：将本段压缩到{target_per_chunk} tokens。",
-                    tool_list=[],  # 空列表表示不使用工具
-                    tool_choice="none"  # 明确表示不调用工具（压缩任务）
-                )
-                
-                if response.status == "success":
-                    chunk_results.append(response.output)
-                    safe_print(f"            ✅ 第{i+1}段压缩成功")
-                else:
-                    chunk_results.append(chunk[:500] + "\n[本段压缩失败]")
-                    safe_print(f"            ⚠️ 第{i+1}段压缩失败")
-            except Exception as e:
-                chunk_results.append(chunk[:500] + "\n[本段压缩异常]")
-                safe_print(f"            ❌ 第{i+1}段压缩异常: {e}")
+            system_prompt = f"压缩专家。目标：将本段压缩到{target_per_chunk} tokens。"
+            jobs.append((prompt, system_prompt, chunk, target_per_chunk))
+        
+        safe_print(f"         并发压缩字段 {len(chunks)} 段（并发度 {min(len(chunks), self.max_parallel_chunks)}）...")
+        chunk_results = await self._acompress_chunks(jobs, "         ")
+        
+        # reduce：段数超过扇入时逐层合并
+        chunk_results, levels = await self._atree_reduce(
+            chunk_results, target_tokens, context_info, content_type, "         "
+        )
         
         # 合并结果
         final_result = '\n\n---\n\n'.join(chunk_results)
         
-        safe_print(f"         ✅ 字段分段压缩完成，共{len(chunks)}段")
+        safe_print(f"         ✅ 字段分段压缩完成，共{len(chunks)}段，归并{levels}层")
         
         return final_result
     
@@ -8,13 +8,37 @@ from utils.windows_compat import safe_print
 import os
 import yaml
 import time
+import asyncio
 import json
+import queue
+import threading
 import concurrent.futures
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 from pathlib import Path
 from litellm import completion  # 直接导入completion函数
 import litellm
+from utils.token_counter import count_tokens
+
+
+# 流式读取线程池（进程级，长期复用）：后台线程建立连接并读取数据块，
+# 调用方按首包/块间隔超时等待，超时后直接放弃，不再等待卡住的worker；
+# 连接建立受 LiteLLM timeout（不超过首包超时）限制，卡住的worker会自行退出，不会长期占满线程池
+_STREAM_WORKERS = 32
+_stream_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_stream_executor_lock = threading.Lock()
+
+
+def _get_stream_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """获取进程级流式读取线程池（首次使用时创建）"""
+    global _stream_executor
+    if _stream_executor is None:
+        with _stream_executor_lock:
+            if _stream_executor is None:
+                _stream_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=_STREAM_WORKERS, thread_name_prefix="llm-stream"
+                )
+    return _stream_executor
 
 
 @dataclass
@@ -42,6 +66,92 @@ class LLMResponse:
     finish_reason: str
     usage: Optional[Dict] = None
     error_information: str = ""
+    metrics: Optional[Dict] = None  # 连接耗时、首token延迟、生成速度等
+
+
+class _StreamAccumulator:
+    """流式响应累积器（同步/异步调用共用）：文本、工具调用增量、usage和首token时间"""
+    
+    def __init__(self, model: str):
+        self.model = model
+        self.content = ""
+        self.tool_calls = {}  # index -> {id, name, arguments}
+        self.finish_reason = "unknown"
+        self.usage = None
+        self.chunk_count = 0
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.metrics = {"connect_time": None, "ttft": None}
+    
+    def add(self, chunk):
+        """累积一个数据块"""
+        self.chunk_count += 1
+        if self.chunk_count == 1:
+            safe_print(f"   ⚡️ 首包延迟: {time.time() - self.start_time:.2f}s")
+        # 全量打印 chunk（方便观察断联和增量内容，可能较噪声）
+        # try:
+        #     safe_print(f"\n[chunk #{self.chunk_count}] {chunk}", flush=True)
+        # except Exception:
+        #     pass
+        
+        # 提取模型信息
+        if hasattr(chunk, 'model') and chunk.model:
+            self.model = chunk.model
+        
+        # usage 通常在最后一个（choices为空的）数据块中
+        if getattr(chunk, 'usage', None):
+            self.usage = chunk.usage
+        
+        if not chunk.choices:
+            return
+        
+        delta = chunk.choices[0].delta
+        
+        # A. 累积文本内容
+        if hasattr(delta, 'content') and delta.content:
+            if self.first_token_time is None:
+                self.first_token_time = time.time()
+            self.content += delta.content
+            # 直接流式打印模型文本片段，便于无 CLI 时观察进度
+            try:
+                safe_print(delta.content, end="", flush=True)
+            except Exception:
+                pass
+        
+        # B. 累积工具调用
+        if hasattr(delta, 'tool_calls') and delta.tool_calls:
+            if self.first_token_time is None:
+                self.first_token_time = time.time()
+            for tc in delta.tool_calls:
+                idx = tc.index
+                if idx not in self.tool_calls:
+                    self.tool_calls[idx] = {"id": "", "name": "", "arguments": ""}
+                
+                if tc.id:
+                    self.tool_calls[idx]["id"] = tc.id
+                if tc.function and tc.function.name:
+                    self.tool_calls[idx]["name"] += tc.function.name
+                if tc.function and tc.function.arguments:
+                    self.tool_calls[idx]["arguments"] += tc.function.arguments
+        
+        # C. 记录结束原因
+        if chunk.choices[0].finish_reason:
+            self.finish_reason = chunk.choices[0].finish_reason
+
+
+def run_coroutine(coro):
+    """
+    在同步代码中运行协程
+    
+    当前线程没有运行中的事件循环时直接 asyncio.run；
+    已在事件循环中（例如被异步代码间接调用）时放到独立线程执行，避免嵌套事件循环
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
 
 
 class SimpleLLMClient:
@@ -77,6 +187,22 @@ class SimpleLLMClient:
         self.timeout = self.config.get("timeout", 600)  # LiteLLM 原生：总超时
         self.stream_timeout = self.config.get("stream_timeout", 20)  # LiteLLM 原生：流式超时
         self.first_chunk_timeout = self.config.get("first_chunk_timeout", 20)  # 应用层强制：首包超时
+        self.chunk_timeout = self.config.get("chunk_timeout", self.stream_timeout)  # 应用层强制：数据块间隔超时
+        self.last_call_metrics: Optional[Dict] = None
+        
+        # 提示词缓存：在稳定前缀末尾标记 cache_control（默认关闭，模型配置中的 prompt_cache 可单独覆盖）
+        # 并非所有服务商/代理都接受 content 分块和 cache_control，需按服务商显式开启
+        self.prompt_cache = self.config.get("prompt_cache", False)
+        # 流式响应末尾返回usage（用于统计缓存命中的输入token，默认关闭：部分兼容接口不支持 stream_options）
+        self.stream_usage = self.config.get("stream_usage", False)
+        self._usage_lock = threading.Lock()
+        self._usage_stats = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "cache_write_tokens": 0,
+            "completion_tokens": 0,
+        }
         
         # 解析模型配置（支持两种格式）
         self.models = []  # 模型名称列表
@@ -112,7 +238,7 @@ class SimpleLLMClient:
         safe_print(f"   Compressor模型: {len(self.compressor_models)} 个")
         safe_print(f"   默认Temperature: {self.temperature}")
         safe_print(f"   默认Max Tokens: {self.max_tokens}")
-        safe_print(f"   超时配置: timeout={self.timeout}s, stream_timeout={self.stream_timeout}s, first_chunk_timeout={self.first_chunk_timeout}s")
+        safe_print(f"   超时配置: timeout={self.timeout}s, stream_timeout={self.stream_timeout}s, first_chunk_timeout={self.first_chunk_timeout}s, chunk_timeout={self.chunk_timeout}s")
     
     def _parse_models_config(self, models_config: List, target_list: List):
         """
@@ -155,7 +281,9 @@ class SimpleLLMClient:
         tool_choice: str = "required",
         temperature: float = None,
         max_tokens: int = None,
-        max_retries: int = 3
+        max_retries: int = 3,
+        cache_breakpoints: List[int] = None,
+        parallel_tool_calls: bool = False
     ) -> LLMResponse:
         """
         调用LLM进行对话 (增强版：支持流式监控、自动重试、参数修复)
@@ -169,6 +297,8 @@ class SimpleLLMClient:
             temperature: 温度参数（None则使用配置文件默认值）
             max_tokens: 最大token数（None则使用配置文件默认值）
             max_retries: 最大重试次数（默认3次，即总共最多4次尝试）
+            cache_breakpoints: system_prompt中稳定前缀的结束位置（字符偏移），用于标记提示词缓存断点
+            parallel_tool_calls: 是否允许模型在一次响应中返回多个工具调用（Agent 的 max_parallel_tools > 1 时开启）
             
         Returns:
             LLMResponse对象
@@ -199,7 +329,7 @@ class SimpleLLMClient:
             # 调用内部实现
             response = self._chat_internal(
                 history, model, fixed_system_prompt, tool_list, 
-                tool_choice, temperature, max_tokens
+                tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
             )
             
             # 如果成功，直接返回
@@ -223,7 +353,7 @@ class SimpleLLMClient:
                     # 立即重试，不计入retry_count
                     response = self._chat_internal(
                         history, model, fixed_system_prompt, tool_list, 
-                        tool_choice, temperature, max_tokens
+                        tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
                     )
                     
                     if response.status == "success":
@@ -252,6 +382,103 @@ class SimpleLLMClient:
         safe_print(f"   ❌ LLM调用失败（已重试{max_retries + 1}次）")
         return last_error
     
+    async def achat(
+        self,
+        history: List[ChatMessage],
+        model: str,
+        system_prompt: str,
+        tool_list: List[str],
+        tool_choice: str = "required",
+        temperature: float = None,
+        max_tokens: int = None,
+        max_retries: int = 3,
+        cache_breakpoints: List[int] = None,
+        parallel_tool_calls: bool = False
+    ) -> LLMResponse:
+        """
+        chat 的异步版本（基于 litellm.acompletion）
+        
+        重试、参数类型修复提示与 chat 完全一致；多个调用可以在同一个事件循环中并发
+        （如历史压缩、thinking、上下文压缩），不占用线程
+        
+        Args:
+            与 chat 相同
+            
+        Returns:
+            LLMResponse对象
+        """
+        # 使用配置文件的默认值
+        if temperature is None:
+            temperature = self.temperature
+        if max_tokens is None:
+            max_tokens = self.max_tokens
+        
+        # 重试循环
+        last_error = None
+        fixed_system_prompt = system_prompt  # 可能会被修复的 system prompt
+        type_fix_attempted = False  # 是否已尝试类型修复
+        
+        for retry_count in range(max_retries + 1):
+            if retry_count > 0:
+                safe_print(f"   🔄 LLM重试 {retry_count}/{max_retries}...")
+                await asyncio.sleep(2 * retry_count)  # 指数退避：2秒, 4秒, 6秒
+                
+                # 根据上次错误生成提示（帮助 LLM 避免重复错误）
+                if last_error:
+                    retry_hint = self._generate_retry_hint(last_error.error_information, retry_count)
+                    if retry_hint:
+                        fixed_system_prompt = system_prompt + "\n\n" + retry_hint
+                        safe_print(f"   📝 添加错误提醒: {retry_hint[:80]}...")
+            
+            response = await self._achat_internal(
+                history, model, fixed_system_prompt, tool_list, 
+                tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
+            )
+            
+            if response.status == "success":
+                if retry_count > 0 or type_fix_attempted:
+                    safe_print(f"   ✅ 重试成功 (第{retry_count + 1}次尝试)")
+                return response
+            
+            # 检查是否是工具参数类型错误（优先处理，不消耗重试次数）
+            if not type_fix_attempted and ("did not match schema" in response.error_information or "expected array, but got string" in response.error_information):
+                safe_print(f"   🔧 检测到工具参数类型错误，尝试自动修复...")
+                
+                fix_hint = self._generate_type_fix_hint(response.error_information)
+                if fix_hint:
+                    fixed_system_prompt = system_prompt + "\n\n" + fix_hint
+                    safe_print(f"   📝 已添加参数类型提示，立即重试...")
+                    type_fix_attempted = True
+                    last_error = response
+                    
+                    # 立即重试，不计入retry_count
+                    response = await self._achat_internal(
+                        history, model, fixed_system_prompt, tool_list, 
+                        tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
+                    )
+                    
+                    if response.status == "success":
+                        safe_print(f"   ✅ 参数类型修复成功！")
+                        return response
+                    else:
+                        safe_print(f"   ⚠️ 修复后仍失败，继续常规重试...")
+                        last_error = response
+                        continue
+            
+            error_type = self._get_error_type(response.error_information)
+            safe_print(f"   ⚠️ {error_type} (第{retry_count + 1}次)")
+            last_error = response
+            
+            if retry_count < max_retries:
+                continue
+            else:
+                safe_print(f"   ❌ 已达到最大重试次数 ({max_retries + 1})")
+                error_msg = f"LLM 调用失败（已重试 {max_retries + 1} 次）: {response.error_information}"
+                raise Exception(error_msg)
+        
+        safe_print(f"   ❌ LLM调用失败（已重试{max_retries + 1}次）")
+        return last_error
+    
     def _chat_internal(
         self,
         history: List[ChatMessage],
@@ -260,275 +487,503 @@ class SimpleLLMClient:
         tool_list: List[str],
         tool_choice: str,
         temperature: float,
-        max_tokens: int
+        max_tokens: int,
+        cache_breakpoints: List[int] = None,
+        parallel_tool_calls: bool = False
     ) -> LLMResponse:
         """
         LLM调用的内部实现（使用 LiteLLM 原生超时机制）
         """
         try:
-            # 构建工具定义（OpenAI格式）
-            tools_definition = self._build_tools_definition(tool_list)
-            
-            # 转换消息格式
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend([{"role": msg.role, "content": msg.content} for msg in history])
-            
-            # 构建请求参数
-            kwargs = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-                "api_key": self.api_key,
-                "stream": True,  # 启用流式模式
-                # --- LiteLLM 原生超时设定（从配置文件读取）---
-                "timeout": self.timeout,              # 建立连接及整体响应的最大等待时间（秒）
-                "stream_timeout": self.stream_timeout,  # 两个流式数据块（chunk）之间的最大间隔时间（秒）
-            }
-            
-            # 只在 base_url 非空时添加 api_base
-            if self.base_url:
-                kwargs["api_base"] = self.base_url
-            
-            # 只在max_tokens > 0时添加
-            if max_tokens > 0:
-                kwargs["max_tokens"] = max_tokens
-            
-            # 添加工具定义（只有当工具列表非空时才添加工具相关参数）
-            if tools_definition:
-                # 工具列表非空：正常添加工具参数
-                kwargs["tools"] = tools_definition
-                if tool_choice == "required":
-                    kwargs["tool_choice"] = "required"
-                kwargs["parallel_tool_calls"] = False
-            # 注意：当 tools_definition 为空时，即使 tool_choice="none" 也不添加任何参数
-            # 这避免了 API 错误：When using `tool_choice`, `tools` must be set
-            
-            # 添加模型特定的额外参数
-            model_extra_params = self.model_configs.get(model, {})
-            if model_extra_params:
-                if "provider" in model_extra_params:
-                    if "extra_body" not in kwargs:
-                        kwargs["extra_body"] = {}
-                    kwargs["extra_body"]["provider"] = model_extra_params["provider"]
-                
-                if "extra_headers" in model_extra_params:
-                    kwargs["extra_headers"] = model_extra_params["extra_headers"]
-                
-                if "extra_body" in model_extra_params:
-                    if "extra_body" not in kwargs:
-                        kwargs["extra_body"] = {}
-                    kwargs["extra_body"].update(model_extra_params["extra_body"])
-            
-            # 发起流式请求（LiteLLM 会根据 timeout 和 stream_timeout 自动管理超时）
-            safe_print(f"   🌊 正在调用LLM (timeout={kwargs['timeout']}s, stream_timeout={kwargs['stream_timeout']}s)...")
-            safe_print(f"   📨 请求模型: {model}")
-            safe_print(f"   🛠️ 工具数量: {len(tools_definition)}")
-            safe_print(f"   📝 消息数: {len(messages)}")
-            request_start_time = time.time()
-            
-            # 累积变量
-            accumulated_content = ""
-            accumulated_tool_calls = {}  # index -> {id, name, arguments}
-            finish_reason = "unknown"
-            response_model = model
-            
-            chunk_count = 0
-            
-            # --- 强制首包超时检测（包含 completion 调用以防止连接池死锁）---
+            kwargs = self._build_request(
+                history, model, system_prompt, tool_list,
+                tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
+            )
+            stream = _StreamAccumulator(model)
+            
+            # 流式读取由看门狗驱动：首包（含连接建立）和块间隔超时都在调用方强制执行，
+            # 超时立即放弃该请求并关闭连接，不会被卡住的连接阻塞
+            for chunk in self._watched_stream(kwargs, stream.metrics):
+                stream.add(chunk)
+            
+            return self._finish_response(stream, model)
+        
+        except Exception as e:
+            return self._error_response(e, model)
+    
+    async def _achat_internal(
+        self,
+        history: List[ChatMessage],
+        model: str,
+        system_prompt: str,
+        tool_list: List[str],
+        tool_choice: str,
+        temperature: float,
+        max_tokens: int,
+        cache_breakpoints: List[int] = None,
+        parallel_tool_calls: bool = False
+    ) -> LLMResponse:
+        """
+        LLM调用的异步实现（litellm.acompletion）
+        
+        首包（含连接建立）和块间隔超时用 asyncio.wait_for 强制，超时即取消读取并关闭流
+        """
+        response_iterator = None
+        try:
+            kwargs = self._build_request(
+                history, model, system_prompt, tool_list,
+                tool_choice, temperature, max_tokens, cache_breakpoints, parallel_tool_calls
+            )
+            stream = _StreamAccumulator(model)
+            
+            opened = {}
+            
+            async def open_stream():
+                response = await litellm.acompletion(**kwargs)
+                opened["response"] = response
+                stream.metrics["connect_time"] = round(time.time() - stream.start_time, 3)
+                return response, await response.__anext__()
+            
             try:
-                # 定义完整的初始化和首包获取函数（防止 httpx 连接池锁死锁）
-                def get_response_and_first_chunk():
-                    iterator = completion(**kwargs)
-                    first = next(iterator)
-                    return iterator, first
-                
-                # 强制首包超时时间（秒），包含连接建立+首包接收，防止 httpx 连接池死锁
-                first_chunk_timeout = self.first_chunk_timeout  # 从配置文件读取
-                
-                with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(get_response_and_first_chunk)
-                    try:
-                        # 强制等待整个初始化过程（包括 completion 调用）
-                        response_iterator, first_chunk = future.result(timeout=first_chunk_timeout)
-                        
-                        # 处理首包
-                        chunk_count += 1
-                        latency = time.time() - request_start_time
-                        safe_print(f"   ⚡️ 首包延迟: {latency:.2f}s")
-                        
-                        # 处理首包逻辑
-                        if hasattr(first_chunk, 'model'):
-                            response_model = first_chunk.model
-                        
-                        # 打印首包
-                        # try:
-                        #     safe_print(f"\n[chunk #1] {first_chunk}", flush=True)
-                        # except Exception:
-                        #     pass
-
-                        if first_chunk.choices:
-                            delta = first_chunk.choices[0].delta
-                            if hasattr(delta, 'content') and delta.content:
-                                accumulated_content += delta.content
-                                # try:
-                                #     safe_print(delta.content, end="", flush=True)
-                                # except Exception:
-                                #     pass
-                            
-                            if hasattr(delta, 'tool_calls') and delta.tool_calls:
-                                for tc in delta.tool_calls:
-                                    idx = tc.index
-                                    if idx not in accumulated_tool_calls:
-                                        accumulated_tool_calls[idx] = {"id": "", "name": "", "arguments": ""}
-                                    if tc.id:
-                                        accumulated_tool_calls[idx]["id"] = tc.id
-                                    if tc.function and tc.function.name:
-                                        accumulated_tool_calls[idx]["name"] += tc.function.name
-                                    if tc.function and tc.function.arguments:
-                                        accumulated_tool_calls[idx]["arguments"] += tc.function.arguments
-                                    
-                                    # try:
-                                    #     tc_args_preview = tc.function.arguments[:200] if tc.function and tc.function.arguments else ""
-                                    #     safe_print(f"\n[tool_call #{idx}] {tc.function.name}: {tc_args_preview}", flush=True)
-                                    # except Exception:
-                                    #     pass
-                                        
-                            if first_chunk.choices[0].finish_reason:
-                                finish_reason = first_chunk.choices[0].finish_reason
-
-                    except concurrent.futures.TimeoutError:
-                        raise TimeoutError(f"连接建立或首包接收超时（超过 {first_chunk_timeout}s）- 可能原因：httpx连接池死锁、网络断开、服务器无响应")
-            
-            except StopIteration:
-                safe_print("   ⚠️ 响应为空（无数据块）")
-                return LLMResponse(
-                    status="error",
-                    output="",
-                    tool_calls=[],
-                    model=model,
-                    finish_reason="empty",
-                    error_information="Empty response - no chunks received"
+                response_iterator, first_chunk = await asyncio.wait_for(
+                    open_stream(), timeout=self.first_chunk_timeout
                 )
+            except StopAsyncIteration:
+                response_iterator = opened["response"]
+                first_chunk = None
+            except asyncio.TimeoutError:
+                # 连接已建立但首包超时：关闭已打开的流
+                response_iterator = opened.get("response")
+                raise TimeoutError(f"连接建立或首包接收超时（超过 {self.first_chunk_timeout}s）- 可能原因：httpx连接池死锁、网络断开、服务器无响应")
             
-            # --- 继续处理剩余 chunk ---
-            # 直接迭代流式响应（LiteLLM 会自动处理后续的 stream_timeout）
-            for chunk in response_iterator:
-                chunk_count += 1
-                # 全量打印 chunk（方便观察断联和增量内容，可能较噪声）
-                # try:
-                #     safe_print(f"\n[chunk #{chunk_count}] {chunk}", flush=True)
-                # except Exception:
-                #     pass
-                
-                # 提取模型信息
-                if hasattr(chunk, 'model'):
-                    response_model = chunk.model
-                
-                if not chunk.choices:
-                    continue
-                    
-                delta = chunk.choices[0].delta
-                
-                # A. 累积文本内容
-                if hasattr(delta, 'content') and delta.content:
-                    accumulated_content += delta.content
-                    # 直接流式打印模型文本片段，便于无 CLI 时观察进度
+            if first_chunk is not None:
+                stream.add(first_chunk)
+                while True:
                     try:
-                        safe_print(delta.content, end="", flush=True)
-                    except Exception:
-                        pass
-                
-                # B. 累积工具调用
-                if hasattr(delta, 'tool_calls') and delta.tool_calls:
-                    for tc in delta.tool_calls:
-                        idx = tc.index
-                        if idx not in accumulated_tool_calls:
-                            accumulated_tool_calls[idx] = {"id": "", "name": "", "arguments": ""}
-                        
-                        if tc.id:
-                            accumulated_tool_calls[idx]["id"] = tc.id
-                        if tc.function and tc.function.name:
-                            accumulated_tool_calls[idx]["name"] += tc.function.name
-                        if tc.function and tc.function.arguments:
-                            accumulated_tool_calls[idx]["arguments"] += tc.function.arguments
-                        
-                        # 工具调用流式打印：名称与参数增量，便于无 CLI 时跟踪
-                        # try:
-                        #     tc_args_preview = tc.function.arguments[:200] if tc.function and tc.function.arguments else ""
-                        #     safe_print(f"\n[tool_call #{idx}] {tc.function.name}: {tc_args_preview}", flush=True)
-                        # except Exception:
-                        #     pass
-                
-                # C. 记录结束原因
-                if chunk.choices[0].finish_reason:
-                    finish_reason = chunk.choices[0].finish_reason
-            
-            safe_print(f"   ✅ 流式响应完成，共接收 {chunk_count} 个数据块")
+                        chunk = await asyncio.wait_for(response_iterator.__anext__(), timeout=self.chunk_timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"流式数据块间隔超时（超过 {self.chunk_timeout}s 未收到新数据块，已接收 {stream.chunk_count} 个）")
+                    stream.add(chunk)
             
-            # 构建最终的 ToolCall 对象列表
-            final_tool_calls = []
-            for idx in sorted(accumulated_tool_calls.keys()):
-                tc_data = accumulated_tool_calls[idx]
-                
-                try:
-                    args_str = tc_data["arguments"]
-                    if not args_str:
-                        args = {}
-                    else:
-                        args = json.loads(args_str)
-                except json.JSONDecodeError as e:
-                    safe_print(f"\n⚠️ 工具参数JSON解析失败: {str(e)}")
-                    safe_print(f"   原始参数: {tc_data['arguments'][:200]}...")
-                    
-                    # 尝试修复常见的 JSON 错误
-                    args = self._try_fix_json(tc_data["arguments"])
-                    if args:
-                        safe_print(f"   ✅ JSON 自动修复成功")
-                    else:
-                        safe_print(f"   ❌ JSON 修复失败，使用空参数")
-                        args = {}
-                
-                final_tool_calls.append(ToolCall(
-                    id=tc_data["id"] or f"call_{idx}",
-                    name=tc_data["name"],
-                    arguments=args
-                ))
-            
-            return LLMResponse(
-                status="success",
-                output=accumulated_content,
-                tool_calls=final_tool_calls,
-                model=response_model,
-                finish_reason=finish_reason
-            )
+            return self._finish_response(stream, model)
         
         except Exception as e:
-            # 捕获所有异常，包括 LiteLLM 抛出的超时异常
-            error_msg = str(e)
-            is_timeout = any(keyword in error_msg.lower() for keyword in ["timeout", "timed out", "time out"])
-            
-            if is_timeout:
-                safe_print(f"⏱️  LLM调用超时 (原生超时机制)")
-                safe_print(f"   超时详情: {error_msg}")
-                safe_print(f"   💡 提示: 如果频繁超时，可能是：")
-                safe_print(f"      1. 网络连接不稳定")
-                safe_print(f"      2. 上下文过长导致 API 响应缓慢")
-                safe_print(f"      3. API 服务商限流或过载")
-            else:
-                safe_print(f"❌ LLM调用异常: {error_msg}")
+            if response_iterator is not None:
+                await self._aclose_stream(response_iterator)
+            return self._error_response(e, model)
+    
+    def _build_request(
+        self,
+        history: List[ChatMessage],
+        model: str,
+        system_prompt: str,
+        tool_list: List[str],
+        tool_choice: str,
+        temperature: float,
+        max_tokens: int,
+        cache_breakpoints: List[int] = None,
+        parallel_tool_calls: bool = False
+    ) -> Dict:
+        """构建 completion/acompletion 的请求参数（同步和异步调用共用）"""
+        # 构建工具定义（OpenAI格式）
+        tools_definition = self._build_tools_definition(tool_list)
+        
+        # 转换消息格式
+        messages = [self._build_system_message(system_prompt, model, cache_breakpoints)]
+        messages.extend([{"role": msg.role, "content": msg.content} for msg in history])
+        
+        # 构建请求参数
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "api_key": self.api_key,
+            "stream": True,  # 启用流式模式
+            # --- LiteLLM 原生超时设定（从配置文件读取）---
+            # 不超过首包超时：调用方放弃后，卡在建立连接上的worker也会在此时间内退出
+            "timeout": min(self.timeout, self.first_chunk_timeout),  # 建立连接及整体响应的最大等待时间（秒）
+            "stream_timeout": self.stream_timeout,  # 两个流式数据块（chunk）之间的最大间隔时间（秒）
+        }
+        
+        # 流式响应末尾附带usage（含缓存命中token数）
+        if self.stream_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        
+        # 只在 base_url 非空时添加 api_base
+        if self.base_url:
+            kwargs["api_base"] = self.base_url
+        
+        # 只在max_tokens > 0时添加
+        if max_tokens > 0:
+            kwargs["max_tokens"] = max_tokens
+        
+        # 添加工具定义（只有当工具列表非空时才添加工具相关参数）
+        if tools_definition:
+            # 工具列表非空：正常添加工具参数
+            kwargs["tools"] = tools_definition
+            if tool_choice == "required":
+                kwargs["tool_choice"] = "required"
+            kwargs["parallel_tool_calls"] = bool(parallel_tool_calls)
+        # 注意：当 tools_definition 为空时，即使 tool_choice="none" 也不添加任何参数
+        # 这避免了 API 错误：When using `tool_choice`, `tools` must be set
+        
+        # 添加模型特定的额外参数
+        model_extra_params = self.model_configs.get(model, {})
+        if model_extra_params:
+            if "provider" in model_extra_params:
+                if "extra_body" not in kwargs:
+                    kwargs["extra_body"] = {}
+                kwargs["extra_body"]["provider"] = model_extra_params["provider"]
             
-            # 返回包含详细错误信息的响应
-            import traceback
-            error_detail = traceback.format_exc()
+            if "extra_headers" in model_extra_params:
+                kwargs["extra_headers"] = model_extra_params["extra_headers"]
             
+            if "extra_body" in model_extra_params:
+                if "extra_body" not in kwargs:
+                    kwargs["extra_body"] = {}
+                kwargs["extra_body"].update(model_extra_params["extra_body"])
+        
+        # 发起流式请求（LiteLLM 管理 timeout/stream_timeout，看门狗另外强制首包和块间隔超时）
+        safe_print(f"   🌊 正在调用LLM (timeout={kwargs['timeout']}s, stream_timeout={kwargs['stream_timeout']}s)...")
+        safe_print(f"   📨 请求模型: {model}")
+        safe_print(f"   🛠️ 工具数量: {len(tools_definition)}")
+        safe_print(f"   📝 消息数: {len(messages)}")
+        return kwargs
+    
+    def _finish_response(self, stream: "_StreamAccumulator", model: str) -> LLMResponse:
+        """流式接收完成后构建 LLMResponse（解析工具参数、记录usage和调用指标）"""
+        if stream.chunk_count == 0:
+            safe_print("   ⚠️ 响应为空（无数据块）")
             return LLMResponse(
                 status="error",
                 output="",
                 tool_calls=[],
                 model=model,
-                finish_reason="timeout" if is_timeout else "error",
-                error_information=f"{error_msg}\n\nDetails:\n{error_detail}"
+                finish_reason="empty",
+                error_information="Empty response - no chunks received"
             )
+        
+        safe_print(f"   ✅ 流式响应完成，共接收 {stream.chunk_count} 个数据块")
+        
+        # 构建最终的 ToolCall 对象列表
+        final_tool_calls = []
+        for idx in sorted(stream.tool_calls.keys()):
+            tc_data = stream.tool_calls[idx]
+            
+            try:
+                args_str = tc_data["arguments"]
+                if not args_str:
+                    args = {}
+                else:
+                    args = json.loads(args_str)
+            except json.JSONDecodeError as e:
+                safe_print(f"\n⚠️ 工具参数JSON解析失败: {str(e)}")
+                safe_print(f"   原始参数: {tc_data['arguments'][:200]}...")
+                
+                # 尝试修复常见的 JSON 错误
+                args = self._try_fix_json(tc_data["arguments"])
+                if args:
+                    safe_print(f"   ✅ JSON 自动修复成功")
+                else:
+                    safe_print(f"   ❌ JSON 修复失败，使用空参数")
+                    args = {}
+            
+            final_tool_calls.append(ToolCall(
+                id=tc_data["id"] or f"call_{idx}",
+                name=tc_data["name"],
+                arguments=args
+            ))
+        
+        usage_info = self._record_usage(stream.usage)
+        metrics = self._finish_call_metrics(
+            stream.metrics, stream.start_time, stream.first_token_time, stream.chunk_count, usage_info,
+            stream.content + "".join(tc["arguments"] for tc in stream.tool_calls.values())
+        )
+        
+        return LLMResponse(
+            status="success",
+            output=stream.content,
+            tool_calls=final_tool_calls,
+            model=stream.model,
+            finish_reason=stream.finish_reason,
+            usage=usage_info,
+            metrics=metrics
+        )
+    
+    def _error_response(self, e: Exception, model: str) -> LLMResponse:
+        """将调用异常（包括 LiteLLM 抛出的超时异常）转换为错误响应"""
+        error_msg = str(e)
+        is_timeout = isinstance(e, TimeoutError) or any(keyword in error_msg.lower() for keyword in ["timeout", "timed out", "time out"])
+        
+        if is_timeout:
+            safe_print(f"⏱️  LLM调用超时 (原生超时机制)")
+            safe_print(f"   超时详情: {error_msg}")
+            safe_print(f"   💡 提示: 如果频繁超时，可能是：")
+            safe_print(f"      1. 网络连接不稳定")
+            safe_print(f"      2. 上下文过长导致 API 响应缓慢")
+            safe_print(f"      3. API 服务商限流或过载")
+        else:
+            safe_print(f"❌ LLM调用异常: {error_msg}")
+        
+        # 返回包含详细错误信息的响应
+        import traceback
+        error_detail = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+        
+        return LLMResponse(
+            status="error",
+            output="",
+            tool_calls=[],
+            model=model,
+            finish_reason="timeout" if is_timeout else "error",
+            error_information=f"{error_msg}\n\nDetails:\n{error_detail}"
+        )
+    
+    def _watched_stream(self, kwargs: Dict, metrics: Dict):
+        """
+        带看门狗的流式读取
+        
+        completion() 和数据块读取在进程级线程池中进行，数据块经队列交给调用方；
+        在线程池中排队最多等待 timeout 秒；调用方等待首个数据块最多 first_chunk_timeout 秒
+        （包含连接建立，从worker开始执行时计时，不计线程池排队时间），之后每个数据块最多等待
+        chunk_timeout 秒。超时后标记取消并关闭底层连接，立即抛出 TimeoutError
+        
+        Args:
+            kwargs: completion 参数
+            metrics: 调用指标（写入 connect_time）
+            
+        Yields:
+            流式数据块
+        """
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        holder = {}
+        start_time = None
+        
+        def pump():
+            # 排队超时后调用方已放弃：不再发起请求
+            if cancelled.is_set():
+                return
+            chunks.put(("started", time.time()))
+            try:
+                iterator = completion(**kwargs)
+                holder["iterator"] = iterator
+                chunks.put(("connected", time.time()))
+                for chunk in iterator:
+                    if cancelled.is_set():
+                        break
+                    chunks.put(("chunk", chunk))
+                chunks.put(("end", None))
+            except Exception as e:
+                chunks.put(("error", e))
+            finally:
+                # 调用方已放弃：worker醒来后释放连接
+                if cancelled.is_set() and "iterator" in holder:
+                    self._close_stream(holder["iterator"])
+        
+        _get_stream_executor().submit(pump)
+        submit_time = time.time()
+        
+        received = 0
+        try:
+            while True:
+                if start_time is None:
+                    # 等待worker开始执行（线程池被占满时最多排队 timeout 秒）
+                    wait = max(0.0, self.timeout - (time.time() - submit_time))
+                elif received == 0:
+                    wait = max(0.0, self.first_chunk_timeout - (time.time() - start_time))
+                else:
+                    wait = self.chunk_timeout
+                try:
+                    kind, payload = chunks.get(timeout=wait)
+                except queue.Empty:
+                    cancelled.set()
+                    if "iterator" in holder:
+                        self._close_stream(holder["iterator"])
+                    if start_time is None:
+                        raise TimeoutError(f"流式请求排队超时（超过 {self.timeout}s 未开始执行）- 可能原因：流式线程池已被占满")
+                    if received == 0:
+                        raise TimeoutError(f"连接建立或首包接收超时（超过 {self.first_chunk_timeout}s）- 可能原因：httpx连接池死锁、网络断开、服务器无响应")
+                    raise TimeoutError(f"流式数据块间隔超时（超过 {self.chunk_timeout}s 未收到新数据块，已接收 {received} 个）")
+                
+                if kind == "started":
+                    start_time = payload
+                elif kind == "connected":
+                    metrics["connect_time"] = round(payload - start_time, 3)
+                elif kind == "chunk":
+                    received += 1
+                    yield payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    return
+        finally:
+            cancelled.set()
+    
+    @staticmethod
+    def _close_stream(iterator):
+        """尽力关闭流式响应的底层连接（使阻塞在读取上的worker尽快退出）"""
+        for target in (getattr(iterator, "completion_stream", None), iterator):
+            close = getattr(target, "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+    
+    @staticmethod
+    async def _aclose_stream(iterator):
+        """尽力关闭异步流式响应的底层连接"""
+        for target in (getattr(iterator, "completion_stream", None), iterator):
+            close = getattr(target, "aclose", None) or getattr(target, "close", None)
+            if callable(close):
+                try:
+                    result = close()
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    pass
+    
+    def _finish_call_metrics(
+        self,
+        metrics: Dict,
+        request_start_time: float,
+        first_token_time: Optional[float],
+        chunk_count: int,
+        usage_info: Optional[Dict],
+        generated_text: str
+    ) -> Dict:
+        """
+        汇总单次调用指标：连接耗时、首token延迟（TTFT）、生成速度
+        
+        Returns:
+            {"connect_time", "ttft", "total_time", "chunks", "completion_tokens", "tokens_per_sec"}
+        """
+        end_time = time.time()
+        completion_tokens = (usage_info or {}).get("completion_tokens") or count_tokens(generated_text)
+        generation_time = end_time - first_token_time if first_token_time else 0.0
+        
+        metrics.update({
+            "ttft": round(first_token_time - request_start_time, 3) if first_token_time else None,
+            "total_time": round(end_time - request_start_time, 3),
+            "chunks": chunk_count,
+            "completion_tokens": completion_tokens,
+            "tokens_per_sec": round(completion_tokens / generation_time, 1) if generation_time > 0 else None,
+        })
+        self.last_call_metrics = metrics
+        
+        safe_print(
+            f"   ⏱️ 连接: {metrics['connect_time']}s，首token: {metrics['ttft']}s，"
+            f"总耗时: {metrics['total_time']}s，生成速度: {metrics['tokens_per_sec']} tokens/s"
+        )
+        return metrics
+    
+    def _prompt_cache_enabled(self, model: str) -> bool:
+        """模型是否启用提示词缓存标记（模型配置优先于全局配置）"""
+        model_config = self.model_configs.get(model, {})
+        return bool(model_config.get("prompt_cache", self.prompt_cache))
+    
+    def _build_system_message(self, system_prompt: str, model: str, cache_breakpoints: List[int] = None) -> Dict:
+        """
+        构建system消息
+        
+        有缓存断点时，将system_prompt按断点切分为多个文本块，并在每个稳定块末尾标记
+        cache_control，供应商（Anthropic、Gemini、OpenRouter等）可以复用已缓存的前缀；
+        不支持的供应商由LiteLLM自动去掉该标记（如OpenAI官方接口，其前缀缓存是自动的）
+        
+        Args:
+            system_prompt: 系统提示词
+            model: 模型名称
+            cache_breakpoints: 稳定前缀的结束位置（字符偏移）
+            
+        Returns:
+            OpenAI格式的system消息
+        """
+        if not cache_breakpoints or not self._prompt_cache_enabled(model):
+            return {"role": "system", "content": system_prompt}
+        
+        # Anthropic 最多支持4个缓存断点
+        offsets = sorted({p for p in cache_breakpoints if 0 < p <= len(system_prompt)})[-4:]
+        blocks = []
+        start = 0
+        for offset in offsets:
+            if offset > start:
+                blocks.append({
+                    "type": "text",
+                    "text": system_prompt[start:offset],
+                    "cache_control": {"type": "ephemeral"}
+                })
+                start = offset
+        if start < len(system_prompt):
+            blocks.append({"type": "text", "text": system_prompt[start:]})
+        if not blocks:
+            return {"role": "system", "content": system_prompt}
+        return {"role": "system", "content": blocks}
+    
+    def _record_usage(self, usage) -> Optional[Dict]:
+        """
+        解析usage（区分缓存命中/未命中的输入token）并累计到客户端统计
+        
+        Args:
+            usage: LiteLLM返回的usage对象或字典
+            
+        Returns:
+            usage字典；供应商未返回usage时为None
+        """
+        if usage is None:
+            return None
+        
+        def field(obj, key):
+            if obj is None:
+                return None
+            return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+        
+        prompt_tokens = field(usage, "prompt_tokens") or 0
+        completion_tokens = field(usage, "completion_tokens") or 0
+        cached_tokens = (
+            field(field(usage, "prompt_tokens_details"), "cached_tokens")
+            or field(usage, "cache_read_input_tokens")
+            or 0
+        )
+        cache_write_tokens = field(usage, "cache_creation_input_tokens") or 0
+        
+        usage_info = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": field(usage, "total_tokens") or prompt_tokens + completion_tokens,
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": max(0, prompt_tokens - cached_tokens),
+            "cache_write_tokens": cache_write_tokens,
+        }
+        
+        with self._usage_lock:
+            self._usage_stats["calls"] += 1
+            self._usage_stats["prompt_tokens"] += prompt_tokens
+            self._usage_stats["cached_tokens"] += cached_tokens
+            self._usage_stats["cache_write_tokens"] += cache_write_tokens
+            self._usage_stats["completion_tokens"] += completion_tokens
+        
+        hit_rate = cached_tokens / prompt_tokens * 100 if prompt_tokens else 0.0
+        safe_print(
+            f"   💾 输入tokens: {prompt_tokens}（缓存命中 {cached_tokens}，未缓存 {usage_info['uncached_tokens']}，"
+            f"缓存写入 {cache_write_tokens}，命中率 {hit_rate:.1f}%），输出tokens: {completion_tokens}"
+        )
+        return usage_info
+    
+    def get_usage_stats(self) -> Dict:
+        """
+        获取累计的token使用统计
+        
+        Returns:
+            {"calls", "prompt_tokens", "cached_tokens", "cache_write_tokens", "completion_tokens", "cache_hit_rate"}
+        """
+        with self._usage_lock:
+            stats = dict(self._usage_stats)
+        stats["cache_hit_rate"] = (
+            round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+        )
+        return stats
     
     def set_tools_config(self, tools_config: Dict):
         """
@@ -837,6 +1292,44 @@ JSON 格式要求：
         return tools
 
 
+# 进程级客户端注册表：{(配置路径, 工具配置路径): (配置mtime_ns, 客户端)}
+_clients: Dict[tuple, tuple] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(llm_config_path: str = None, tools_config_path: str = None) -> SimpleLLMClient:
+    """
+    获取进程内共享的LLM客户端（线程安全）
+    
+    同一配置文件只解析一次；配置文件修改（mtime变化）后自动重建。
+    主Agent、子Agent、Thinking Agent共用同一客户端，LiteLLM 按相同参数缓存的HTTP连接池也随之复用
+    
+    Args:
+        llm_config_path: LLM配置文件路径（默认 config/run_env_config/llm_config.yaml）
+        tools_config_path: 工具配置文件路径
+        
+    Returns:
+        SimpleLLMClient实例
+    """
+    if llm_config_path is None:
+        llm_config_path = Path(__file__).parent.parent / "config" / "run_env_config" / "llm_config.yaml"
+    config_path = os.path.abspath(str(llm_config_path))
+    key = (config_path, os.path.abspath(tools_config_path) if tools_config_path else None)
+    
+    try:
+        mtime_ns = os.stat(config_path).st_mtime_ns
+    except OSError:
+        mtime_ns = None  # 文件不存在时交给构造函数报错
+    
+    with _clients_lock:
+        cached = _clients.get(key)
+        if cached and cached[0] == mtime_ns:
+            return cached[1]
+        client = SimpleLLMClient(config_path, tools_config_path)
+        _clients[key] = (mtime_ns, client)
+        return client
+
+
 if __name__ == "__main__":
     # 测试LLM客户端
     try:
@@ -6,16 +6,20 @@ Thinking Agent - 任务进展分析服务
 """
 
 from typing import Dict, List
-from services.llm_client import SimpleLLMClient, ChatMessage
+from services.llm_client import SimpleLLMClient, ChatMessage, get_llm_client
 
 
 class ThinkingAgent:
     """思考Agent - 用于分析任务进展"""
     
-    def __init__(self):
-        """初始化Thinking Agent"""
-        # 使用简化的LLM客户端
-        self.llm_client = SimpleLLMClient()
+    def __init__(self, llm_client: SimpleLLMClient = None):
+        """
+        初始化Thinking Agent
+        
+        Args:
+            llm_client: LLM客户端（默认使用进程内共享客户端）
+        """
+        self.llm_client = llm_client or get_llm_client()
         
         # Thinking Agent的系统提示词
         self.system_prompt = """你是一个agent行动的上下文管理专家，这个 agent 每次在清除动作历史之前会请你进行上下文整理。
@@ -115,40 +119,43 @@ class ThinkingAgent:
             初始规划结果
         """
         try:
-            # 构建工具信息
-            tools_info = self._format_tools_info(available_tools, tools_config)
-            
-            # 构建分析请求
-            analysis_request = f"""当前被分析 agent 的提示词
-{agent_system_prompt}
-agent可以调用的所有工具和参数信息
-{tools_info}
-按照被分析提示词中<用户最新输入>的语言使用对应语言输出,例如提示词中<用户最新输入>为英文，则<todo_list>区域等所有区域内内容使用英文构造。不要参考我使用的语言！
-如果是初始阶段，请你构造新的<当前进度思考>上下文，否则请你更新<当前进度思考>。只需要输出<当前进度思考>内的内容即可！
-"""
-
-            #safe_print(analysis_request)           
-            history = [ChatMessage(role="user", content=analysis_request)]
-            
-            # 使用第一个可用模型，不使用工具
             response = self.llm_client.chat(
-                history=history,
-                model=self.llm_client.models[0],
+                history=[ChatMessage(role="user", content=self._first_thinking_request(
+                    agent_system_prompt, available_tools, tools_config
+                ))],
+                model=self.llm_client.models[0],  # 使用第一个可用模型，不使用工具
                 system_prompt=self.system_prompt,
                 tool_list=[],  # 空列表表示不使用工具
-                tool_choice="none"  # 明确表示不调用工具
+                tool_choice="none",  # 明确表示不调用工具
+                cache_breakpoints=[len(self.system_prompt)]  # 系统提示词固定不变，整体缓存
             )
-            
-            if response.status == "success":
-                return f"[🤖 初始规划]\n\n{response.output}"
-            else:
-                return f"[初始规划失败: {response.error_information}]"
+            return self._first_thinking_result(response)
         
         except Exception as e:
             safe_print(f"⚠️ thinking失败: {e}")
             raise Exception(str(e))
-            
-            
+    
+    def _first_thinking_request(self, agent_system_prompt: str, available_tools: List[str],
+                                tools_config: dict = None) -> str:
+        """构建首次思考的分析请求"""
+        # 构建工具信息
+        tools_info = self._format_tools_info(available_tools, tools_config)
+        
+        # 构建分析请求
+        return f"""当前被分析 agent 的提示词
+{agent_system_prompt}
+agent可以调用的所有工具和参数信息
+{tools_info}
+按照被分析提示词中<用户最新输入>的语言使用对应语言输出,例如提示词中<用户最新输入>为英文，则<todo_list>区域等所有区域内内容使用英文构造。不要参考我使用的语言！
+如果是初始阶段，请你构造新的<当前进度思考>上下文，否则请你更新<当前进度思考>。只需要输出<当前进度思考>内的内容即可！
+"""
+    
+    @staticmethod
+    def _first_thinking_result(response) -> str:
+        if response.status == "success":
+            return f"[🤖 初始规划]\n\n{response.output}"
+        else:
+            return f"[初始规划失败: {response.error_information}]"
     
     def _format_tools_info(self, available_tools: List[str], tools_config: dict = None) -> str:
         """
@@ -205,8 +212,26 @@ agent可以调用的所有工具和参数信息
             进度分析结果
         """
         try:
-            # 构建分析请求（agent_system_prompt已包含完整的<历史动作>）
-            analysis_request = f"""当前任务：{task_description}
+            response = self.llm_client.chat(
+                history=[ChatMessage(role="user", content=self._progress_request(
+                    task_description, agent_system_prompt, tool_call_counter
+                ))],
+                model=self.llm_client.models[0],
+                system_prompt=self.system_prompt,
+                tool_list=[],  # 空列表表示不使用工具
+                tool_choice="none",  # 明确表示不调用工具
+                cache_breakpoints=[len(self.system_prompt)]  # 系统提示词固定不变，整体缓存
+            )
+            return self._progress_result(response, tool_call_counter)
+        
+        except Exception as e:
+            safe_print(f"⚠️ 进度分析失败: {e}")
+            return f"[进度分析失败: {str(e)}]"
+    
+    @staticmethod
+    def _progress_request(task_description: str, agent_system_prompt: str, tool_call_counter: int) -> str:
+        """构建进度分析请求（agent_system_prompt已包含完整的<历史动作>）"""
+        return f"""当前任务：{task_description}
 
 Agent的完整上下文（包含系统角色、历史动作等）：
 {agent_system_prompt}
@@ -225,25 +250,13 @@ Agent的完整上下文（包含系统角色、历史动作等）：
 - 进度必须精准！
 - 如果发现死循环，严厉警告
 """
-            
-            history = [ChatMessage(role="user", content=analysis_request)]
-            
-            response = self.llm_client.chat(
-                history=history,
-                model=self.llm_client.models[0],
-                system_prompt=self.system_prompt,
-                tool_list=[],  # 空列表表示不使用工具
-                tool_choice="none"  # 明确表示不调用工具
-            )
-            
-            if response.status == "success":
-                return f"[🤖 进度分析 - 第{tool_call_counter}轮]\n\n{response.output}"
-            else:
-                return f"[进度分析失败: {response.error_information}]"
-        
-        except Exception as e:
-            safe_print(f"⚠️ 进度分析失败: {e}")
-            return f"[进度分析失败: {str(e)}]"
+    
+    @staticmethod
+    def _progress_result(response, tool_call_counter: int) -> str:
+        if response.status == "success":
+            return f"[🤖 进度分析 - 第{tool_call_counter}轮]\n\n{response.output}"
+        else:
+            return f"[进度分析失败: {response.error_information}]"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,45 @@
+import pytest
+from pathlib import Path
+from tool_server_lite.tools.code_tools import ExecuteCodeTool
+from tool_server_lite.tools.code_kernel import shutdown_kernels
+
+pytestmark = pytest.mark.unit
+
+@pytest.fixture
+def workspace(tmp_path):
+    """Fixture to provide a temporary workspace path."""
+    (tmp_path / "code_run").mkdir()
+    yield str(tmp_path)
+    shutdown_kernels(tmp_path)
+
+def run_kernel(workspace, code, **parameters):
+    (Path(workspace) / "code_run/main.py").write_text(code, encoding="utf-8")
+    params = {"file_path": "code_run/main.py", "use_venv": False, "kernel": True}
+    params.update(parameters)
+    return ExecuteCodeTool().execute(workspace, params)
+
+class TestExecuteCodeKernel:
+    def test_kernel_reloads_edited_workspace_module(self, workspace):
+        """测试修改工作区模块后 kernel 使用新代码"""
+        helper = Path(workspace) / "code_run/helper.py"
+        helper.write_text("VALUE = 1\n", encoding="utf-8")
+        result = run_kernel(workspace, "import helper\nprint(helper.VALUE)\n")
+        assert result["output"].strip() == "1"
+
+        helper.write_text("VALUE = 22\n", encoding="utf-8")
+        result = run_kernel(workspace, "import helper\nprint(helper.VALUE)\n")
+        assert result["output"].strip() == "22"
+
+    def test_kernel_keep_state_and_restart_after_timeout(self, workspace):
+        """测试保留变量，超时后 kernel 重启且变量清空"""
+        run_kernel(workspace, "x = 5\n", keep_state=True)
+        result = run_kernel(workspace, "print(x * 2)\n", keep_state=True)
+        assert result["output"].strip() == "10"
+
+        result = run_kernel(workspace, "import time\ntime.sleep(10)\n", timeout=1)
+        assert result["status"] == "error"
+        assert "timeout" in result["error"].lower()
+
+        result = run_kernel(workspace, "print('x' in globals())\n", keep_state=True)
+        assert result["status"] == "success"
+        assert result["output"].strip() == "False"
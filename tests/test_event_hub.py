@@ -0,0 +1,69 @@
+import pytest
+import threading
+from web_ui.server import event_hub
+from web_ui.server.event_hub import EventHub, create_hub, get_hub
+
+pytestmark = pytest.mark.unit
+
+class TestEventHub:
+    def test_replay_after_last_event_id(self):
+        hub = EventHub("task")
+        for i in range(5):
+            hub.publish({"type": "token", "content": str(i)})
+        hub.close()
+
+        replayed = [event_id for event_id, _ in hub.subscribe(last_event_id=3)]
+        assert replayed == [4, 5]
+        assert hub.last_event_id == 5
+
+    def test_fan_out_to_subscribers(self):
+        hub = EventHub("task")
+        received = {name: [] for name in ("a", "b", "c")}
+        started = threading.Barrier(4)
+
+        def consume(name):
+            stream = hub.subscribe(heartbeat=0.05)
+            started.wait()
+            for item in stream:
+                if item is not None:
+                    received[name].append(item[1]["content"])
+
+        threads = [threading.Thread(target=consume, args=(name,)) for name in received]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        for i in range(3):
+            hub.publish({"type": "token", "content": i})
+        hub.close()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert all(not thread.is_alive() for thread in threads)
+        assert all(contents == [0, 1, 2] for contents in received.values())
+
+    def test_stream_ends_after_close(self):
+        hub = EventHub("task")
+        hub.publish({"type": "token", "content": "x"})
+        hub.close()
+
+        frames = list(hub.sse_stream())
+        assert frames[0].startswith("id: 1\n")
+        assert '"type": "end"' in frames[-1]
+        assert len(frames) == 2
+
+    def test_buffer_keeps_recent_events(self):
+        hub = EventHub("task", buffer_size=3)
+        for i in range(6):
+            hub.publish({"content": i})
+        hub.close()
+
+        assert [event_id for event_id, _ in hub.subscribe()] == [4, 5, 6]
+
+    def test_closed_hubs_are_pruned(self, monkeypatch):
+        monkeypatch.setattr(event_hub, "HUB_RETENTION", 0)
+        hub = create_hub("pruned-task")
+        assert get_hub("pruned-task") is hub
+
+        hub.close()
+        hub.closed_at -= 1
+        assert get_hub("pruned-task") is None
@@ -79,6 +79,58 @@ class TestFileReadTool:
         assert output[0]["line"] == 2
         assert output[0]["content"] == "line2"
 
+    def test_read_line_range_text_format(self, workspace):
+        """测试按行范围读取（紧凑文本格式，跨越行索引检查点）"""
+        content = "".join(f"row{i}\n" for i in range(1, 3001))
+        (Path(workspace) / "big.log").write_text(content, encoding="utf-8")
+
+        tool = FileReadTool()
+        result = tool.execute(workspace, {
+            "path": "big.log", "start_line": 2047, "end_line": 2049, "line_format": "text"
+        })
+
+        assert result["status"] == "success"
+        assert result["output"] == "2047\trow2047\n2048\trow2048\n2049\trow2049"
+
+    def test_line_index_resumes_after_append(self, workspace, monkeypatch):
+        """测试文件追加后行索引从最后一个检查点继续扫描"""
+        from tool_server_lite.tools import file_tools
+        path = Path(workspace) / "grow.log"
+        path.write_text("".join(f"row{i}\n" for i in range(1, 3001)), encoding="utf-8")
+        checkpoints, total = file_tools.get_line_index(path)
+        assert total == 3000
+
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(f"row{i}\n" for i in range(3001, 3101)))
+        seeks = []
+        real_build = file_tools._build_line_index
+
+        def build(file_path, base=None, upto_line=None):
+            seeks.append(base[-1] if base else 0)
+            return real_build(file_path, base, upto_line)
+        monkeypatch.setattr(file_tools, "_build_line_index", build)
+        grown, total = file_tools.get_line_index(path)
+        assert total == 3100
+        assert seeks == [checkpoints[-1]]
+        assert list(grown) == list(real_build(path)[0])
+
+    def test_single_file_read_indexes_only_up_to_start_line(self, workspace):
+        """测试单文件读取只扫描到起始行所在检查点，不计算总行数"""
+        from tool_server_lite.tools import file_tools
+        path = Path(workspace) / "partial.log"
+        path.write_text("".join(f"row{i}\n" for i in range(1, 5001)), encoding="utf-8")
+
+        result = FileReadTool().execute(workspace, {
+            "path": "partial.log", "start_line": 1500, "end_line": 1501, "line_format": "text"
+        })
+        assert result["output"] == "1500\trow1500\n1501\trow1501"
+        checkpoints, total = file_tools._line_index_cache[str(path)][2:]
+        assert total is None and len(checkpoints) == 2
+
+        result = FileReadTool().execute(workspace, {"path": "partial.log", "start_line": 4999, "line_format": "text"})
+        assert result["output"] == "4999\trow4999\n5000\trow5000"
+        assert file_tools.get_line_index(path)[1] == 5000
+
     def test_read_without_line_numbers(self, workspace):
         """测试不显示行号"""
         (Path(workspace) / "test.txt").write_text("content", encoding="utf-8")
@@ -119,6 +171,22 @@ class TestFileReadTool:
         assert output["success_count"] == 1
         assert output["error_count"] == 1
 
+    def test_read_multiple_files_budget_truncates_large_file(self, workspace):
+        """测试多文件读取的总输出预算：小文件完整返回，大文件截断并标注"""
+        (Path(workspace) / "small.txt").write_text("tiny\n", encoding="utf-8")
+        (Path(workspace) / "large.txt").write_text(("y" * 99 + "\n") * 100, encoding="utf-8")
+
+        tool = FileReadTool()
+        result = tool.execute(workspace, {"path": ["small.txt", "large.txt"], "max_total_bytes": 1000})
+
+        assert result["status"] == "success"
+        output = json.loads(result["output"])
+        assert output["files"]["small.txt"]["content"] == [{"line": 1, "content": "tiny"}]
+        large = output["files"]["large.txt"]
+        assert large["truncated"] is True
+        assert len(large["content"]) == 9
+        assert large["total_lines"] == 100
+
 class TestFileWriteTool:
     def test_write_file_success(self, workspace):
         tool = FileWriteTool()
@@ -241,6 +309,66 @@ class TestDirListTool:
         assert "[dir] parent" in result["output"]
         assert "  [file] child.txt" in result["output"]
 
+    def test_list_recursive_depth_rollup_and_excludes(self, workspace):
+        """超过深度的目录显示汇总，排除的目录只显示一行"""
+        (Path(workspace) / "src/deep").mkdir(parents=True)
+        (Path(workspace) / "src/deep/a.py").write_text("x" * 10)
+        (Path(workspace) / "src/deep/b.py").write_text("y" * 10)
+        (Path(workspace) / "node_modules/pkg").mkdir(parents=True)
+        (Path(workspace) / "node_modules/pkg/index.js").touch()
+        (Path(workspace) / "build").mkdir()
+
+        tool = DirListTool()
+        result = tool.execute(workspace, {
+            "path": ".", "recursive": True, "max_depth": 2, "exclude": ["build/"]
+        })
+
+        assert result["status"] == "success"
+        assert "  [dir] deep (2 files, 0 dirs, 20 B)" in result["output"]
+        assert "[dir] node_modules (excluded)" in result["output"]
+        assert "[dir] build (excluded)" in result["output"]
+        assert "index.js" not in result["output"]
+
+    def test_list_max_entries_truncates(self, workspace):
+        for i in range(5):
+            (Path(workspace) / f"f{i}.txt").touch()
+
+        tool = DirListTool()
+        result = tool.execute(workspace, {"path": ".", "recursive": True, "max_entries": 3})
+
+        assert result["status"] == "success"
+        assert result["output"].count("[file]") == 3
+        assert "truncated" in result["output"]
+
+    def test_list_symlinked_dir_and_zero_depth(self, workspace):
+        """指向目录的符号链接显示为 [dir]，max_depth=0 不表示不限制"""
+        (Path(workspace) / "real/sub").mkdir(parents=True)
+        (Path(workspace) / "link").symlink_to(Path(workspace) / "real", target_is_directory=True)
+
+        tool = DirListTool()
+        result = tool.execute(workspace, {"path": "."})
+        assert "[dir] link" in result["output"]
+
+        result = tool.execute(workspace, {"path": ".", "recursive": True, "max_depth": 0})
+        assert "[dir] real (0 files, 1 dirs, 0 B)" in result["output"]
+        assert "[dir] sub" not in result["output"]
+
+    def test_list_rollup_size_after_file_grows(self, workspace):
+        """文件内容变化（目录mtime不变）后汇总大小随之更新"""
+        import os
+        deep = Path(workspace) / "src/deep"
+        deep.mkdir(parents=True)
+        (deep / "a.py").write_text("x" * 10)
+        os.utime(deep, ns=(0, 0))  # 目录快照可被缓存
+
+        tool = DirListTool()
+        params = {"path": ".", "recursive": True, "max_depth": 2}
+        assert "(1 files, 0 dirs, 10 B)" in tool.execute(workspace, params)["output"]
+
+        (deep / "a.py").write_text("x" * 30)
+        os.utime(deep, ns=(0, 0))
+        assert "(1 files, 0 dirs, 30 B)" in tool.execute(workspace, params)["output"]
+
 class TestDirCreateTool:
     def test_create_dir_success(self, workspace):
         tool = DirCreateTool()
@@ -303,3 +431,91 @@ class TestFileDeleteTool:
 
         assert result["status"] == "error"
         assert "not found" in result["error"].lower()
+
+class TestGrepTool:
+    def test_grep_skips_ignored_dirs(self, workspace):
+        """测试默认忽略 code_env，直接搜索时不受限制"""
+        from tool_server_lite.tools.code_tools import GrepTool
+        (Path(workspace) / "code_env/venv").mkdir(parents=True)
+        (Path(workspace) / "code_env/venv/mod.py").write_text("needle\n", encoding="utf-8")
+        (Path(workspace) / "main.py").write_text("x = 1\nneedle = 2\n", encoding="utf-8")
+
+        tool = GrepTool()
+        result = tool.execute(workspace, {"pattern": "needle"})
+
+        assert result["status"] == "success"
+        assert "main.py:2: needle = 2" in result["output"]
+        assert "code_env" not in result["output"]
+
+        result = tool.execute(workspace, {"pattern": "needle", "search_path": "code_env"})
+        assert "code_env/venv/mod.py:1: needle" in result["output"]
+
+    def test_grep_stops_at_max_results(self, workspace):
+        """测试达到 max_results 后停止"""
+        from tool_server_lite.tools.code_tools import GrepTool
+        for i in range(5):
+            (Path(workspace) / f"f{i}.txt").write_text("hit\nhit\n", encoding="utf-8")
+
+        tool = GrepTool()
+        result = tool.execute(workspace, {"pattern": "hit", "max_results": 3})
+
+        assert result["status"] == "success"
+        assert "找到 3 处匹配" in result["output"]
+        assert "在 2 个文件中" in result["output"]
+
+    def test_grep_index_matches_unindexed_scan(self, workspace):
+        """测试索引过滤与全量扫描结果一致（含转义和分支），且确实跳过了不含字面量的文件"""
+        import re
+        from tool_server_lite.tools.workspace_index import iter_matches
+        (Path(workspace) / "a.txt").write_text("Abcd\nhello world\n", encoding="utf-8")
+        (Path(workspace) / "b.txt").write_text("foo.bar 42\ncafé\n", encoding="utf-8")
+        (Path(workspace) / "decoy.txt").write_text("nothing relevant here\n", encoding="utf-8")
+
+        patterns = [r"\x41bcd", r"\101bcd", r"caf\u00e9", r"hello|foo", r"foo\.bar \d+", r"hello\sworld"]
+        for pattern in patterns:
+            regex = re.compile(pattern)
+            indexed = list(iter_matches(Path(workspace), Path(workspace), regex))
+            scanned = list(iter_matches(Path(workspace), Path(workspace), regex, use_index=False))
+            assert indexed == scanned, pattern
+            assert indexed, pattern
+
+        counters = {}
+        list(iter_matches(Path(workspace), Path(workspace), re.compile(r"foo\.bar"), counters=counters))
+        assert counters["files_skipped"] == 2
+        assert counters["files_searched"] == 1
+
+    def test_grep_indexes_only_pattern_files_and_reads_once(self, workspace, monkeypatch):
+        """测试只为匹配 file_pattern 的文件建索引，use_index=False 时不建索引，首次搜索每个文件只读一次"""
+        import builtins
+        import re
+        from tool_server_lite.tools import workspace_index
+        for i in range(5):
+            (Path(workspace) / f"data{i}.csv").write_text("needle\n", encoding="utf-8")
+        (Path(workspace) / "main.py").write_text("needle = 1\n", encoding="utf-8")
+        index = workspace_index.get_workspace_index(Path(workspace))
+        regex = re.compile("needle")
+
+        list(workspace_index.iter_matches(Path(workspace), Path(workspace), regex,
+                                          file_pattern="*.py", use_index=False))
+        assert index.stats["indexed"] == 0
+
+        opened = []
+        real_open = builtins.open
+        monkeypatch.setattr(builtins, "open", lambda file, *a, **kw: opened.append(file) or real_open(file, *a, **kw))
+        results = list(workspace_index.iter_matches(Path(workspace), Path(workspace), regex, file_pattern="*.py"))
+        assert results == ["main.py:1: needle = 1"]
+        assert index.stats["indexed"] == 1
+        assert opened == [str(Path(workspace).resolve() / "main.py")]
+
+    def test_grep_index_size_is_bounded(self, workspace, monkeypatch):
+        """测试位图总大小超过上限时淘汰最久未用的条目"""
+        import re
+        from tool_server_lite.tools import workspace_index
+        monkeypatch.setattr(workspace_index, "INDEX_MAX_BYTES", 3 * 128)
+        for i in range(6):
+            (Path(workspace) / f"f{i}.txt").write_text(f"line {i}\n", encoding="utf-8")
+
+        list(workspace_index.iter_matches(Path(workspace), Path(workspace), re.compile("line")))
+        index = workspace_index.get_workspace_index(Path(workspace))
+        assert index.bytes <= 3 * 128
+        assert len(index._entries) == 3
@@ -0,0 +1,130 @@
+import pytest
+from utils import state_store
+from utils.state_store import WorkspaceStateStore
+
+pytestmark = pytest.mark.unit
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Fixture to provide a temporary database path."""
+    return tmp_path / "task_state.db"
+
+def make_context():
+    return {
+        "task_id": "task",
+        "current": {
+            "instructions": [{"instruction_id": "i1", "instruction": "做点什么"}],
+            "hierarchy": {
+                "a": {"parent": None, "children": ["b"], "level": 0},
+                "b": {"parent": "a", "children": [], "level": 1},
+            },
+            "agents_status": {
+                "a": {"agent_name": "A", "status": "running"},
+                "b": {"agent_name": "B", "status": "running"},
+            },
+            "_compressed_user_agent_history": "摘要",
+        },
+        "agent_time_history": {"a": {"start_time": "t0", "end_time": None}},
+        "history": [{"completion_time": "t-1", "instructions": []}],
+    }
+
+def traced_writes(store, action):
+    """执行 action 并返回其中的写语句"""
+    statements = []
+    store._conn.set_trace_callback(statements.append)
+    try:
+        action()
+    finally:
+        store._conn.set_trace_callback(None)
+    return [s for s in statements if s.startswith(("INSERT", "DELETE"))]
+
+class TestWorkspaceStateStore:
+    def test_context_and_stack_round_trip(self, db_path):
+        store = WorkspaceStateStore(db_path)
+        context = make_context()
+        stack = [{"agent_id": "a"}, {"agent_id": "b"}]
+        store.save_context(context)
+        store.save_stack(stack)
+
+        other = WorkspaceStateStore(db_path)
+        assert other.load_context() == context
+        assert other.load_stack() == stack
+        assert not other.is_empty()
+
+    def test_save_writes_only_changed_rows(self, db_path):
+        store = WorkspaceStateStore(db_path)
+        context = make_context()
+        store.save_context(context)
+
+        assert traced_writes(store, lambda: store.save_context(context)) == []
+
+        context["current"]["agents_status"]["b"]["status"] = "completed"
+        context["history"].append({"completion_time": "t-2"})
+        writes = traced_writes(store, lambda: store.save_context(context))
+        assert len(writes) == 2
+        assert writes[0].startswith("INSERT OR REPLACE INTO agents") and "'b'" in writes[0]
+        assert writes[1].startswith("INSERT INTO history")
+
+        del context["current"]["hierarchy"]["b"]
+        context["current"]["hierarchy"]["a"]["children"] = []
+        writes = traced_writes(store, lambda: store.save_context(context))
+        assert sorted(w.split(" WHERE")[0] for w in writes) == ["DELETE FROM edges", "DELETE FROM hierarchy"]
+        assert WorkspaceStateStore(db_path).load_context() == context
+
+    def test_external_change_forces_full_rewrite(self, db_path):
+        store = WorkspaceStateStore(db_path)
+        context = make_context()
+        store.save_context(context)
+
+        other = WorkspaceStateStore(db_path)
+        changed = other.load_context()
+        changed["current"]["agents_status"]["c"] = {"agent_name": "C", "status": "running"}
+        other.save_context(changed)
+        assert store.changed_externally()
+
+        writes = traced_writes(store, lambda: store.save_context(context))
+        assert "DELETE FROM agents" in writes
+        assert WorkspaceStateStore(db_path).load_context() == context
+
+    def test_transaction_rollback_and_nesting(self, db_path):
+        store = WorkspaceStateStore(db_path)
+        context = make_context()
+        store.save_context(context)
+
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                with store.transaction():
+                    store.save_stack([{"agent_id": "a"}])
+                raise RuntimeError("abort")
+        assert store.load_stack() == []
+
+        # 回滚后不再依赖已记录的行：下次保存整表重写
+        context["current"]["agents_status"]["a"]["status"] = "completed"
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                store.save_context(context)
+                raise RuntimeError("abort")
+        store.save_context(context)
+        assert WorkspaceStateStore(db_path).load_context() == context
+
+    def test_action_log_round_trip(self, db_path):
+        store = WorkspaceStateStore(db_path)
+        assert store.load_action_log("a") is None
+
+        store.append_action_records("a", [{"seq": 1, "op": "append"}, {"seq": 2, "op": "append"}])
+        assert store.load_action_log("a") == (None, [{"seq": 1, "op": "append"}, {"seq": 2, "op": "append"}])
+
+        store.write_action_snapshot("a", {"action_history": [1, 2]}, seq=2)
+        store.append_action_records("a", [{"seq": 3, "op": "set"}])
+        assert store.load_action_log("a") == ({"action_history": [1, 2]}, [{"seq": 3, "op": "set"}])
+        assert store.load_action_log("b") is None
+
+    def test_close_state_store_evicts_instance(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("HOME", str(tmp_path))
+        monkeypatch.setattr(state_store, "STATE_BACKEND", "sqlite")
+        store = state_store.get_state_store("/work/task")
+        assert state_store.get_state_store("/work/task") is store
+
+        state_store.close_state_store("/work/task")
+        assert state_store.get_state_store("/work/task") is not store
+        state_store.close_state_store("/work/task")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工具执行池 - 按工具类别隔离的有界线程池/进程池
+
+长时间运行的 execute_code/execute_command 只占用 subprocess 池，
+不会挤占 file_read、dir_list 等快速工具所在的 fast_io 池。
+每个池记录排队等待时间和利用率，供 /health 和 /api/pools 查看。
+"""
+
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+# 默认池配置：workers 为并发数，max_queue 为允许排队（等待空闲worker）的最大请求数
+DEFAULT_POOL_CONFIG = {
+    "fast_io": {"workers": 8, "max_queue": 64},
+    "cpu": {"workers": max(2, (os.cpu_count() or 2) // 2), "max_queue": 16, "process": False},
+    "subprocess": {"workers": 8, "max_queue": 16},
+    "network": {"workers": 16, "max_queue": 64},
+}
+
+
+class PoolBusyError(Exception):
+    """执行池排队已满"""
+
+
+def _timed_call(fn: Callable, *args):
+    """在worker中执行并返回(开始时间, 结束时间, 结果)，用于计算排队等待和执行耗时"""
+    started = time.time()
+    result = fn(*args)
+    return started, time.time(), result
+
+
+# 进程池worker中的工具实例缓存：{类名: 实例}
+_process_tools: Dict[str, Any] = {}
+
+
+def run_tool_in_process(class_name: str, task_id: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """在进程池worker中执行工具（工具在子进程内按需加载并缓存）"""
+    tool = _process_tools.get(class_name)
+    if tool is None:
+        import tools
+        tool = getattr(tools, class_name)()
+        _process_tools[class_name] = tool
+    return tool.execute(task_id, parameters)
+
+
+class ToolPool:
+    """单个类别的有界执行池（带排队上限和指标）"""
+
+    def __init__(self, name: str, workers: int, max_queue: int, process: bool = False):
+        self.name = name
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.process = bool(process)
+        if self.process:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix=f"tool-{name}"
+            )
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+
+    async def run(self, fn: Callable, *args):
+        """
+        在池中执行函数
+
+        Raises:
+            PoolBusyError: 所有worker忙且排队已满
+        """
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise PoolBusyError(
+                    f"工具执行池 '{self.name}' 繁忙（{self.workers} 个执行中，{self.max_queue} 个排队），请稍后重试"
+                )
+            self._in_flight += 1
+            self._submitted += 1
+
+        submitted = time.time()
+        loop = asyncio.get_event_loop()
+        try:
+            started, finished, result = await loop.run_in_executor(self.executor, _timed_call, fn, *args)
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        wait = max(0.0, started - submitted)
+        with self._lock:
+            self._completed += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            self._total_run += finished - started
+        return result
+
+    def metrics(self) -> Dict[str, Any]:
+        """池指标：排队深度、利用率、等待/执行耗时"""
+        with self._lock:
+            active = min(self._in_flight, self.workers)
+            return {
+                "kind": "process" if self.process else "thread",
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "active": active,
+                "queued": self._in_flight - active,
+                "utilization": round(active / self.workers, 3),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / self._completed * 1000, 2) if self._completed else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 2),
+                "avg_run_ms": round(self._total_run / self._completed * 1000, 2) if self._completed else 0.0,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class ToolPools:
+    """按类别管理执行池（首次使用时创建）"""
+
+    def __init__(self, config: Optional[Dict[str, Dict[str, Any]]] = None):
+        self._config = {name: dict(value) for name, value in DEFAULT_POOL_CONFIG.items()}
+        for name, value in (config or {}).items():
+            self._config.setdefault(name, {"workers": 4, "max_queue": 16}).update(value or {})
+        self._pools: Dict[str, ToolPool] = {}
+        self._lock = threading.Lock()
+
+    def get(self, category: str) -> ToolPool:
+        """获取类别对应的执行池（未知类别使用 network 池）"""
+        if category not in self._config:
+            category = "network"
+        pool = self._pools.get(category)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(category)
+                if pool is None:
+                    pool = ToolPool(category, **self._config[category])
+                    self._pools[category] = pool
+        return pool
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """所有已创建执行池的指标"""
+        return {name: pool.metrics() for name, pool in list(self._pools.items())}
+
+    def shutdown(self):
+        for pool in list(self._pools.values()):
+            pool.shutdown()
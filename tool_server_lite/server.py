@@ -24,60 +24,18 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any, List, Tuple
 import uvicorn
 import asyncio
+import threading
+import time
+from collections.abc import Mapping
+from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 
 # 添加父目录到路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from tools import (
-    FileReadTool,
-    FileWriteTool,
-    DirListTool,
-    DirCreateTool,
-    FileMoveTool,
-    FileDeleteTool,
-    WebSearchTool,
-    GoogleScholarSearchTool,
-    ArxivSearchTool,
-    CrawlPageTool,
-    FileDownloadTool,
-    ParseDocumentTool,
-    VisionTool,
-    CreateImageTool,
-    AudioTool,
-    PaperAnalyzeTool,
-    MarkdownToPdfTool,
-    MarkdownToDocxTool,
-    TexToPdfTool,
-    HumanInLoopTool,
-    ExecuteCodeTool,
-    PipInstallTool,
-    ExecuteCommandTool,
-    GrepTool,
-    CodeProcessManagerTool,
-    ReferenceListTool,
-    ReferenceAddTool,
-    ReferenceDeleteTool,
-    ImagesToPptTool,
-    BrowserLaunchTool,
-    BrowserCloseTool,
-    BrowserNewPageTool,
-    BrowserSwitchPageTool,
-    BrowserClosePageTool,
-    BrowserListPagesTool,
-    BrowserNavigateTool,
-    BrowserSnapshotTool,
-    BrowserExecuteJsTool,
-    BrowserClickTool,
-    BrowserTypeTool,
-    BrowserWaitTool,
-    BrowserMouseMoveTool,
-    BrowserMouseClickCoordsTool,
-    BrowserDragAndDropTool,
-    BrowserHoverTool,
-    BrowserScrollTool
-)
+import tools  # 工具类按需导入（见 tools/__init__.py）
+from executor_pools import ToolPools, PoolBusyError, run_tool_in_process
 from tools.human_tools import (
     get_hil_status, respond_hil_task, list_hil_tasks, get_hil_task_for_workspace,
     create_tool_confirmation, get_tool_confirmation_status, respond_tool_confirmation,
@@ -90,57 +48,179 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# 初始化所有工具
-TOOLS = {
-    "file_read": FileReadTool(),
-    "file_write": FileWriteTool(),
-    "dir_list": DirListTool(),
-    "dir_create": DirCreateTool(),
-    "file_move": FileMoveTool(),
-    "file_delete": FileDeleteTool(),
-    "web_search": WebSearchTool(),
-    "google_scholar_search": GoogleScholarSearchTool(),
-    "arxiv_search": ArxivSearchTool(),
-    "crawl_page": CrawlPageTool(),
-    "file_download": FileDownloadTool(),
-    "parse_document": ParseDocumentTool(),
-    "vision_tool": VisionTool(),
-    "create_image": CreateImageTool(),
-    "audio_tool": AudioTool(),
-    "paper_analyze_tool": PaperAnalyzeTool(),
-    "md_to_pdf": MarkdownToPdfTool(),
-    "md_to_docx": MarkdownToDocxTool(),
-    "tex_to_pdf": TexToPdfTool(),
-    "human_in_loop": HumanInLoopTool(),
-    "execute_code": ExecuteCodeTool(),
-    "pip_install": PipInstallTool(),
-    "execute_command": ExecuteCommandTool(),
-    "grep": GrepTool(),
-    "manage_code_process": CodeProcessManagerTool(),
-    "reference_list": ReferenceListTool(),
-    "reference_add": ReferenceAddTool(),
-    "reference_delete": ReferenceDeleteTool(),
-    "images_to_ppt": ImagesToPptTool(),
-    "browser_launch": BrowserLaunchTool(),
-    "browser_close": BrowserCloseTool(),
-    "browser_new_page": BrowserNewPageTool(),
-    "browser_switch_page": BrowserSwitchPageTool(),
-    "browser_close_page": BrowserClosePageTool(),
-    "browser_list_pages": BrowserListPagesTool(),
-    "browser_navigate": BrowserNavigateTool(),
-    "browser_snapshot": BrowserSnapshotTool(),
-    "browser_execute_js": BrowserExecuteJsTool(),
-    "browser_click": BrowserClickTool(),
-    "browser_type": BrowserTypeTool(),
-    "browser_wait": BrowserWaitTool(),
-    "browser_mouse_move": BrowserMouseMoveTool(),
-    "browser_mouse_click_coords": BrowserMouseClickCoordsTool(),
-    "browser_drag_and_drop": BrowserDragAndDropTool(),
-    "browser_hover": BrowserHoverTool(),
-    "browser_scroll": BrowserScrollTool(),
+# 工具名 → 工具类名（类所在模块见 tools._TOOL_MODULES）
+TOOL_CLASSES = {
+    "file_read": "FileReadTool",
+    "file_write": "FileWriteTool",
+    "dir_list": "DirListTool",
+    "dir_create": "DirCreateTool",
+    "file_move": "FileMoveTool",
+    "file_delete": "FileDeleteTool",
+    "web_search": "WebSearchTool",
+    "google_scholar_search": "GoogleScholarSearchTool",
+    "arxiv_search": "ArxivSearchTool",
+    "crawl_page": "CrawlPageTool",
+    "file_download": "FileDownloadTool",
+    "parse_document": "ParseDocumentTool",
+    "vision_tool": "VisionTool",
+    "create_image": "CreateImageTool",
+    "audio_tool": "AudioTool",
+    "paper_analyze_tool": "PaperAnalyzeTool",
+    "md_to_pdf": "MarkdownToPdfTool",
+    "md_to_docx": "MarkdownToDocxTool",
+    "tex_to_pdf": "TexToPdfTool",
+    "human_in_loop": "HumanInLoopTool",
+    "execute_code": "ExecuteCodeTool",
+    "pip_install": "PipInstallTool",
+    "execute_command": "ExecuteCommandTool",
+    "grep": "GrepTool",
+    "manage_code_process": "CodeProcessManagerTool",
+    "reference_list": "ReferenceListTool",
+    "reference_add": "ReferenceAddTool",
+    "reference_delete": "ReferenceDeleteTool",
+    "images_to_ppt": "ImagesToPptTool",
+    "browser_launch": "BrowserLaunchTool",
+    "browser_close": "BrowserCloseTool",
+    "browser_new_page": "BrowserNewPageTool",
+    "browser_switch_page": "BrowserSwitchPageTool",
+    "browser_close_page": "BrowserClosePageTool",
+    "browser_list_pages": "BrowserListPagesTool",
+    "browser_navigate": "BrowserNavigateTool",
+    "browser_snapshot": "BrowserSnapshotTool",
+    "browser_execute_js": "BrowserExecuteJsTool",
+    "browser_click": "BrowserClickTool",
+    "browser_type": "BrowserTypeTool",
+    "browser_wait": "BrowserWaitTool",
+    "browser_mouse_move": "BrowserMouseMoveTool",
+    "browser_mouse_click_coords": "BrowserMouseClickCoordsTool",
+    "browser_drag_and_drop": "BrowserDragAndDropTool",
+    "browser_hover": "BrowserHoverTool",
+    "browser_scroll": "BrowserScrollTool",
+}
+
+
+# 工具名 → 执行池类别（只对同步工具生效，异步工具直接在事件循环中 await）
+# fast_io: 快速本地文件操作；cpu: CPU 密集的解析/转换；subprocess: 启动子进程的长任务；network: 网络/LLM 调用
+TOOL_CATEGORIES = {
+    "file_read": "fast_io",
+    "file_write": "fast_io",
+    "dir_list": "fast_io",
+    "dir_create": "fast_io",
+    "file_move": "fast_io",
+    "file_delete": "fast_io",
+    "grep": "fast_io",
+    "reference_list": "fast_io",
+    "reference_add": "fast_io",
+    "reference_delete": "fast_io",
+    "manage_code_process": "fast_io",
+    "parse_document": "cpu",
+    "md_to_docx": "cpu",
+    "images_to_ppt": "cpu",
+    "md_to_pdf": "subprocess",
+    "tex_to_pdf": "subprocess",
+    "execute_code": "subprocess",
+    "execute_command": "subprocess",
+    "pip_install": "subprocess",
 }
 
 
+class LazyToolRegistry(Mapping):
+    """
+    工具注册表：首次使用某个工具时才导入其模块并实例化
+    
+    服务器启动时不再导入 playwright、crawl4ai 等重量级依赖；每个工具的加载耗时和
+    常驻内存增量记录在 load_stats() 中，通过 /health 暴露。
+    """
+    
+    def __init__(self, tool_classes: Dict[str, str]):
+        self._tool_classes = dict(tool_classes)
+        self._instances: Dict[str, Any] = {}
+        self._load_stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def __getitem__(self, tool_name: str):
+        tool = self._instances.get(tool_name)
+        if tool is not None:
+            return tool
+        if tool_name not in self._tool_classes:
+            raise KeyError(tool_name)
+        
+        with self._lock:
+            if tool_name not in self._instances:
+                self._load(tool_name)
+        return self._instances[tool_name]
+    
+    def __contains__(self, tool_name) -> bool:
+        return tool_name in self._tool_classes
+    
+    def __iter__(self):
+        return iter(self._tool_classes)
+    
+    def __len__(self) -> int:
+        return len(self._tool_classes)
+    
+    def _load(self, tool_name: str):
+        """导入并实例化工具，记录耗时和内存增量"""
+        class_name = self._tool_classes[tool_name]
+        rss_before = _current_rss()
+        start = time.perf_counter()
+        
+        tool = getattr(tools, class_name)()
+        
+        load_time = time.perf_counter() - start
+        rss_after = _current_rss()
+        self._instances[tool_name] = tool
+        self._load_stats[tool_name] = {
+            "class": class_name,
+            "module": tools._TOOL_MODULES[class_name].lstrip("."),
+            "load_time_ms": round(load_time * 1000, 2),
+            "rss_delta_mb": (
+                round((rss_after - rss_before) / 1024 / 1024, 2)
+                if rss_before is not None and rss_after is not None else None
+            ),
+            "loaded_at": datetime.now().isoformat()
+        }
+        print(f"📦 工具已加载: {tool_name} ({self._load_stats[tool_name]['load_time_ms']} ms)")
+    
+    def is_loaded(self, tool_name: str) -> bool:
+        return tool_name in self._instances
+    
+    def load_stats(self) -> Dict[str, Dict[str, Any]]:
+        """已加载工具的加载耗时和内存增量"""
+        return dict(self._load_stats)
+
+
+def _current_rss() -> Optional[int]:
+    """当前进程常驻内存（字节），未安装 psutil 时返回 None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return None
+
+
+# 工具注册表（首次使用时加载）
+TOOLS = LazyToolRegistry(TOOL_CLASSES)
+
+
+def load_pool_config() -> Dict[str, Dict[str, Any]]:
+    """从配置文件读取执行池配置（tool_pools），未配置时使用默认值"""
+    try:
+        import yaml
+        config_path = Path(__file__).parent.parent / "config" / "run_env_config" / "tool_config.yaml"
+        if not config_path.exists():
+            return {}
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        return config.get('tool_pools') or {}
+    except Exception:
+        return {}
+
+
+# 按类别隔离的执行池（首次使用时创建）
+POOLS = ToolPools(load_pool_config())
+
+
 # ===== 请求模型 =====
 class ToolExecuteRequest(BaseModel):
     """工具执行请求"""
@@ -153,6 +233,36 @@ class TaskCreateRequest(BaseModel):
     task_id: str  # 绝对路径
 
 
+async def _get_tool(tool_name: str):
+    """获取工具实例；首次加载（导入模块）放到线程池中，避免阻塞事件循环"""
+    if TOOLS.is_loaded(tool_name):
+        return TOOLS[tool_name]
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, TOOLS.__getitem__, tool_name)
+
+
+async def _run_tool(tool_name: str, task_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    执行工具：异步工具直接 await；同步工具放到其类别对应的执行池中，避免阻塞事件循环，
+    也避免长任务挤占快速工具
+    """
+    tool = await _get_tool(tool_name)
+    if hasattr(tool, 'execute_async'):
+        return await tool.execute_async(task_id=task_id, parameters=params)
+    
+    pool = POOLS.get(TOOL_CATEGORIES.get(tool_name, "network"))
+    try:
+        if pool.process:
+            return await pool.run(run_tool_in_process, TOOL_CLASSES[tool_name], task_id, params)
+        return await pool.run(tool.execute, task_id, params)
+    except PoolBusyError as e:
+        return {
+            "status": "error",
+            "output": "",
+            "error": str(e)
+        }
+
+
 # ===== API 端点 =====
 @app.get("/")
 async def root():
@@ -166,11 +276,27 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """健康检查"""
+    """健康检查（含各工具的加载耗时和内存增量）"""
+    rss = _current_rss()
     return {
         "status": "healthy",
         "service": "tool_server_lite",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "rss_mb": round(rss / 1024 / 1024, 2) if rss is not None else None,
+        "tools": {
+            "registered": len(TOOLS),
+            "loaded": TOOLS.load_stats()
+        },
+        "pools": POOLS.metrics()
+    }
+
+
+@app.get("/api/pools")
+async def get_pools():
+    """各工具执行池的排队深度、利用率和等待时间"""
+    return {
+        "success": True,
+        "data": POOLS.metrics()
     }
 
 
@@ -282,24 +408,8 @@ async def execute_tool_old_api(request: OldToolExecuteRequest):
                 "error": f"Tool '{tool_name}' not found. Available tools: {list(TOOLS.keys())}"
             }
         
-        tool = TOOLS[tool_name]
-        
         # 执行工具（支持异步工具）
-        if hasattr(tool, 'execute_async'):
-            # 异步工具直接 await
-            result = await tool.execute_async(
-                task_id=request.task_id,
-                parameters=request.params
-            )
-        else:
-            # 同步工具在线程池中执行，避免阻塞事件循环
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,  # 使用默认线程池
-                tool.execute,
-                request.task_id,
-                request.params
-            )
+        result = await _run_tool(tool_name, request.task_id, request.params)
         
         # 返回旧版格式
         if result["status"] == "success":
@@ -323,6 +433,69 @@ async def execute_tool_old_api(request: OldToolExecuteRequest):
         }
 
 
+class BatchToolCall(BaseModel):
+    """批量执行中的单个工具调用"""
+    tool_name: str
+    params: Dict[str, Any] = {}
+
+
+class BatchToolExecuteRequest(BaseModel):
+    """批量工具执行请求（同一 workspace）"""
+    task_id: str
+    calls: List[BatchToolCall]
+
+
+async def _execute_batch_item(task_id: str, call: BatchToolCall) -> Dict[str, Any]:
+    """执行批量请求中的一项，错误只影响该项"""
+    if call.tool_name not in TOOLS:
+        return {
+            "tool_name": call.tool_name,
+            "success": False,
+            "error": f"Tool '{call.tool_name}' not found. Available tools: {list(TOOLS.keys())}"
+        }
+    
+    try:
+        result = await _run_tool(call.tool_name, task_id, call.params)
+    except Exception as e:
+        import traceback
+        return {
+            "tool_name": call.tool_name,
+            "success": False,
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }
+    
+    item = {
+        "tool_name": call.tool_name,
+        "success": result["status"] == "success",
+        "data": result
+    }
+    if not item["success"]:
+        item["error"] = result.get("error", "Unknown error")
+    return item
+
+
+@app.post("/api/tool/execute_batch")
+async def execute_tool_batch(request: BatchToolExecuteRequest):
+    """
+    批量执行工具：一次请求执行同一 workspace 的多个工具调用
+    
+    异步工具并发 await，同步工具分发到各自类别的执行池并发执行；结果按请求顺序返回，每项带独立状态。
+    调用方应只把互不依赖的调用放在同一批中（例如多个文件读取、搜索）。
+    
+    Args:
+        request: {"task_id": "...", "calls": [{"tool_name": "...", "params": {...}}, ...]}
+    """
+    results = await asyncio.gather(
+        *(_execute_batch_item(request.task_id, call) for call in request.calls)
+    )
+    
+    return {
+        "success": all(item["success"] for item in results),
+        "data": list(results)
+    }
+
+
 @app.post("/api/execute/{tool_name}")
 async def execute_tool(tool_name: str, request: ToolExecuteRequest):
     """
@@ -340,24 +513,8 @@ async def execute_tool(tool_name: str, request: ToolExecuteRequest):
                 detail=f"Tool '{tool_name}' not found. Available tools: {list(TOOLS.keys())}"
             )
         
-        tool = TOOLS[tool_name]
-        
         # 执行工具（支持异步工具）
-        if hasattr(tool, 'execute_async'):
-            # 异步工具直接 await
-            result = await tool.execute_async(
-                task_id=request.task_id,
-                parameters=request.parameters
-            )
-        else:
-            # 同步工具在线程池中执行，避免阻塞事件循环
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,  # 使用默认线程池
-                tool.execute,
-                request.task_id,
-                request.parameters
-            )
+        result = await _run_tool(tool_name, request.task_id, request.parameters)
         
         return {
             "success": result["status"] == "success",
@@ -502,7 +659,40 @@ def load_server_config() -> Tuple[str, int]:
         return "0.0.0.0", 8001
 
 
-def start_server(host: str = None, port: int = None):
+def load_server_socket_path() -> Optional[str]:
+    """
+    从配置文件读取可选的 Unix 域套接字路径（tools_server_socket）
+    
+    Returns:
+        套接字路径，未配置或平台不支持时返回 None
+    """
+    if sys.platform == 'win32':
+        return None
+    try:
+        import yaml
+        config_path = Path(__file__).parent.parent / "config" / "run_env_config" / "tool_config.yaml"
+        if not config_path.exists():
+            return None
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        return config.get('tools_server_socket') or None
+    except Exception:
+        return None
+
+
+async def _serve_tcp_and_uds(host: str, port: int, uds: str):
+    """同时在 TCP 端口和 Unix 域套接字上提供服务（同机客户端可走套接字）"""
+    import os
+    if os.path.exists(uds):
+        os.unlink(uds)
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port)),
+        uvicorn.Server(uvicorn.Config(app, uds=uds)),
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def start_server(host: str = None, port: int = None, uds: str = None):
     """启动服务器"""
     # 如果没有指定，从配置文件读取
     used_config = False
@@ -521,7 +711,13 @@ def start_server(host: str = None, port: int = None):
     print(f"📚 Available tools: {len(TOOLS)}")
     print(f"🔗 API Docs: http://{host}:{port}/docs")
     
-    uvicorn.run(app, host=host, port=port)
+    if uds is None:
+        uds = load_server_socket_path()
+    if uds:
+        print(f"🔌 Unix socket: {uds}")
+        asyncio.run(_serve_tcp_and_uds(host, port, uds))
+    else:
+        uvicorn.run(app, host=host, port=port)
 
 
 def get_server_pid() -> int:
@@ -1,74 +1,76 @@
-"""轻量化工具集合"""
+"""轻量化工具集合
 
-from .file_tools import (
-    FileReadTool,
-    FileWriteTool,
-    DirListTool,
-    DirCreateTool,
-    FileMoveTool,
-    FileDeleteTool
-)
+工具类按需导入：首次访问某个工具类时才导入其所在模块，
+只用到文件工具时不会加载 playwright、crawl4ai、pdfplumber 等重量级依赖。
+"""
 
-from .web_tools import (
-    WebSearchTool,
-    GoogleScholarSearchTool,
-    CrawlPageTool,
-    FileDownloadTool
-)
+import importlib
 
-from .arxiv_tools import ArxivSearchTool
+# 工具类名 → 所在模块
+_TOOL_MODULES = {
+    "FileReadTool": ".file_tools",
+    "FileWriteTool": ".file_tools",
+    "DirListTool": ".file_tools",
+    "DirCreateTool": ".file_tools",
+    "FileMoveTool": ".file_tools",
+    "FileDeleteTool": ".file_tools",
+    "WebSearchTool": ".web_tools",
+    "GoogleScholarSearchTool": ".web_tools",
+    "ArxivSearchTool": ".arxiv_tools",
+    "CrawlPageTool": ".web_tools",
+    "FileDownloadTool": ".web_tools",
+    "ParseDocumentTool": ".document_tools",
+    "VisionTool": ".vision_tools",
+    "CreateImageTool": ".vision_tools",
+    "AudioTool": ".audio_tools",
+    "PaperAnalyzeTool": ".paper_tools",
+    "MarkdownToPdfTool": ".convert_tools",
+    "MarkdownToDocxTool": ".convert_tools",
+    "TexToPdfTool": ".convert_tools",
+    "HumanInLoopTool": ".human_tools",
+    "ExecuteCodeTool": ".code_tools",
+    "PipInstallTool": ".code_tools",
+    "ExecuteCommandTool": ".code_tools",
+    "GrepTool": ".code_tools",
+    "CodeProcessManagerTool": ".code_tools",
+    "ReferenceListTool": ".reference_tools",
+    "ReferenceAddTool": ".reference_tools",
+    "ReferenceDeleteTool": ".reference_tools",
+    "ImagesToPptTool": ".powerpoint_tools",
+    "BrowserLaunchTool": ".browser_tools",
+    "BrowserCloseTool": ".browser_tools",
+    "BrowserNewPageTool": ".browser_tools",
+    "BrowserSwitchPageTool": ".browser_tools",
+    "BrowserClosePageTool": ".browser_tools",
+    "BrowserListPagesTool": ".browser_tools",
+    "BrowserNavigateTool": ".browser_tools",
+    "BrowserSnapshotTool": ".browser_tools",
+    "BrowserExecuteJsTool": ".browser_tools",
+    "BrowserClickTool": ".browser_tools",
+    "BrowserTypeTool": ".browser_tools",
+    "BrowserWaitTool": ".browser_tools",
+    "BrowserMouseMoveTool": ".browser_tools",
+    "BrowserMouseClickCoordsTool": ".browser_tools",
+    "BrowserDragAndDropTool": ".browser_tools",
+    "BrowserHoverTool": ".browser_tools",
+    "BrowserScrollTool": ".browser_tools",
+}
 
-from .document_tools import ParseDocumentTool
 
-from .vision_tools import VisionTool, CreateImageTool
+def __getattr__(name):
+    """按需导入工具类（PEP 562）"""
+    module_name = _TOOL_MODULES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(module_name, __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
 
-from .audio_tools import AudioTool
 
-from .paper_tools import PaperAnalyzeTool
+def __dir__():
+    return sorted(set(globals()) | set(_TOOL_MODULES))
 
-from .human_tools import HumanInLoopTool
-
-from .convert_tools import (
-    MarkdownToPdfTool,
-    MarkdownToDocxTool,
-    TexToPdfTool
-)
-
-from .code_tools import (
-    ExecuteCodeTool,
-    PipInstallTool,
-    ExecuteCommandTool,
-    GrepTool,
-    CodeProcessManagerTool
-)
-
-from .reference_tools import (
-    ReferenceListTool,
-    ReferenceAddTool,
-    ReferenceDeleteTool
-)
-
-from .powerpoint_tools import ImagesToPptTool
-
-from .browser_tools import (
-    BrowserLaunchTool,
-    BrowserCloseTool,
-    BrowserNewPageTool,
-    BrowserSwitchPageTool,
-    BrowserClosePageTool,
-    BrowserListPagesTool,
-    BrowserNavigateTool,
-    BrowserSnapshotTool,
-    BrowserExecuteJsTool,
-    BrowserClickTool,
-    BrowserTypeTool,
-    BrowserWaitTool,
-    BrowserMouseMoveTool,
-    BrowserMouseClickCoordsTool,
-    BrowserDragAndDropTool,
-    BrowserHoverTool,
-    BrowserScrollTool
-)
 
 __all__ = [
     "FileReadTool",
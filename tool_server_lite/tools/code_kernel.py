@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻代码执行进程（kernel 模式）
+
+每个 workspace + 解释器对应一个长期运行的 worker 进程，通过管道接收代码并返回
+stdout/stderr/退出码。numpy、pandas 等库只在 worker 中导入一次，后续执行直接复用；
+工作区中的模块每次执行前都会从 sys.modules 移除，修改后立即生效。
+可选保留命名空间（变量在多次执行间保留）。
+超时或崩溃时 worker 被终止，下次执行自动重启；空闲超过 KERNEL_IDLE_TIMEOUT 的 worker 由后台线程回收。
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+# 空闲多久后回收 worker（秒）
+KERNEL_IDLE_TIMEOUT = int(os.environ.get("MLA_KERNEL_IDLE_TIMEOUT", "600"))
+# 回收线程的检查间隔（秒）
+KERNEL_REAP_INTERVAL = 30
+# worker 启动（握手）超时（秒）
+KERNEL_START_TIMEOUT = 30
+
+
+# worker 进程的启动代码：协议使用原始的 stdin/stdout（JSON 行），
+# 每次执行时将 fd 1/2 重定向到输出目录下的临时文件，子进程和C扩展的输出也能被捕获
+_WORKER_SOURCE = r'''
+import json, os, sys, traceback, importlib
+
+proto_in = os.fdopen(os.dup(0), "r", encoding="utf-8")
+proto_out = os.fdopen(os.dup(1), "w", encoding="utf-8")
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(devnull, 0)
+os.close(devnull)
+
+tmp_dir = sys.argv[1]
+os.makedirs(tmp_dir, exist_ok=True)
+out_path = os.path.join(tmp_dir, "stdout")
+err_path = os.path.join(tmp_dir, "stderr")
+saved_path = list(sys.path)
+namespace = None
+
+
+def _stable_prefixes():
+    """标准库和 site-packages（含模板 .pth 叠加的目录）：其中的模块在多次执行间保留"""
+    import site, sysconfig
+    paths = set()
+    for key in ("stdlib", "platstdlib", "purelib", "platlib"):
+        path = sysconfig.get_paths().get(key)
+        if path:
+            paths.add(path)
+    try:
+        paths.update(site.getsitepackages())
+    except AttributeError:
+        pass
+    paths.update(p for p in saved_path if os.path.basename(p) in ("site-packages", "dist-packages"))
+    return tuple(os.path.join(os.path.realpath(p), "") for p in paths)
+
+
+stable_prefixes = _stable_prefixes()
+
+
+def _purge_user_modules():
+    """移除工作区等非库目录中导入的模块，修改后的代码在下次执行时重新导入"""
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if path and not os.path.realpath(path).startswith(stable_prefixes):
+            del sys.modules[name]
+
+
+def _flush():
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+def _run(request):
+    global namespace
+    code_file = request["code_file"]
+    if namespace is None or not request.get("keep_state"):
+        namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    namespace["__file__"] = code_file
+    try:
+        with open(code_file, "r", encoding="utf-8") as f:
+            source = f.read()
+        os.chdir(request["cwd"])
+        sys.argv = [code_file]
+        sys.path[:] = [os.path.dirname(code_file)] + saved_path
+        _purge_user_modules()
+        importlib.invalidate_caches()
+        exec(compile(source, code_file, "exec"), namespace)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        # 去掉 worker 自身的栈帧，只显示用户代码的 traceback
+        etype, value, tb = sys.exc_info()
+        traceback.print_exception(etype, value, tb.tb_next)
+        return 1
+
+
+proto_out.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+proto_out.flush()
+
+for line in proto_in:
+    request = json.loads(line)
+    merge = request.get("merge_stderr")
+    out_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    err_fd = out_fd if merge else os.open(err_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    _flush()
+    os.dup2(out_fd, 1)
+    os.dup2(err_fd, 2)
+    try:
+        exit_code = _run(request)
+    finally:
+        _flush()
+        os.close(out_fd)
+        if not merge:
+            os.close(err_fd)
+    response = {
+        "exit_code": exit_code,
+        "stdout": _read(out_path),
+        "stderr": "" if merge else _read(err_path),
+    }
+    proto_out.write(json.dumps(response) + "\n")
+    proto_out.flush()
+'''
+
+
+class KernelCrashed(Exception):
+    """worker 在执行过程中退出"""
+
+
+class CodeKernel:
+    """单个 workspace 的常驻 worker 进程"""
+
+    def __init__(self, workspace: str, python_exec: str):
+        self.workspace = workspace
+        self.python_exec = python_exec
+        # 每次执行的输出临时文件所在目录（随 workspace 一起清理）
+        self.output_dir = Path(workspace) / "code_env" / "kernel" / hashlib.md5(python_exec.encode("utf-8")).hexdigest()[:8]
+        self.process: Optional[subprocess.Popen] = None
+        self.last_used = time.time()
+        self.runs = 0
+        self.restarts = 0
+        self._responses: "queue.Queue[Optional[str]]" = queue.Queue()
+        # 同一 kernel 的执行串行进行
+        self.lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def _start(self):
+        """启动 worker 并等待就绪"""
+        env = os.environ.copy()
+        env["PYTHONIOENCODING"] = "utf-8"
+        env["PYTHONUTF8"] = "1"
+        env["PYTHONUNBUFFERED"] = "1"
+
+        kwargs = {}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = 0x08000000  # CREATE_NO_WINDOW
+        else:
+            kwargs["start_new_session"] = True
+
+        self.process = subprocess.Popen(
+            [self.python_exec, "-u", "-c", _WORKER_SOURCE, str(self.output_dir)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.workspace,
+            env=env,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            **kwargs
+        )
+        self._responses = queue.Queue()
+        threading.Thread(
+            target=self._read_responses,
+            args=(self.process, self._responses),
+            daemon=True,
+            name="code-kernel-reader"
+        ).start()
+
+        try:
+            ready = self._responses.get(timeout=KERNEL_START_TIMEOUT)
+        except queue.Empty:
+            ready = None
+        if not ready:
+            self.stop()
+            raise KernelCrashed("kernel 启动失败")
+
+    @staticmethod
+    def _read_responses(process: subprocess.Popen, responses: "queue.Queue"):
+        """读取 worker 的响应行（EOF 时放入 None）"""
+        try:
+            for line in process.stdout:
+                responses.put(line)
+        except (OSError, ValueError):
+            pass
+        responses.put(None)
+
+    def run(self, code_file: Path, cwd: Path, timeout: int,
+            keep_state: bool = False, merge_stderr: bool = False) -> Tuple[int, str, str]:
+        """
+        在 worker 中执行代码文件
+
+        Returns:
+            (退出码, stdout, stderr)
+
+        Raises:
+            subprocess.TimeoutExpired: 超时（worker 已被终止，下次执行时重启）
+            KernelCrashed: worker 在执行过程中退出
+        """
+        with self.lock:
+            if not self.alive:
+                self._start()
+            self.last_used = time.time()
+            self.runs += 1
+
+            request = {
+                "code_file": str(code_file),
+                "cwd": str(cwd),
+                "keep_state": keep_state,
+                "merge_stderr": merge_stderr,
+            }
+            try:
+                self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+            except OSError:
+                self.stop()
+                self.restarts += 1
+                raise KernelCrashed("kernel 已退出")
+
+            try:
+                line = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                self.stop()
+                self.restarts += 1
+                raise subprocess.TimeoutExpired(str(code_file), timeout)
+            finally:
+                self.last_used = time.time()
+
+            if line is None:
+                returncode = self.process.wait()
+                self.restarts += 1
+                raise KernelCrashed(f"kernel 在执行过程中退出（exit code: {returncode}）")
+
+            response = json.loads(line)
+            return response["exit_code"], response["stdout"], response["stderr"]
+
+    def stop(self):
+        """终止 worker（包括其启动的子进程）"""
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            if sys.platform != "win32":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+
+
+# 全局 kernel 注册表：{(workspace, 解释器路径): CodeKernel}
+_kernels: Dict[Tuple[str, str], CodeKernel] = {}
+_kernels_lock = threading.Lock()
+_reaper_started = False
+
+
+def get_kernel(workspace: Path, python_exec: Path) -> CodeKernel:
+    """获取（或创建）workspace 对应的 kernel，首次调用时启动空闲回收线程"""
+    global _reaper_started
+    key = (str(workspace), str(python_exec))
+    with _kernels_lock:
+        kernel = _kernels.get(key)
+        if kernel is None:
+            kernel = CodeKernel(str(workspace), str(python_exec))
+            _kernels[key] = kernel
+        if not _reaper_started:
+            threading.Thread(target=_reap_idle_kernels, daemon=True, name="code-kernel-reaper").start()
+            _reaper_started = True
+    return kernel
+
+
+def list_kernels(workspace: Optional[Path] = None) -> List[Dict]:
+    """列出 kernel 状态（可按 workspace 筛选）"""
+    with _kernels_lock:
+        kernels = list(_kernels.values())
+    return [
+        {
+            "workspace": k.workspace,
+            "python": k.python_exec,
+            "pid": k.process.pid if k.alive else None,
+            "alive": k.alive,
+            "runs": k.runs,
+            "restarts": k.restarts,
+            "idle_seconds": round(time.time() - k.last_used, 1),
+        }
+        for k in kernels
+        if workspace is None or k.workspace == str(workspace)
+    ]
+
+
+def shutdown_kernels(workspace: Optional[Path] = None) -> int:
+    """
+    终止 kernel（下次执行时重新启动，命名空间清空）
+
+    Args:
+        workspace: 只终止该 workspace 的 kernel；None 表示全部
+
+    Returns:
+        终止的 kernel 数量
+    """
+    with _kernels_lock:
+        keys = [key for key in _kernels if workspace is None or key[0] == str(workspace)]
+        kernels = [_kernels.pop(key) for key in keys]
+    stopped = 0
+    for kernel in kernels:
+        if kernel.alive:
+            stopped += 1
+        kernel.stop()
+    return stopped
+
+
+def _reap_idle_kernels():
+    """后台线程：终止空闲超时的 worker（kernel 保留在注册表中，下次执行时重新启动）"""
+    while True:
+        time.sleep(KERNEL_REAP_INTERVAL)
+        with _kernels_lock:
+            kernels = list(_kernels.values())
+        for kernel in kernels:
+            if not kernel.alive or time.time() - kernel.last_used <= KERNEL_IDLE_TIMEOUT:
+                continue
+            # 正在执行的 kernel 不回收
+            if kernel.lock.acquire(blocking=False):
+                try:
+                    kernel.stop()
+                finally:
+                    kernel.lock.release()
+
+
+atexit.register(shutdown_kernels)
@@ -12,6 +12,9 @@ import re
 import time
 from datetime import datetime
 from .file_tools import BaseTool, get_abs_path
+from .workspace_index import iter_matches
+from .code_kernel import KernelCrashed, get_kernel, list_kernels, shutdown_kernels
+from .venv_template import create_venv_from_template, pip_install_cached, venv_python
 
 #def _create_venv(self, venv_path: Path) -> Tuple[bool, str]:重复两遍要记得同时维护。
 #为了美观，def _create_venv还是重复写两次吧，这样一个一个类比较独立。
@@ -29,7 +32,8 @@ class ExecuteCodeTool(BaseTool):
         创建虚拟环境（兼容 Anaconda 和标准 Python）
         
         策略：
-        1. 优先尝试标准 venv（CPython）
+        0. 优先从共享模板创建（叠加模板的 site-packages，见 venv_template）
+        1. 失败时尝试标准 venv（CPython）
         2. 失败时尝试 virtualenv（兼容 Anaconda）
         
         Returns:
@@ -38,6 +42,10 @@ class ExecuteCodeTool(BaseTool):
         import os
         venv_path.parent.mkdir(parents=True, exist_ok=True)
         
+        ok, _ = create_venv_from_template(venv_path)
+        if ok:
+            return True, ""
+        
         #print(f"[DEBUG] 开始创建虚拟环境: {venv_path}")
         #print(f"[DEBUG] Python 解释器: {sys.executable}")
         
@@ -96,6 +104,8 @@ class ExecuteCodeTool(BaseTool):
             timeout (int, optional): 超时时间（秒），默认30，后台执行时忽略
             background (bool, optional): 是否后台执行（不阻塞），默认False
             output_file (str, optional): 输出重定向到文件（相对路径），后台执行时必需
+            kernel (bool, optional): 是否在常驻进程中执行（已导入的库在多次执行间复用），默认False
+            keep_state (bool, optional): kernel 模式下是否保留上次执行的变量，默认False（为True时自动启用kernel）
         """
         try:
             code = parameters.get("code")
@@ -105,6 +115,8 @@ class ExecuteCodeTool(BaseTool):
             timeout = parameters.get("timeout", 30)
             background = parameters.get("background", False)
             output_file = parameters.get("output_file")
+            keep_state = parameters.get("keep_state", False)
+            use_kernel = parameters.get("kernel", False) or keep_state
             
             # 后台执行时必须指定输出文件
             if background and not output_file:
@@ -152,7 +164,8 @@ class ExecuteCodeTool(BaseTool):
             else:
                 # 直接执行
                 output = self._execute_python(
-                    workspace, exec_file, exec_dir, use_venv, timeout, output_file
+                    workspace, exec_file, exec_dir, use_venv, timeout, output_file,
+                    use_kernel=use_kernel, keep_state=keep_state
                 )
             
             return {
@@ -167,6 +180,12 @@ class ExecuteCodeTool(BaseTool):
                 "output": "",
                 "error": f"Execution timeout ({timeout}s)"
             }
+        except KernelCrashed as e:
+            return {
+                "status": "error",
+                "output": "",
+                "error": f"{e}，下次执行时将自动重启（已保留的变量丢失）"
+            }
         except Exception as e:
             return {
                 "status": "error",
@@ -198,28 +217,38 @@ class ExecuteCodeTool(BaseTool):
         else:
             return Path(sys.executable)
     
-    def _execute_python(self, workspace: Path, code_file: Path, exec_dir: Path, use_venv: bool, timeout: int, output_file: str = None) -> str:
-        """执行Python代码（直接模式）"""
+    def _execute_python(self, workspace: Path, code_file: Path, exec_dir: Path, use_venv: bool, timeout: int, output_file: str = None,
+                        use_kernel: bool = False, keep_state: bool = False) -> str:
+        """执行Python代码（直接模式，use_kernel 时在 workspace 的常驻进程中执行）"""
         python_exec = self._get_python_exec(workspace, use_venv)
+        kernel = get_kernel(workspace, python_exec) if use_kernel else None
         
         # 如果指定了输出文件，重定向输出
         if output_file:
             output_path = get_abs_path(str(workspace), output_file)
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            with open(output_path, 'w', encoding='utf-8') as out_f:
-                result = subprocess.run(
-                    [str(python_exec), str(code_file)],
-                    stdout=out_f,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    timeout=timeout,
-                    cwd=str(exec_dir),
-                    stdin=subprocess.DEVNULL
+            if kernel:
+                returncode, stdout, _ = kernel.run(
+                    code_file, exec_dir, timeout, keep_state=keep_state, merge_stderr=True
                 )
+                with open(output_path, 'w', encoding='utf-8') as out_f:
+                    out_f.write(stdout)
+            else:
+                with open(output_path, 'w', encoding='utf-8') as out_f:
+                    result = subprocess.run(
+                        [str(python_exec), str(code_file)],
+                        stdout=out_f,
+                        stderr=subprocess.STDOUT,
+                        text=True,
+                        timeout=timeout,
+                        cwd=str(exec_dir),
+                        stdin=subprocess.DEVNULL
+                    )
+                returncode = result.returncode
             
             output = f"代码执行完成，输出已保存到: {output_file}\n"
-            output += f"Exit code: {result.returncode}"
+            output += f"Exit code: {returncode}"
             
             # 读取部分输出用于显示
             try:
@@ -235,20 +264,26 @@ class ExecuteCodeTool(BaseTool):
             return output
         else:
             # 不重定向，直接捕获输出
-            result = subprocess.run(
-                [str(python_exec), str(code_file)],
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                cwd=str(exec_dir),
-                stdin=subprocess.DEVNULL
-            )
+            if kernel:
+                returncode, stdout, stderr = kernel.run(
+                    code_file, exec_dir, timeout, keep_state=keep_state
+                )
+            else:
+                result = subprocess.run(
+                    [str(python_exec), str(code_file)],
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                    cwd=str(exec_dir),
+                    stdin=subprocess.DEVNULL
+                )
+                returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
             
-            output = result.stdout
-            if result.stderr:
-                output += f"\nSTDERR:\n{result.stderr}"
-            if result.returncode != 0:
-                output += f"\nExit code: {result.returncode}"
+            output = stdout
+            if stderr:
+                output += f"\nSTDERR:\n{stderr}"
+            if returncode != 0:
+                output += f"\nExit code: {returncode}"
             
             return output
     
@@ -326,6 +361,10 @@ class PipInstallTool(BaseTool):
         import os
         venv_path.parent.mkdir(parents=True, exist_ok=True)
         
+        ok, _ = create_venv_from_template(venv_path)
+        if ok:
+            return True, ""
+        
         print(f"[DEBUG] 开始创建虚拟环境: {venv_path}")
         print(f"[DEBUG] Python 解释器: {sys.executable}")
         
@@ -409,39 +448,23 @@ class PipInstallTool(BaseTool):
                         "error": f"无法创建虚拟环境: {error_msg}"
                     }
             
-            # 获取虚拟环境的 pip
-            if sys.platform == "win32":
-                pip_exec = venv_path / "Scripts" / "pip.exe"
-            else:
-                pip_exec = venv_path / "bin" / "pip"
+            # 通过 python -m pip 调用（从模板创建的 venv 使用模板中的 pip）
+            python_exec = venv_python(venv_path)
             
-            # 安装包
+            # 安装包（经共享 wheel 缓存）
             results = []
             for package in packages:
-                # 设置环境变量，避免 Bad file descriptor
-                import os
-                env = os.environ.copy()
-                env.setdefault("PYTHONIOENCODING", "utf-8")
-                env.setdefault("PYTHONUTF8", "1")
-                
-                # Windows 下不使用 close_fds
-                close_fds = (sys.platform != "win32")
-                
-                result = subprocess.run(
-                    [str(pip_exec), "install", package],
-                    stdin=subprocess.DEVNULL,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout,
-                    env=env,
-                    close_fds=close_fds
-                )
+                result = pip_install_cached(python_exec, package, timeout)
                 
                 if result.returncode == 0:
                     results.append(f"✅ {package}: installed")
                 else:
                     results.append(f"❌ {package}: {result.stderr.strip()[:200]}")
             
+            # 常驻 kernel 中已导入的旧版本包不会自动重新加载，安装后重启
+            if shutdown_kernels(workspace):
+                results.append("🔄 代码 kernel 已重启（下次执行时加载新安装的包）")
+            
             output = "\n".join(results)
             
             return {
@@ -664,6 +687,9 @@ class GrepTool(BaseTool):
             show_line_number (bool, optional): 是否显示行号，默认True
             max_results (int, optional): 最大结果数量，默认100
             context_lines (int, optional): 显示匹配行前后的上下文行数，默认0
+            exclude (list/str, optional): 额外忽略的模式（gitignore风格），
+                默认已忽略 code_env、temp/browser、.git、node_modules 等及工作区 .gitignore
+            use_index (bool, optional): 是否使用三元组索引过滤候选文件，默认True
         """
         try:
             pattern = parameters.get("pattern")
@@ -681,6 +707,10 @@ class GrepTool(BaseTool):
             show_line_number = parameters.get("show_line_number", True)
             max_results = parameters.get("max_results", 100)
             context_lines = parameters.get("context_lines", 0)
+            exclude = parameters.get("exclude") or []
+            if isinstance(exclude, str):
+                exclude = [p for p in exclude.split(",") if p.strip()]
+            use_index = parameters.get("use_index", True)
             
             # 获取绝对路径，确保只在 workspace 内搜索
             abs_search_path = get_abs_path(task_id, search_path)
@@ -714,81 +744,28 @@ class GrepTool(BaseTool):
                     "error": f"Invalid regex pattern: {str(e)}"
                 }
             
-            # 执行搜索
+            # 执行搜索：索引过滤候选文件 + 逐行流式验证，达到 max_results 后停止遍历
             results = []
-            total_matches = 0
-            files_searched = 0
-            
-            # 获取要搜索的文件列表
-            if abs_search_path.is_file():
-                files_to_search = [abs_search_path]
-            else:
-                if recursive:
-                    files_to_search = list(abs_search_path.rglob(file_pattern))
-                else:
-                    files_to_search = list(abs_search_path.glob(file_pattern))
-                
-                # 只保留文件（排除目录）
-                files_to_search = [f for f in files_to_search if f.is_file()]
-            
-            # 搜索每个文件
-            for file_path in files_to_search:
-                if total_matches >= max_results:
-                    break
-                
-                try:
-                    # 尝试读取文件（跳过二进制文件）
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        lines = f.readlines()
-                    
-                    files_searched += 1
-                    matches_in_file = []
-                    
-                    for line_num, line in enumerate(lines, 1):
-                        if total_matches >= max_results:
-                            break
-                        
-                        if regex.search(line):
-                            total_matches += 1
-                            
-                            # 计算相对路径（相对于 workspace）
-                            try:
-                                relative_path = file_path.relative_to(workspace)
-                            except ValueError:
-                                relative_path = file_path
-                            
-                            # 构建输出行
-                            if show_line_number:
-                                match_line = f"{relative_path}:{line_num}: {line.rstrip()}"
-                            else:
-                                match_line = f"{relative_path}: {line.rstrip()}"
-                            
-                            # 添加上下文行
-                            if context_lines > 0:
-                                context = []
-                                # 前面的行
-                                for i in range(max(0, line_num - context_lines - 1), line_num - 1):
-                                    context.append(f"{relative_path}:{i+1}- {lines[i].rstrip()}")
-                                
-                                context.append(match_line)
-                                
-                                # 后面的行
-                                for i in range(line_num, min(len(lines), line_num + context_lines)):
-                                    context.append(f"{relative_path}:{i+1}- {lines[i].rstrip()}")
-                                
-                                matches_in_file.append("\n".join(context))
-                            else:
-                                matches_in_file.append(match_line)
-                    
-                    if matches_in_file:
-                        results.extend(matches_in_file)
-                
-                except (UnicodeDecodeError, PermissionError):
-                    # 跳过无法读取的文件（二进制文件或权限问题）
-                    continue
-                except Exception:
-                    # 跳过其他错误的文件
-                    continue
+            counters = {}
+            matches = iter_matches(
+                workspace, abs_search_path, regex,
+                file_pattern=file_pattern,
+                recursive=recursive,
+                show_line_number=show_line_number,
+                context_lines=context_lines,
+                exclude=exclude,
+                use_index=use_index,
+                counters=counters
+            )
+            try:
+                for match in matches:
+                    results.append(match)
+                    if len(results) >= max_results:
+                        break
+            finally:
+                matches.close()
+            total_matches = len(results)
+            files_searched = counters.get("files_searched", 0)
             
             # 构建输出
             if results:
@@ -822,7 +799,7 @@ class CodeProcessManagerTool(BaseTool):
         管理后台执行的代码进程
         
         Parameters:
-            action (str): 操作类型 'list' 或 'kill'
+            action (str): 操作类型 'list'、'kill' 或 'restart_kernel'
             process_id (str, optional): 进程ID（kill 时需要）
         """
         try:
@@ -839,11 +816,18 @@ class CodeProcessManagerTool(BaseTool):
                         "error": "process_id is required for kill action"
                     }
                 return self._kill_process(task_id, process_id)
+            elif action == "restart_kernel":
+                stopped = shutdown_kernels(Path(task_id))
+                return {
+                    "status": "success",
+                    "output": f"✅ 已重启 {stopped} 个代码 kernel（保留的变量已清空）" if stopped else "当前 workspace 没有运行中的代码 kernel",
+                    "error": ""
+                }
             else:
                 return {
                     "status": "error",
                     "output": "",
-                    "error": f"Unknown action: {action}. Use 'list' or 'kill'"
+                    "error": f"Unknown action: {action}. Use 'list', 'kill' or 'restart_kernel'"
                 }
         
         except Exception as e:
@@ -895,6 +879,12 @@ class CodeProcessManagerTool(BaseTool):
                 output += f"   启动: {proc['start_time']}\n"
                 output += f"   状态: {proc['status']}\n\n"
         
+        kernels = [k for k in list_kernels(Path(task_id)) if k["alive"]]
+        if kernels:
+            output += f"\n\n代码 kernel（共 {len(kernels)} 个）:\n"
+            for k in kernels:
+                output += f"   PID: {k['pid']}  解释器: {k['python']}  执行次数: {k['runs']}  空闲: {k['idle_seconds']}s\n"
+        
         return {
             "status": "success",
             "output": output,
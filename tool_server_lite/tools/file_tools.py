@@ -5,8 +5,14 @@
 """
 
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from array import array
+from collections import OrderedDict
+from itertools import islice
+import os
 import shutil
+import threading
+import time
 import chardet
 
 
@@ -85,6 +91,305 @@ def is_binary_file(file_path: Path) -> bool:
         return False
 
 
+# 行偏移索引：每 LINE_INDEX_STEP 行记录一个字节偏移（稀疏索引，超大文件也只占很少内存）
+LINE_INDEX_STEP = 1024
+LINE_INDEX_CACHE_SIZE = 64
+# 缓存项：(mtime, size, 检查点偏移数组, 总行数)；总行数为 None 表示索引只扫描到了文件中部
+_line_index_cache: "OrderedDict[str, Tuple[int, int, array, Optional[int]]]" = OrderedDict()
+_line_index_lock = threading.Lock()
+
+
+def _build_line_index(file_path: Path, checkpoints: Optional[array] = None,
+                      upto_line: Optional[int] = None) -> Tuple[array, Optional[int]]:
+    """
+    流式扫描文件，返回 (检查点偏移数组, 总行数)
+
+    Args:
+        checkpoints: 已有的检查点，从最后一个检查点继续扫描（文件追加写入后无需从头重建）
+        upto_line: 只需要定位到该行（从0开始）时，扫描到覆盖它的检查点即停止，此时总行数为 None
+    """
+    checkpoints = array('Q', checkpoints or [0])
+    lines = (len(checkpoints) - 1) * LINE_INDEX_STEP
+    offset = checkpoints[-1]
+    stop = upto_line // LINE_INDEX_STEP if upto_line is not None else None
+    if stop is not None and len(checkpoints) > stop:
+        return checkpoints, None
+    last_byte = b"\n"
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            pos = chunk.find(b"\n")
+            while pos != -1:
+                lines += 1
+                if lines % LINE_INDEX_STEP == 0:
+                    checkpoints.append(offset + pos + 1)
+                    if stop is not None and len(checkpoints) > stop:
+                        return checkpoints, None
+                pos = chunk.find(b"\n", pos + 1)
+            offset += len(chunk)
+            last_byte = chunk[-1:]
+    # 最后一行没有换行符时也算一行（与 readlines 一致）
+    if last_byte != b"\n":
+        lines += 1
+    return checkpoints, lines
+
+
+def _is_appended(file_path: Path, checkpoints: array) -> bool:
+    """粗略判断文件是否只是在末尾追加：最后一个检查点之前仍是换行符"""
+    offset = checkpoints[-1]
+    if offset == 0:
+        return True
+    try:
+        with open(file_path, 'rb') as f:
+            f.seek(offset - 1)
+            return f.read(1) == b"\n"
+    except OSError:
+        return False
+
+
+def get_line_index(file_path: Path, upto_line: Optional[int] = None) -> Tuple[array, Optional[int]]:
+    """
+    获取文件的行偏移索引（按 mtime + size 缓存）
+
+    文件只变大时从缓存的最后一个检查点继续扫描；upto_line 给定时只保证能定位到该行，
+    返回的总行数可能为 None。
+    """
+    stat = os.stat(file_path)
+    key = str(file_path)
+    base = None
+    with _line_index_lock:
+        cached = _line_index_cache.get(key)
+        if cached:
+            _line_index_cache.move_to_end(key)
+            checkpoints, total = cached[2], cached[3]
+            if cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                if total is not None or (upto_line is not None
+                                         and len(checkpoints) > upto_line // LINE_INDEX_STEP):
+                    return checkpoints, total
+                base = checkpoints
+            elif stat.st_size > cached[1]:
+                base = checkpoints
+    if base is not None and not _is_appended(file_path, base):
+        base = None
+    checkpoints, total = _build_line_index(file_path, base, upto_line)
+    with _line_index_lock:
+        _line_index_cache[key] = (stat.st_mtime_ns, stat.st_size, checkpoints, total)
+        _line_index_cache.move_to_end(key)
+        while len(_line_index_cache) > LINE_INDEX_CACHE_SIZE:
+            _line_index_cache.popitem(last=False)
+    return checkpoints, total
+
+
+_LINE_ENDINGS = '\n\r'
+
+
+def _decode_line(raw: bytes, encoding: str) -> str:
+    try:
+        text = raw.decode(encoding)
+    except (UnicodeDecodeError, LookupError):
+        text = raw.decode('utf-8', errors='ignore')
+    # 与文本模式读取一致：\r\n 统一为 \n
+    if text.endswith('\r\n'):
+        text = text[:-2] + '\n'
+    return text
+
+
+def read_line_range(file_path: Path, encoding: str, start_line: Optional[int] = None,
+                    end_line: Optional[int] = None,
+                    need_total: bool = True) -> Tuple[Iterator[str], int, Optional[int]]:
+    """
+    按行范围流式读取文件（通过行偏移索引直接定位，不读取范围之外的内容）
+
+    Args:
+        start_line: 起始行号（从1开始），None 表示从头开始
+        end_line: 结束行号（包含），None 表示到文件末尾
+        need_total: 是否需要文件总行数；为 False 时只索引到起始行，总行数返回 None
+
+    Returns:
+        (行迭代器（保留换行符）, 第一行的行号, 文件总行数)
+    """
+    start_idx = (start_line - 1) if start_line else 0
+    start_idx = max(start_idx, 0)
+
+    try:
+        ascii_compatible = "\n".encode(encoding) == b"\n"
+    except LookupError:
+        encoding, ascii_compatible = 'utf-8', True
+
+    if not ascii_compatible:
+        # UTF-16 等编码无法按字节切分行：按文本流式读取
+        def open_text():
+            try:
+                f = open(file_path, 'r', encoding=encoding)
+                f.readline()
+                f.seek(0)
+                return f
+            except UnicodeDecodeError:
+                f.close()
+                return open(file_path, 'r', encoding='utf-8', errors='ignore')
+
+        total = None
+        if need_total:
+            with open_text() as f:
+                total = sum(1 for _ in f)
+        end_idx = end_line if end_line else total
+        if end_idx is not None and total is not None:
+            end_idx = min(end_idx, total)
+
+        def iter_text():
+            with open_text() as f:
+                yield from islice(f, start_idx, max(start_idx, end_idx) if end_idx is not None else None)
+        return iter_text(), start_idx + 1, total
+
+    if need_total:
+        checkpoints, total = get_line_index(file_path)
+    else:
+        checkpoints, total = get_line_index(file_path, upto_line=start_idx)
+    end_idx = end_line if end_line else total
+    if end_idx is not None and total is not None:
+        end_idx = min(end_idx, total)
+
+    def iter_bytes():
+        if end_idx is not None and start_idx >= end_idx:
+            return
+        checkpoint = min(start_idx // LINE_INDEX_STEP, len(checkpoints) - 1)
+        with open(file_path, 'rb') as f:
+            f.seek(checkpoints[checkpoint])
+            for _ in range(start_idx - checkpoint * LINE_INDEX_STEP):
+                f.readline()
+            remaining = end_idx - start_idx if end_idx is not None else None
+            while remaining is None or remaining > 0:
+                raw = f.readline()
+                if not raw:
+                    break
+                if remaining is not None:
+                    remaining -= 1
+                yield _decode_line(raw, encoding)
+
+    return iter_bytes(), start_idx + 1, total
+
+
+def format_lines(lines: Iterator[str], first_line: int, show_line_numbers: bool,
+                 line_format: str = "json") -> str:
+    """
+    格式化行内容
+
+    line_format:
+        "json": [{"line": 1, "content": "..."}]（默认）
+        "text": 每行 "行号\t内容"，体积远小于JSON
+    """
+    if not show_line_numbers:
+        return ''.join(lines)
+    if line_format == "text":
+        numbered = []
+        for i, line in enumerate(lines, start=first_line):
+            numbered.append(f"{i}\t{line.rstrip(_LINE_ENDINGS)}")
+        return '\n'.join(numbered)
+    import json
+    return json.dumps(
+        [{"line": i, "content": line.rstrip('\n\r')} for i, line in enumerate(lines, start=first_line)],
+        ensure_ascii=False, indent=2
+    )
+
+
+# 多文件读取：并发数与默认输出预算
+MULTI_READ_WORKERS = 8
+MULTI_READ_BUDGET_BYTES = 512 * 1024
+SNIFF_CACHE_SIZE = 2048
+_sniff_cache: "OrderedDict[str, Tuple[int, int, bool, str]]" = OrderedDict()
+_sniff_lock = threading.Lock()
+_read_executor = None
+_read_executor_lock = threading.Lock()
+
+
+def _get_read_executor():
+    """多文件读取共享的有界线程池（首次使用时创建）"""
+    global _read_executor
+    if _read_executor is None:
+        with _read_executor_lock:
+            if _read_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _read_executor = ThreadPoolExecutor(
+                    max_workers=MULTI_READ_WORKERS, thread_name_prefix="file-read"
+                )
+    return _read_executor
+
+
+def sniff_file(file_path: Path) -> Tuple[bool, str]:
+    """
+    一次打开同时判断是否为二进制文件并检测编码（按 mtime + size 缓存）
+
+    判定规则与 is_binary_file / detect_encoding 相同。
+
+    Returns:
+        (是否为二进制文件, 编码)
+    """
+    stat = os.stat(file_path)
+    key = str(file_path)
+    with _sniff_lock:
+        cached = _sniff_cache.get(key)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            _sniff_cache.move_to_end(key)
+            return cached[2], cached[3]
+
+    binary, encoding = False, 'utf-8'
+    if file_path.suffix.lower() in BINARY_EXTENSIONS:
+        binary = True
+    else:
+        try:
+            with open(file_path, 'rb') as f:
+                head = f.read(10240)
+            binary = b'\x00' in head[:1024]
+            if not binary:
+                encoding = chardet.detect(head).get('encoding') or 'utf-8'
+        except Exception:
+            pass
+
+    with _sniff_lock:
+        _sniff_cache[key] = (stat.st_mtime_ns, stat.st_size, binary, encoding)
+        _sniff_cache.move_to_end(key)
+        while len(_sniff_cache) > SNIFF_CACHE_SIZE:
+            _sniff_cache.popitem(last=False)
+    return binary, encoding
+
+
+def _read_for_batch(task_id: str, path: str, encoding: Optional[str], start_line: Optional[int],
+                    end_line: Optional[int], max_bytes: int) -> Dict[str, Any]:
+    """批量读取中的单个文件：一次打开完成二进制/编码嗅探，最多读取 max_bytes 字节的行"""
+    abs_path = get_abs_path(task_id, path)
+    
+    # 检查文件是否存在
+    if not abs_path.exists():
+        return {"status": "error", "error": f"File not found: {path}", "message": f"File not found: {path}"}
+    
+    binary, detected = sniff_file(abs_path)
+    if binary:
+        return {"status": "error", "error": "Binary file, use other tools",
+                "message": f"Cannot read binary file: {path}"}
+    
+    lines_iter, first_line, total = read_line_range(abs_path, encoding or detected, start_line, end_line)
+    lines, size = [], 0
+    for line in lines_iter:
+        lines.append(line)
+        size += len(line.encode('utf-8'))
+        if size > max_bytes:
+            break
+    lines_iter.close()
+    
+    last_line = min(end_line, total) if end_line else total
+    return {
+        "status": "success",
+        "lines": lines,
+        "bytes": size,
+        "first_line": first_line,
+        "range_lines": max(0, last_line - first_line + 1),
+        "total_lines": total,
+    }
+
+
 class FileReadTool(BaseTool):
     """文件读取工具"""
     
@@ -99,6 +404,8 @@ class FileReadTool(BaseTool):
             end_line (int, optional): 结束行号
             encoding (str, optional): 文件编码
             show_line_numbers (bool, optional): 是否显示行号，默认 True
+            line_format (str, optional): 带行号时的格式，"json"（默认）或 "text"（每行 "行号\t内容"）
+            max_total_bytes (int, optional): 多文件模式下所有文件的总输出预算（字节），默认 512KB
         """
         try:
             # 兼容 path 和 file_path 两种参数名
@@ -143,6 +450,7 @@ class FileReadTool(BaseTool):
         end_line = parameters.get("end_line")
         encoding = parameters.get("encoding")
         show_line_numbers = parameters.get("show_line_numbers", True)
+        line_format = parameters.get("line_format", "json")
         
         abs_path = get_abs_path(task_id, path)
         
@@ -166,34 +474,9 @@ class FileReadTool(BaseTool):
         if not encoding:
             encoding = detect_encoding(abs_path)
         
-        # 读取文件
-        try:
-            with open(abs_path, 'r', encoding=encoding) as f:
-                lines = f.readlines()
-        except UnicodeDecodeError:
-            # 如果指定编码失败，尝试 utf-8
-            with open(abs_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-        
-        # 处理行范围
-        start_idx = (start_line - 1) if start_line else 0
-        end_idx = end_line if end_line else len(lines)
-        selected_lines = lines[start_idx:end_idx]
-        
-        # 格式化输出
-        if show_line_numbers:
-            # 带行号格式
-            import json
-            output_lines = []
-            for i, line in enumerate(selected_lines, start=start_idx + 1):
-                output_lines.append({
-                    "line": i,
-                    "content": line.rstrip('\n\r')
-                })
-            content = json.dumps(output_lines, ensure_ascii=False, indent=2)
-        else:
-            # 纯文本格式
-            content = ''.join(selected_lines)
+        # 按行范围流式读取（行偏移索引只扫描到起始行，不需要总行数）
+        lines, first_line, _ = read_line_range(abs_path, encoding, start_line, end_line, need_total=False)
+        content = format_lines(lines, first_line, show_line_numbers, line_format)
         
         return {
             "status": "success",
@@ -202,81 +485,94 @@ class FileReadTool(BaseTool):
         }
     
     def _read_multiple_files(self, task_id: str, paths: list, parameters: Dict[str, Any]) -> Dict[str, Any]:
-        """读取多个文件"""
+        """
+        读取多个文件（有界线程池并发读取）
+        
+        所有文件共享 max_total_bytes 的输出预算：小文件完整返回，剩余预算在大文件间平分，
+        超出部分按行截断并在结果中标注 truncated / note。
+        """
         import json
         
         start_line = parameters.get("start_line")
         end_line = parameters.get("end_line")
         encoding = parameters.get("encoding")
         show_line_numbers = parameters.get("show_line_numbers", True)
+        line_format = parameters.get("line_format", "json")
+        budget = int(parameters.get("max_total_bytes") or MULTI_READ_BUDGET_BYTES)
+        
+        # 并发读取（每个文件最多读取整个预算的内容）
+        executor = _get_read_executor()
+        futures = [
+            executor.submit(_read_for_batch, task_id, path, encoding, start_line, end_line, budget)
+            for path in paths
+        ]
+        reads = []
+        for path, future in zip(paths, futures):
+            try:
+                reads.append(future.result())
+            except Exception as e:
+                reads.append({"status": "error", "error": str(e), "message": f"{path}: {str(e)}"})
+        
+        # 分配输出预算：按大小从小到大，每个文件最多获得剩余预算的平均份额
+        allowances = {}
+        ok = sorted(
+            (i for i, r in enumerate(reads) if r["status"] == "success"),
+            key=lambda i: reads[i]["bytes"]
+        )
+        remaining = budget
+        for n, i in enumerate(ok):
+            share = remaining // (len(ok) - n)
+            allowances[i] = min(reads[i]["bytes"], share)
+            remaining -= allowances[i]
         
         results = {}
         errors = []
         success_count = 0
         
-        for path in paths:
-            try:
-                abs_path = get_abs_path(task_id, path)
-                
-                # 检查文件是否存在
-                if not abs_path.exists():
-                    errors.append(f"File not found: {path}")
-                    results[path] = {
-                        "status": "error",
-                        "error": f"File not found: {path}"
-                    }
-                    continue
-                
-                # 检查是否为二进制文件
-                if is_binary_file(abs_path):
-                    errors.append(f"Cannot read binary file: {path}")
-                    results[path] = {
-                        "status": "error",
-                        "error": f"Binary file, use other tools"
-                    }
-                    continue
-                
-                # 自动检测编码
-                file_encoding = encoding or detect_encoding(abs_path)
-                
-                # 读取文件
-                try:
-                    with open(abs_path, 'r', encoding=file_encoding) as f:
-                        lines = f.readlines()
-                except UnicodeDecodeError:
-                    with open(abs_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        lines = f.readlines()
-                
-                # 处理行范围
-                start_idx = (start_line - 1) if start_line else 0
-                end_idx = end_line if end_line else len(lines)
-                selected_lines = lines[start_idx:end_idx]
-                
-                # 格式化内容
-                if show_line_numbers:
-                    output_lines = []
-                    for i, line in enumerate(selected_lines, start=start_idx + 1):
-                        output_lines.append({
-                            "line": i,
-                            "content": line.rstrip('\n\r')
-                        })
-                    content = output_lines  # 保持为列表，稍后统一序列化
-                else:
-                    content = ''.join(selected_lines)
-                
-                results[path] = {
-                    "status": "success",
-                    "content": content,
-                    "total_lines": len(lines)
-                }
-                success_count += 1
-                
-            except Exception as e:
-                errors.append(f"{path}: {str(e)}")
+        for i, (path, read) in enumerate(zip(paths, reads)):
+            if read["status"] != "success":
+                errors.append(read["message"])
                 results[path] = {
                     "status": "error",
-                    "error": str(e)
+                    "error": read["error"]
                 }
+                continue
+            
+            lines = read["lines"]
+            kept, used = [], 0
+            for line in lines:
+                size = len(line.encode('utf-8'))
+                if used + size > allowances[i]:
+                    break
+                kept.append(line)
+                used += size
+            
+            first_line = read["first_line"]
+            if show_line_numbers and line_format != "text":
+                content = [
+                    {"line": n, "content": line.rstrip('\n\r')}
+                    for n, line in enumerate(kept, start=first_line)
+                ]  # 保持为列表，稍后统一序列化
+            else:
+                content = format_lines(kept, first_line, show_line_numbers, line_format)
+            
+            entry = {
+                "status": "success",
+                "content": content,
+                "total_lines": read["total_lines"]
+            }
+            if len(kept) < read["range_lines"]:
+                last_shown = first_line + len(kept) - 1
+                entry["truncated"] = True
+                entry["note"] = (
+                    f"Output budget reached: showing lines {first_line}-{last_shown} of "
+                    f"{read['total_lines']}. Read this file alone or use start_line/end_line for the rest."
+                    if kept else
+                    f"Output budget reached: no lines shown ({read['total_lines']} lines). "
+                    f"Read this file alone or use start_line/end_line."
+                )
+            results[path] = entry
+            success_count += 1
         
         # 构建输出
         output_data = {
@@ -381,6 +677,68 @@ class FileWriteTool(BaseTool):
             }
 
 
+# 目录快照缓存：目录路径 → (目录mtime, [(名称, 是否目录, 是否符号链接)])，目录mtime变化时重新扫描
+# 只缓存名称和类型（文件内容修改不改变目录mtime，大小在汇总时才读取）
+DIR_SNAPSHOT_CACHE_SIZE = 20000
+# 被剪枝子树的汇总最多统计的条目数
+DIR_ROLLUP_LIMIT = 20000
+DIR_SNAPSHOT_RACY_NS = 2_000_000_000
+_dir_snapshots: "OrderedDict[str, Tuple[int, List[Tuple[str, bool, bool]]]]" = OrderedDict()
+_dir_snapshots_lock = threading.Lock()
+
+
+def scan_dir(dir_path: str) -> List[Tuple[str, bool, bool]]:
+    """
+    列出目录（os.scandir，按名称排序），目录mtime未变化时直接复用快照
+
+    Returns:
+        [(名称, 是否目录, 是否符号链接)]，符号链接按其目标判断是否目录（每次调用时重新判断）
+    """
+    mtime = os.stat(dir_path).st_mtime_ns
+    with _dir_snapshots_lock:
+        cached = _dir_snapshots.get(dir_path)
+        if cached and cached[0] == mtime:
+            _dir_snapshots.move_to_end(dir_path)
+            entries = cached[1]
+        else:
+            entries = None
+
+    if entries is None:
+        entries = []
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                try:
+                    is_link = entry.is_symlink()
+                    is_dir = not is_link and entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir, is_link = False, False
+                entries.append((entry.name, is_dir, is_link))
+        entries.sort()
+
+        # 刚被修改的目录不缓存：同一mtime精度内的后续修改无法被察觉
+        if time.time_ns() - mtime >= DIR_SNAPSHOT_RACY_NS:
+            with _dir_snapshots_lock:
+                _dir_snapshots[dir_path] = (mtime, entries)
+                _dir_snapshots.move_to_end(dir_path)
+                while len(_dir_snapshots) > DIR_SNAPSHOT_CACHE_SIZE:
+                    _dir_snapshots.popitem(last=False)
+
+    # 符号链接的目标可能在目录mtime不变时改变，不缓存其类型
+    if any(is_link for _, _, is_link in entries):
+        entries = [
+            (name, os.path.isdir(os.path.join(dir_path, name)) if is_link else is_dir, is_link)
+            for name, is_dir, is_link in entries
+        ]
+    return entries
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
 class DirListTool(BaseTool):
     """目录列表工具"""
     
@@ -391,10 +749,19 @@ class DirListTool(BaseTool):
         Parameters:
             path (str): 相对路径，默认 '.'
             recursive (bool): 是否递归列出子目录，默认 False
+            max_depth (int, optional): 递归的最大深度（1 表示只列出第一层），默认不限制
+            max_entries (int, optional): 最多输出的条目数，默认 1000
+            exclude (list/str, optional): 额外排除的模式（gitignore风格），
+                默认已排除 code_env、temp/browser、.git、node_modules 等及工作区 .gitignore
         """
         try:
             path = parameters.get("path", ".")
             recursive = parameters.get("recursive", False)
+            max_depth = parameters.get("max_depth")
+            max_entries = int(parameters.get("max_entries") or 1000)
+            exclude = parameters.get("exclude") or []
+            if isinstance(exclude, str):
+                exclude = [p for p in exclude.split(",") if p.strip()]
             abs_path = get_abs_path(task_id, path)
             
             if not abs_path.exists():
@@ -412,13 +779,31 @@ class DirListTool(BaseTool):
                 }
             
             if recursive:
-                items = self._list_recursive(abs_path, abs_path)
+                from .workspace_index import IgnoreRules
+                workspace = Path(task_id)
+                rel_root = os.path.relpath(str(abs_path), str(workspace)).replace(os.sep, "/")
+                rules = IgnoreRules.for_workspace(workspace, exclude)
+                # 明确列出被排除的目录（如 code_env）时不使用默认排除规则
+                if rel_root != "." and rules.match_any_ancestor(rel_root):
+                    rules = IgnoreRules.for_workspace(workspace, exclude, use_defaults=False)
+                items = []
+                truncated = self._list_recursive(
+                    str(abs_path), str(workspace), rules, items,
+                    max_depth=int(max_depth) if max_depth is not None else None,
+                    max_entries=max_entries
+                )
             else:
                 items = []
-                for item in sorted(abs_path.iterdir()):
-                    item_type = "dir" if item.is_dir() else "file"
-                    items.append(f"[{item_type}] {item.name}")
+                truncated = False
+                for name, is_dir, _ in scan_dir(str(abs_path)):
+                    if len(items) >= max_entries:
+                        truncated = True
+                        break
+                    item_type = "dir" if is_dir else "file"
+                    items.append(f"[{item_type}] {name}")
             
+            if truncated:
+                items.append(f"... (truncated: reached max_entries={max_entries})")
             output = "\n".join(items) if items else "(empty directory)"
             
             return {
@@ -434,28 +819,83 @@ class DirListTool(BaseTool):
                 "error": str(e)
             }
     
-    def _list_recursive(self, root: Path, current: Path, indent: int = 0) -> list:
-        """递归列出目录内容，排除 code_env 目录"""
-        items = []
+    def _list_recursive(self, current: str, workspace: str, rules, items: list,
+                        indent: int = 0, max_depth: Optional[int] = None,
+                        max_entries: int = 1000, ancestors: Tuple[str, ...] = ()) -> bool:
+        """
+        递归列出目录内容（排除的目录只显示一行，超过深度的目录显示汇总）
+        
+        指向目录的符号链接显示为 [dir] 并展开，指向自身祖先的链接不展开（避免循环）
         
+        Returns:
+            是否因达到 max_entries 而截断
+        """
         try:
-            for item in sorted(current.iterdir()):
-                # 跳过 code_env 目录
-                if item.name == "code_env":
-                    continue
-                
-                # 只显示当前项的名称（不带父路径）
-                indent_str = "  " * indent
-                item_type = "dir" if item.is_dir() else "file"
-                items.append(f"{indent_str}[{item_type}] {item.name}")
-                
-                # 如果是目录且不是 code_env，递归处理
-                if item.is_dir():
-                    items.extend(self._list_recursive(root, item, indent + 1))
-        except PermissionError:
-            pass
+            entries = scan_dir(current)
+        except (PermissionError, FileNotFoundError):
+            return False
         
-        return items
+        ancestors = ancestors + (os.path.realpath(current),)
+        indent_str = "  " * indent
+        for name, is_dir, is_link in entries:
+            if len(items) >= max_entries:
+                return True
+            
+            child = os.path.join(current, name)
+            rel = os.path.relpath(child, workspace).replace(os.sep, "/")
+            item_type = "dir" if is_dir else "file"
+            
+            if rules.match(rel, is_dir):
+                if is_dir:
+                    items.append(f"{indent_str}[dir] {name} (excluded)")
+                continue
+            
+            if not is_dir:
+                items.append(f"{indent_str}[{item_type}] {name}")
+                continue
+            
+            if is_link and os.path.realpath(child) in ancestors:
+                items.append(f"{indent_str}[dir] {name} (symlink loop)")
+                continue
+            
+            if max_depth is not None and indent + 1 >= max_depth:
+                items.append(f"{indent_str}[dir] {name} ({self._rollup(child)})")
+                continue
+            
+            items.append(f"{indent_str}[dir] {name}")
+            if self._list_recursive(child, workspace, rules, items, indent + 1, max_depth, max_entries, ancestors):
+                return True
+        return False
+    
+    def _rollup(self, dir_path: str) -> str:
+        """
+        统计被剪枝子树的文件数、目录数和总大小（最多统计 DIR_ROLLUP_LIMIT 个条目）
+        
+        文件大小在此时读取（不缓存）；符号链接不展开，大小按链接本身计
+        """
+        files = dirs = size = seen = 0
+        stack = [dir_path]
+        while stack and seen < DIR_ROLLUP_LIMIT:
+            current = stack.pop()
+            try:
+                entries = scan_dir(current)
+            except OSError:
+                continue
+            for name, is_dir, is_link in entries:
+                seen += 1
+                path = os.path.join(current, name)
+                if is_dir:
+                    dirs += 1
+                    if not is_link:
+                        stack.append(path)
+                    continue
+                files += 1
+                try:
+                    size += os.lstat(path).st_size
+                except OSError:
+                    pass
+        more = "+" if stack or seen >= DIR_ROLLUP_LIMIT else ""
+        return f"{files}{more} files, {dirs}{more} dirs, {_format_size(size)}{more}"
 
 
 class DirCreateTool(BaseTool):
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享虚拟环境模板 + 本地 wheel 缓存
+
+所有 workspace 共用一个预热的模板 venv（~/mla_v3/venv_templates/<key>/venv，
+包含 pip 和 MLA_VENV_TEMPLATE_PACKAGES 中的包）。新 workspace 的 venv 不带 pip，
+只通过 .pth 文件叠加模板的 site-packages：创建只需几十毫秒，模板中的包不在每个 workspace 重复安装；
+workspace 中安装的包位于自身 site-packages，优先于模板。
+pip_install 先从共享 wheel 缓存离线安装，缓存未命中时下载/构建 wheel 到缓存后再安装。
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+VENV_TEMPLATE_ROOT = Path.home() / "mla_v3" / "venv_templates"
+WHEEL_CACHE_DIR = VENV_TEMPLATE_ROOT / "wheels"
+# 设置为 0/false/off 时不使用模板（每个 workspace 独立创建完整 venv）
+TEMPLATE_ENABLED = os.environ.get("MLA_VENV_TEMPLATE", "1").lower() not in ("0", "false", "off")
+# 预装到模板中的包（逗号分隔），如 "numpy,pandas,matplotlib"
+TEMPLATE_PACKAGES = [p.strip() for p in os.environ.get("MLA_VENV_TEMPLATE_PACKAGES", "").split(",") if p.strip()]
+# workspace venv 中指向模板 site-packages 的 .pth 文件名
+OVERLAY_PTH_NAME = "_mla_venv_template.pth"
+
+_template_lock = threading.Lock()
+
+
+def venv_python(venv_path: Path) -> Path:
+    """venv 中的 Python 解释器路径"""
+    if sys.platform == "win32":
+        return venv_path / "Scripts" / "python.exe"
+    return venv_path / "bin" / "python"
+
+
+def _site_packages(venv_path: Path) -> Optional[Path]:
+    """venv 的 site-packages 目录"""
+    if sys.platform == "win32":
+        candidates = [venv_path / "Lib" / "site-packages"]
+    else:
+        candidates = sorted(venv_path.glob("lib/python*/site-packages"))
+    for candidate in candidates:
+        if candidate.is_dir():
+            return candidate
+    return None
+
+
+def _subprocess_env() -> dict:
+    env = os.environ.copy()
+    env.setdefault("PYTHONIOENCODING", "utf-8")
+    env.setdefault("PYTHONUTF8", "1")
+    env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+    return env
+
+
+def _run(cmd: List[str], timeout: float) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        env=_subprocess_env(),
+        close_fds=(sys.platform != "win32")
+    )
+
+
+def _template_key() -> str:
+    """解释器 + 版本 + 预装包列表决定模板（变化时自动重建新模板）"""
+    source = "|".join([sys.executable, sys.version, ",".join(sorted(TEMPLATE_PACKAGES))])
+    return hashlib.md5(source.encode("utf-8")).hexdigest()[:12]
+
+
+def get_template() -> Optional[Path]:
+    """
+    获取模板 venv（首次调用时构建）
+
+    构建在临时目录中进行，完成后原子重命名，多个进程同时构建时以先完成者为准。
+
+    Returns:
+        模板 venv 路径；模板被禁用或构建失败时返回 None
+    """
+    if not TEMPLATE_ENABLED:
+        return None
+
+    template_dir = VENV_TEMPLATE_ROOT / _template_key()
+    template_venv = template_dir / "venv"
+    if _site_packages(template_venv):
+        return template_venv
+
+    with _template_lock:
+        if _site_packages(template_venv):
+            return template_venv
+
+        build_dir = VENV_TEMPLATE_ROOT / f".build_{_template_key()}_{os.getpid()}"
+        shutil.rmtree(build_dir, ignore_errors=True)
+        build_venv = build_dir / "venv"
+        try:
+            print(f"🔧 构建共享 venv 模板: {template_venv}")
+            res = _run([sys.executable, "-m", "venv", str(build_venv)], timeout=300)
+            if res.returncode != 0:
+                raise RuntimeError((res.stderr or res.stdout)[:400])
+
+            if TEMPLATE_PACKAGES:
+                WHEEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                res = _run(
+                    [str(venv_python(build_venv)), "-m", "pip", "install",
+                     "--find-links", str(WHEEL_CACHE_DIR), *TEMPLATE_PACKAGES],
+                    timeout=1800
+                )
+                if res.returncode != 0:
+                    # 预装失败不影响模板使用，缺少的包由各 workspace 自行安装
+                    print(f"⚠️ 模板预装包失败: {(res.stderr or res.stdout).strip()[:200]}")
+
+            # activate 等脚本记录了构建目录的绝对路径，移动后在最终位置重新生成（pip 统一通过 python -m pip 调用）
+            template_dir.mkdir(parents=True, exist_ok=True)
+            try:
+                os.rename(build_venv, template_venv)
+            except OSError:
+                # 其他进程已完成构建
+                if not _site_packages(template_venv):
+                    raise
+            else:
+                _run([sys.executable, "-m", "venv", "--upgrade", str(template_venv)], timeout=300)
+            return template_venv if _site_packages(template_venv) else None
+        except Exception as e:
+            print(f"⚠️ 共享 venv 模板构建失败，使用独立 venv: {str(e)[:200]}")
+            return None
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def create_venv_from_template(venv_path: Path) -> Tuple[bool, str]:
+    """
+    从共享模板创建 workspace 的 venv（不带 pip，通过 .pth 叠加模板的 site-packages）
+
+    Returns:
+        (是否成功创建, 错误信息)；失败时已清理残留目录，调用方可改用完整创建
+    """
+    template_venv = get_template()
+    if template_venv is None:
+        return False, "venv template unavailable"
+
+    try:
+        import venv
+        venv_path.parent.mkdir(parents=True, exist_ok=True)
+        venv.EnvBuilder(with_pip=False, symlinks=(sys.platform != "win32")).create(str(venv_path))
+
+        site_packages = _site_packages(venv_path)
+        template_site = _site_packages(template_venv)
+        if site_packages is None or template_site is None:
+            raise RuntimeError("site-packages not found")
+        (site_packages / OVERLAY_PTH_NAME).write_text(str(template_site) + "\n", encoding="utf-8")
+        return True, ""
+    except Exception as e:
+        shutil.rmtree(venv_path, ignore_errors=True)
+        return False, str(e)
+
+
+def pip_install_cached(python_exec: Path, package: str, timeout: float) -> subprocess.CompletedProcess:
+    """
+    通过共享 wheel 缓存安装包
+
+    1. 仅从缓存离线安装（无网络请求）
+    2. 缓存未命中：下载/构建 wheel（含依赖）到缓存后离线安装
+    3. 仍失败（如 -e、本地路径）：直接在线安装
+
+    Raises:
+        subprocess.TimeoutExpired: 总耗时超过 timeout
+    """
+    deadline = time.time() + timeout
+
+    def remaining() -> float:
+        return max(1.0, deadline - time.time())
+
+    python = str(python_exec)
+    wheels = str(WHEEL_CACHE_DIR)
+    offline = [python, "-m", "pip", "install", "--no-index", "--find-links", wheels, package]
+
+    WHEEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    result = _run(offline, remaining())
+    if result.returncode == 0:
+        return result
+
+    built = _run([python, "-m", "pip", "wheel", "--wheel-dir", wheels, "--find-links", wheels, package], remaining())
+    if built.returncode == 0:
+        result = _run(offline, remaining())
+        if result.returncode == 0:
+            return result
+
+    return _run([python, "-m", "pip", "install", package], remaining())
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工作区搜索索引 - GrepTool 的候选文件过滤
+
+- 忽略规则：默认跳过 code_env、temp/browser、.git、node_modules 等目录，
+  并读取工作区根目录的 .gitignore（简化语义：不支持 ! 取反）
+- 三元组索引：每个文本文件保存一个三元组位图（布隆过滤器），按 (mtime, size) 增量更新，
+  只为匹配 file_pattern 的文件建立，建立时读取的内容直接用于逐行验证（每个文件只读一次）；
+  搜索时从正则中提取必需的字面量，只有位图包含全部三元组的文件才会被逐行验证；
+  位图总大小受 INDEX_MAX_BYTES 限制，超出时按最近使用淘汰
+- 逐行流式扫描，达到 max_results 后立即停止
+"""
+
+import io
+import os
+import fnmatch
+import threading
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .file_tools import BINARY_EXTENSIONS
+
+
+# 默认忽略的目录/文件（gitignore风格）
+DEFAULT_IGNORE_PATTERNS = (
+    ".git/",
+    "code_env/",
+    "temp/browser/",
+    "node_modules/",
+    "__pycache__/",
+    ".venv/",
+    "venv/",
+    ".mypy_cache/",
+    ".pytest_cache/",
+)
+
+# 超过该大小的文件不建立位图（总是作为候选，流式扫描）
+MAX_INDEXED_FILE_BYTES = 2 * 1024 * 1024
+# 进程内所有工作区索引的位图总大小上限
+INDEX_MAX_BYTES = 64 * 1024 * 1024
+
+
+class IgnoreRules:
+    """
+    gitignore风格的忽略规则
+
+    - 不含 / 的模式匹配任意层级的名称（如 "*.log"、"node_modules"）
+    - 含 / 的模式相对于工作区根目录匹配（如 "temp/browser"）
+    - 以 / 结尾的模式只匹配目录
+    """
+
+    def __init__(self, patterns: Optional[List[str]] = None):
+        self.rules: List[Tuple[str, bool, bool]] = []  # (模式, 是否锚定路径, 是否只匹配目录)
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    def add(self, pattern: str):
+        pattern = (pattern or "").strip()
+        if not pattern or pattern.startswith("#") or pattern.startswith("!"):
+            return
+        dir_only = pattern.endswith("/")
+        pattern = pattern.strip("/")
+        if not pattern:
+            return
+        self.rules.append((pattern, "/" in pattern, dir_only))
+
+    @classmethod
+    def for_workspace(cls, workspace: Path, extra: Optional[List[str]] = None,
+                      use_defaults: bool = True) -> "IgnoreRules":
+        """默认规则 + 工作区 .gitignore + 额外模式"""
+        rules = cls(list(DEFAULT_IGNORE_PATTERNS) if use_defaults else [])
+        gitignore = workspace / ".gitignore"
+        if use_defaults and gitignore.is_file():
+            try:
+                for line in gitignore.read_text(encoding="utf-8", errors="ignore").splitlines():
+                    rules.add(line)
+            except OSError:
+                pass
+        for pattern in extra or []:
+            rules.add(pattern)
+        return rules
+
+    def match(self, rel_path: str, is_dir: bool) -> bool:
+        """rel_path 为相对工作区根目录的POSIX路径"""
+        name = rel_path.rsplit("/", 1)[-1]
+        for pattern, anchored, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                return True
+        return False
+
+    def match_any_ancestor(self, rel_path: str) -> bool:
+        """路径本身或任一上级目录是否被忽略"""
+        parts = [p for p in rel_path.split("/") if p and p != "."]
+        for i in range(1, len(parts) + 1):
+            if self.match("/".join(parts[:i]), True):
+                return True
+        return False
+
+
+def _trigram_bits(text: str) -> Optional[bytes]:
+    """构建文本（已小写）的三元组位图"""
+    trigrams = {text[i:i + 3] for i in range(len(text) - 2)}
+    if not trigrams:
+        return b""
+    # 位图大小：约为三元组数量的8倍（2的幂，1Kbit ~ 1Mbit），误判率较低
+    bits = 1 << 10
+    while bits < len(trigrams) * 8 and bits < (1 << 20):
+        bits <<= 1
+    bitmap = bytearray(bits >> 3)
+    mask = bits - 1
+    for trigram in trigrams:
+        h = hash(trigram) & mask
+        bitmap[h >> 3] |= 1 << (h & 7)
+    return bytes(bitmap)
+
+
+def _bitmap_has(bitmap: bytes, trigrams: List[str]) -> bool:
+    if not bitmap:
+        return False
+    mask = (len(bitmap) << 3) - 1
+    for trigram in trigrams:
+        h = hash(trigram) & mask
+        if not bitmap[h >> 3] & (1 << (h & 7)):
+            return False
+    return True
+
+
+_REGEX_SPECIAL = set(".^$*+?{}[]()|\\")
+_ESCAPED_LITERALS = set(".^$*+?{}[]()|\\/-#&~ '\"")
+# 不消耗参数的转义：字符类(\d \w \s)、断言(\b \A \Z)、控制字符(\n \t ...)
+_ESCAPED_CLASSES = set("dDwWsSbBAZzntrfva")
+
+
+def required_literals(pattern: str) -> List[str]:
+    """
+    从正则中提取匹配时必然出现的字面量（保守估计）
+
+    含顶层分支(|)、verbose标志或带参数的转义（\\x41、\\u00e9、\\101 等）时返回空列表（不做过滤）；
+    分组、字符类内的内容不参与提取。
+    """
+    if pattern.startswith("(?") and "x" in pattern[2:pattern.find(")")]:
+        return []
+
+    literals: List[str] = []
+    current: List[str] = []
+    depth = 0
+    i = 0
+    n = len(pattern)
+
+    def flush():
+        if current:
+            literals.append("".join(current))
+            current.clear()
+
+    while i < n:
+        c = pattern[i]
+        if c == "\\" and i + 1 < n:
+            nxt = pattern[i + 1]
+            if depth == 0 and nxt in _ESCAPED_LITERALS:
+                char, i = nxt, i + 2
+            elif depth > 0 or nxt in _ESCAPED_CLASSES or nxt in _ESCAPED_LITERALS:
+                # \d \w \s \b 等字符类，或分组内的转义
+                flush()
+                i += 2
+                continue
+            else:
+                # \x41 \u00e9 \N{...} \101 \1 等带参数的转义：参数长度不定，放弃过滤
+                return []
+        elif c == "[":
+            # 跳过字符类
+            flush()
+            i += 1
+            if i < n and pattern[i] == "^":
+                i += 1
+            if i < n and pattern[i] == "]":
+                i += 1
+            while i < n and pattern[i] != "]":
+                i += 2 if pattern[i] == "\\" else 1
+            i += 1
+            continue
+        elif c == "(":
+            flush()
+            depth += 1
+            i += 1
+            continue
+        elif c == ")":
+            depth = max(0, depth - 1)
+            i += 1
+            continue
+        elif c == "|":
+            if depth == 0:
+                return []
+            i += 1
+            continue
+        elif depth > 0:
+            i += 1
+            continue
+        elif c in _REGEX_SPECIAL:
+            if c in "*?{" and current:
+                # 前一个字符可能出现0次
+                current.pop()
+            flush()
+            if c == "{":
+                close = pattern.find("}", i)
+                i = close + 1 if close != -1 else i + 1
+            else:
+                i += 1
+            continue
+        else:
+            char, i = c, i + 1
+
+        # 字面量后紧跟 *、?、{ 时该字符不是必需的
+        if i < n and pattern[i] in "*?{":
+            flush()
+            continue
+        current.append(char)
+    flush()
+    return [lit for lit in literals if len(lit) >= 3]
+
+
+class WorkspaceIndex:
+    """单个工作区的三元组索引（按文件mtime/size增量更新）"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._lock = threading.Lock()
+        # 绝对路径 → (mtime_ns, size, 位图)；位图为None表示未建索引（过大），"binary"表示二进制文件
+        # 按最近使用排序，位图总大小超过 INDEX_MAX_BYTES 时淘汰最久未用的条目
+        self._entries: "OrderedDict[str, Tuple[int, int, object]]" = OrderedDict()
+        self.bytes = 0
+        self.stats = {"indexed": 0, "reused": 0}
+
+    @staticmethod
+    def _read_file(path: str, size: int) -> Tuple[object, Optional[str]]:
+        """
+        读取文件并建立位图
+
+        Returns:
+            (位图, 文本)；文本供调用方在同一遍读取中验证正则，过大或二进制文件为None
+        """
+        suffix = Path(path).suffix.lower()
+        if suffix in BINARY_EXTENSIONS and suffix != ".svg":
+            return "binary", None
+        try:
+            with open(path, "rb") as f:
+                head = f.read(8192)
+                if b"\x00" in head:
+                    return "binary", None
+                if size > MAX_INDEXED_FILE_BYTES:
+                    return None, None
+                data = head + f.read()
+        except OSError:
+            return "binary", None
+        text = data.decode("utf-8", errors="ignore")
+        return _trigram_bits(text.lower()), text
+
+    def walk(self, start: Path, rules: IgnoreRules, recursive: bool = True) -> Iterator[Tuple[str, str, int, int]]:
+        """
+        遍历 start 下未被忽略的文件（不读取文件内容）
+
+        Yields:
+            (绝对路径, 相对工作区根目录的POSIX路径, mtime_ns, 大小)
+        """
+        root_str = str(self.root)
+        stack = [str(start)]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                rel = os.path.relpath(entry.path, root_str).replace(os.sep, "/")
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if rules.match(rel, is_dir):
+                    continue
+                if is_dir:
+                    if recursive:
+                        subdirs.append(entry.path)
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, rel, stat.st_mtime_ns, stat.st_size
+            # 逆序入栈，保证按名称顺序遍历
+            stack.extend(reversed(subdirs))
+
+    def lookup(self, path: str, mtime_ns: int, size: int) -> Tuple[object, Optional[str]]:
+        """
+        获取文件的位图，文件变化或未建索引时读取文件并更新
+
+        Returns:
+            (位图, 文本)；文本仅在本次读取了文件内容时返回，否则为None
+        """
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == mtime_ns and cached[1] == size:
+                self._entries.move_to_end(path)
+                self.stats["reused"] += 1
+                return cached[2], None
+        bitmap, text = self._read_file(path, size)
+        with self._lock:
+            self._drop(path)
+            self._entries[path] = (mtime_ns, size, bitmap)
+            self.bytes += _bitmap_size(bitmap)
+            while self.bytes > INDEX_MAX_BYTES and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+            self.stats["indexed"] += 1
+        return bitmap, text
+
+    def _drop(self, path: str):
+        """移除条目（调用方持有锁）"""
+        cached = self._entries.pop(path, None)
+        if cached is not None:
+            self.bytes -= _bitmap_size(cached[2])
+
+    def forget_missing(self, start: Path, seen: set):
+        """移除 start 下已不存在（本次遍历未见到）的文件"""
+        prefix = str(start).rstrip(os.sep) + os.sep
+        with self._lock:
+            for path in [p for p in self._entries if p.startswith(prefix) and p not in seen]:
+                self._drop(path)
+
+
+def _bitmap_size(bitmap) -> int:
+    return len(bitmap) if isinstance(bitmap, bytes) else 0
+
+
+def _may_contain(bitmap, trigrams: List[str]) -> bool:
+    """根据位图判断文件是否可能包含全部三元组（二进制文件返回False）"""
+    if bitmap == "binary":
+        return False
+    if bitmap is None or not trigrams:
+        return True
+    return _bitmap_has(bitmap, trigrams)
+
+
+# 进程内缓存的工作区索引：按最近使用排序，位图总大小超过 INDEX_MAX_BYTES 时淘汰最久未用的工作区
+_indexes: "OrderedDict[str, WorkspaceIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_workspace_index(workspace: Path) -> WorkspaceIndex:
+    """获取工作区的索引（进程内缓存）"""
+    key = str(workspace.resolve())
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = WorkspaceIndex(Path(key))
+            _indexes[key] = index
+        _indexes.move_to_end(key)
+        total = sum(other.bytes for other in _indexes.values())
+        while total > INDEX_MAX_BYTES and len(_indexes) > 1:
+            _, evicted = _indexes.popitem(last=False)
+            total -= evicted.bytes
+        return index
+
+
+def _trigrams_of(literals: List[str]) -> List[str]:
+    trigrams = set()
+    for literal in literals:
+        literal = literal.lower()
+        trigrams.update(literal[i:i + 3] for i in range(len(literal) - 2))
+    return sorted(trigrams)
+
+
+def search_file(path: str, rel: str, regex, show_line_number: bool = True,
+                context_lines: int = 0, text: Optional[str] = None) -> Iterator[str]:
+    """
+    流式逐行搜索单个文件，每处匹配产出一条输出（含上下文时为多行文本）
+
+    上下文输出格式与原实现一致：匹配行 "path:N: line"，上下文行 "path:N- line"
+
+    Args:
+        text: 已读取的文件内容（建索引时读取），提供时不再打开文件
+    """
+    before = deque(maxlen=context_lines) if context_lines > 0 else None
+    blocks = []  # 等待后文的匹配块：[已收集的行, 还需要的后文行数]
+    if text is not None:
+        source = io.StringIO(text, newline=None)
+    else:
+        source = open(path, "r", encoding="utf-8", errors="ignore")
+    with source as f:
+        for line_num, line in enumerate(f, 1):
+            text = line.rstrip()
+            context_line = f"{rel}:{line_num}- {text}"
+            if blocks:
+                waiting = []
+                for block in blocks:
+                    block[0].append(context_line)
+                    block[1] -= 1
+                    if block[1] == 0:
+                        yield "\n".join(block[0])
+                    else:
+                        waiting.append(block)
+                blocks = waiting
+            if regex.search(line):
+                match_line = f"{rel}:{line_num}: {text}" if show_line_number else f"{rel}: {text}"
+                if before is None:
+                    yield match_line
+                else:
+                    blocks.append([list(before) + [match_line], context_lines])
+            if before is not None:
+                before.append(context_line)
+    for block in blocks:
+        yield "\n".join(block[0])
+
+
+def iter_matches(workspace: Path, search_root: Path, regex, file_pattern: str = "*",
+                 recursive: bool = True, show_line_number: bool = True, context_lines: int = 0,
+                 exclude: Optional[List[str]] = None, use_index: bool = True,
+                 counters: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    """
+    在工作区中流式搜索，调用方停止迭代即提前结束
+
+    Args:
+        counters: 可选，统计 files_searched（实际扫描的文件数）和 files_skipped（被索引排除的文件数）
+    """
+    counters = counters if counters is not None else {}
+    counters.setdefault("files_searched", 0)
+    counters.setdefault("files_skipped", 0)
+
+    workspace = workspace.resolve()
+    search_root = search_root.resolve()
+    rel_root = os.path.relpath(str(search_root), str(workspace)).replace(os.sep, "/")
+
+    if search_root.is_file():
+        counters["files_searched"] += 1
+        yield from search_file(str(search_root), rel_root, regex, show_line_number, context_lines)
+        return
+
+    # 明确搜索被忽略的目录（如 code_env）时不使用默认忽略规则
+    rules = IgnoreRules.for_workspace(workspace, exclude)
+    if rel_root != "." and rules.match_any_ancestor(rel_root):
+        rules = IgnoreRules.for_workspace(workspace, exclude, use_defaults=False)
+
+    trigrams = _trigrams_of(required_literals(regex.pattern)) if use_index else []
+    index = get_workspace_index(workspace)
+    match_path = "/" in file_pattern
+    seen = set()
+
+    walker = index.walk(search_root, rules, recursive)
+    try:
+        for path, rel, mtime_ns, size in walker:
+            seen.add(path)
+            if file_pattern != "*":
+                if match_path:
+                    if not Path(rel).match(file_pattern):
+                        continue
+                elif not fnmatch.fnmatch(os.path.basename(path), file_pattern):
+                    continue
+            text = None
+            if use_index:
+                # 索引过期时读取一次文件：同一份内容既用于建位图，也用于下面的逐行验证
+                bitmap, text = index.lookup(path, mtime_ns, size)
+                if not _may_contain(bitmap, trigrams):
+                    counters["files_skipped"] += 1
+                    continue
+            counters["files_searched"] += 1
+            try:
+                yield from search_file(path, rel, regex, show_line_number, context_lines, text)
+            except (UnicodeDecodeError, PermissionError, OSError):
+                continue
+        # 完整遍历后清理已删除文件的索引
+        if recursive:
+            index.forget_missing(search_root, seen)
+    finally:
+        walker.close()
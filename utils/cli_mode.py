@@ -352,13 +352,19 @@ class InteractiveCLI:
             conversations_dir = Path.home() / "mla_v3" / "conversations"
             stack_file = conversations_dir / f"{task_name}_stack.json"
             
-            if not stack_file.exists():
-                return {"found": False, "message": f"没有找到中断的任务（文件不存在: {stack_file})"}
-            
-            # 读取 stack
-            with open(stack_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                stack = data.get("stack", [])
+            # 启用SQLite后端时从工作区状态库读取
+            from utils.state_store import get_state_store
+            store = get_state_store(self.task_id)
+            if store is not None and not store.is_empty():
+                stack = store.load_stack()
+            else:
+                if not stack_file.exists():
+                    return {"found": False, "message": f"没有找到中断的任务（文件不存在: {stack_file})"}
+                
+                # 读取 stack
+                with open(stack_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    stack = data.get("stack", [])
             
             if not stack:
                 return {"found": False, "message": "没有中断的任务（stack 为空）"}
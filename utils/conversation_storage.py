@@ -3,46 +3,79 @@
 """
 对话历史存储 - 简化版
 只保存action_history，不保存传统的user/assistant对话
+
+存储格式（追加式日志 + 定期快照）：
+- {task_name}_{agent_id}_actions.json   压缩快照（与旧版完整JSON格式兼容）
+- {task_name}_{agent_id}_actions.jsonl  追加日志，每行一条记录（动作、pending变化、thinking更新等）
+
+加载时读取快照，再按序号重放快照之后的日志记录。
+旧版只有 _actions.json 的文件会被当作快照直接读取（迁移无需额外处理）。
+
+启用SQLite后端（MLA_STATE_BACKEND=sqlite）时，快照和日志记录写入工作区状态库的
+action_snapshots / actions 表，格式与文件相同；库中没有记录时回退读取文件。
 """
 
+import os
 import json
 import hashlib
+import threading
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
 
+from utils.state_store import get_state_store
+
+
+# 需要通过"state"记录追踪变化的标量字段
+_STATE_FIELDS = (
+    "agent_name",
+    "task_input",
+    "current_turn",
+    "latest_thinking",
+    "first_thinking_done",
+    "tool_call_counter",
+)
+
+# 进程内的日志状态（按文件路径索引），同一进程内多个存储器实例共享
+_journal_states: Dict[str, Dict] = {}
+_journal_lock = threading.Lock()
+
 
 class ConversationStorage:
     """对话历史存储器"""
-    
+
+    # 日志记录数达到该值时压缩为快照并清空日志
+    compact_every = 500
+
     def __init__(self, task_id: str = None):
         """初始化存储器 - 使用用户主目录（跨平台）"""
         self.conversations_dir = Path.home() / "mla_v3" / "conversations"
         self.conversations_dir.mkdir(parents=True, exist_ok=True)
         self.task_id = task_id
-    
+
     def _generate_filename(self, task_id: str, agent_id: str) -> str:
         """生成对话文件名：hash + 最后文件夹名 + agent_id"""
-        from pathlib import Path
-        import hashlib
-        
         task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
         # 跨平台路径处理：检查是否是路径（包含/或\）
-        import os
         task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
         task_name = f"{task_hash}_{task_folder}"
-        
+
         return str(self.conversations_dir / f"{task_name}_{agent_id}_actions.json")
-    
-    def save_actions(self, task_id: str, agent_id: str, agent_name: str, 
+
+    @staticmethod
+    def _journal_path(filepath: str) -> str:
+        """快照文件对应的日志文件路径"""
+        return filepath + "l"
+
+    def save_actions(self, task_id: str, agent_id: str, agent_name: str,
                     task_input: str, action_history: List[Dict], current_turn: int,
                     latest_thinking: str = "", first_thinking_done: bool = False,
                     tool_call_counter: int = 0, system_prompt: str = "",
                     action_history_fact: List[Dict] = None,
                     pending_tools: List[Dict] = None):
         """
-        保存动作历史和完整状态
-        
+        保存动作历史和完整状态（只追加与上次保存相比的增量记录）
+
         Args:
             task_id: 任务ID
             agent_id: Agent ID
@@ -53,67 +86,362 @@ class ConversationStorage:
             latest_thinking: 最新的thinking内容
             first_thinking_done: 是否已完成首次thinking
             tool_call_counter: 工具调用计数
-            system_prompt: 完整的system_prompt（包含XML上下文）
+            system_prompt: 完整的system_prompt（包含XML上下文，只写入快照）
         """
         try:
             filepath = self._generate_filename(task_id, agent_id)
-            
-            data = {
-                "task_id": task_id,
-                "agent_id": agent_id,
+            fields = {
                 "agent_name": agent_name,
                 "task_input": task_input,
                 "current_turn": current_turn,
-                "action_history": action_history,  # 用于渲染（会压缩）
-                "action_history_fact": action_history_fact if action_history_fact else action_history,  # 完整轨迹
-                "pending_tools": pending_tools if pending_tools else [],  # 待执行的工具
                 "latest_thinking": latest_thinking,
                 "first_thinking_done": first_thinking_done,
                 "tool_call_counter": tool_call_counter,
-                "system_prompt": system_prompt,
-                "last_updated": datetime.now().isoformat()
             }
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            
+            fact = action_history_fact if action_history_fact is not None else []
+            pending = pending_tools if pending_tools else []
+
+            with _journal_lock:
+                state = _journal_states.get(filepath)
+                if state is None:
+                    # 本进程尚未跟踪该文件：写入完整快照作为日志起点
+                    state = self._new_state(task_id, agent_id)
+                    self._track(state, fields, action_history, fact, pending, system_prompt)
+                    self._write_snapshot(filepath, state)
+                    _journal_states[filepath] = state
+                    return
+
+                records = self._diff_records(state, fields, action_history, fact, pending)
+                self._track(state, fields, action_history, fact, pending, system_prompt)
+                if not records:
+                    return
+
+                if state["journal_records"] + len(records) >= self.compact_every:
+                    state["seq"] += len(records)
+                    self._write_snapshot(filepath, state)
+                else:
+                    self._append_records(filepath, state, records)
+
             # print(f"💾 已保存状态: 第{current_turn}轮, {len(action_history)}个动作")
-        
+
         except Exception as e:
             print(f"⚠️ 保存对话历史失败: {e}")
-    
+
     def load_actions(self, task_id: str, agent_id: str) -> Dict:
         """
-        加载动作历史
-        
+        加载动作历史（快照 + 日志重放），并作为后续增量保存的起点
+
         Args:
             task_id: 任务ID
             agent_id: Agent ID
-            
+
         Returns:
             动作历史数据，如果不存在则返回None
         """
         try:
             filepath = self._generate_filename(task_id, agent_id)
-            
-            if not Path(filepath).exists():
+            data = self._read_state(task_id, agent_id, filepath)
+            if data is None:
                 return None
-            
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
+
+            last_seq = data.pop("_seq", 0)
+            journal_records = data.pop("_journal_records", 0)
+
+            with _journal_lock:
+                state = self._new_state(task_id, agent_id)
+                state["seq"] = last_seq
+                state["journal_records"] = journal_records
+                self._track(
+                    state,
+                    {field: data.get(field) for field in _STATE_FIELDS},
+                    data["action_history"],
+                    data["action_history_fact"],
+                    data["pending_tools"],
+                    data.get("system_prompt", "")
+                )
+                _journal_states[filepath] = state
+
             print(f"📂 已加载动作历史: 第{data.get('current_turn', 0)}轮, {len(data.get('action_history', []))}个动作")
             return data
-        
+
         except Exception as e:
             print(f"⚠️ 加载对话历史失败: {e}")
             return None
 
+    def read_actions(self, task_id: str, agent_id: str) -> Optional[Dict]:
+        """
+        只读方式读取当前状态（不影响本进程的日志跟踪，不打印日志）
+
+        Returns:
+            状态数据，如果不存在或读取失败则返回None
+        """
+        try:
+            data = self._read_state(task_id, agent_id, self._generate_filename(task_id, agent_id))
+            if data is not None:
+                data.pop("_seq", None)
+                data.pop("_journal_records", None)
+            return data
+        except Exception:
+            return None
+
+    def get_latest_thinking(self, task_id: str, agent_id: str) -> str:
+        """
+        获取最新保存的thinking：本进程正在写入的文件直接从内存读取，否则读取文件
+
+        Returns:
+            thinking内容，不存在时返回空字符串
+        """
+        filepath = self._generate_filename(task_id, agent_id)
+        with _journal_lock:
+            state = _journal_states.get(filepath)
+            if state is not None:
+                return state["fields"].get("latest_thinking") or ""
+
+        data = self.read_actions(task_id, agent_id)
+        return (data or {}).get("latest_thinking") or ""
+
+    def release(self, task_id: str, agent_id: str):
+        """
+        停止跟踪该Agent的日志状态（Agent结束时调用），释放内存中的动作历史
+
+        之后再次保存时重新写入完整快照作为日志起点
+        """
+        with _journal_lock:
+            _journal_states.pop(self._generate_filename(task_id, agent_id), None)
+
+    def _read_state(self, task_id: str, agent_id: str, filepath: str) -> Optional[Dict]:
+        """读取状态：优先使用工作区状态库，库中没有该Agent时读取文件"""
+        store = get_state_store(task_id)
+        if store is not None:
+            log = store.load_action_log(agent_id)
+            if log is not None:
+                snapshot, records = log
+                return self._replay_records(dict(snapshot or {}), records)
+        return self._replay(filepath)
+
+    def _replay(self, filepath: str) -> Optional[Dict]:
+        """读取快照并重放其后的日志记录"""
+        journal_path = self._journal_path(filepath)
+        has_snapshot = Path(filepath).exists()
+        has_journal = Path(journal_path).exists()
+        if not has_snapshot and not has_journal:
+            return None
+
+        data = {}
+        if has_snapshot:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+        records = []
+        if has_journal:
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # 最后一行可能因进程中断而不完整，忽略
+                        break
+        return self._replay_records(data, records)
+
+    def _replay_records(self, data: Dict, records: List[Dict]) -> Dict:
+        """在快照数据上按序重放日志记录"""
+        data.setdefault("action_history", [])
+        data.setdefault("action_history_fact", [])
+        data.setdefault("pending_tools", [])
+        snapshot_seq = data.pop("journal_seq", 0)
+        last_seq = snapshot_seq
+        journal_records = 0
+
+        for record in records:
+            journal_records += 1
+            seq = record.get("seq", 0)
+            # 快照已包含的记录（压缩后日志未及时清空）跳过
+            if seq <= snapshot_seq:
+                continue
+            self._apply_record(data, record)
+            last_seq = seq
+
+        # 与旧格式保持一致：完整轨迹为空时使用渲染历史
+        if not data["action_history_fact"]:
+            data["action_history_fact"] = list(data["action_history"])
+
+        data["_seq"] = last_seq
+        data["_journal_records"] = journal_records
+        return data
+
+    @staticmethod
+    def _apply_record(data: Dict, record: Dict):
+        """将一条日志记录应用到状态上"""
+        op = record.get("op")
+        if op == "action":
+            targets = record.get("in", [])
+            if "fact" in targets:
+                data["action_history_fact"].append(record["action"])
+            if "history" in targets:
+                data["action_history"].append(record["action"])
+        elif op == "history":
+            data["action_history"] = record.get("action_history", [])
+        elif op == "fact":
+            data["action_history_fact"] = record.get("action_history_fact", [])
+        elif op == "pending":
+            data["pending_tools"] = record.get("pending_tools", [])
+        elif op == "state":
+            data.update(record.get("fields", {}))
+
+        if "ts" in record:
+            data["last_updated"] = record["ts"]
+
+    @staticmethod
+    def _new_state(task_id: str, agent_id: str) -> Dict:
+        """创建进程内日志跟踪状态"""
+        return {
+            "task_id": task_id,
+            "agent_id": agent_id,
+            "seq": 0,
+            "journal_records": 0,
+            "fields": {},
+            "history": [],
+            "history_len": 0,
+            "history_tail": None,
+            "fact": [],
+            "fact_len": 0,
+            "fact_tail": None,
+            "pending": [],
+            "system_prompt": "",
+        }
+
+    @staticmethod
+    def _track(state: Dict, fields: Dict, history: List[Dict], fact: List[Dict],
+               pending: List[Dict], system_prompt: str):
+        """记录本次保存后的状态，用于下次计算增量"""
+        state["fields"] = dict(fields)
+        state["history"] = history
+        state["history_len"] = len(history)
+        state["history_tail"] = history[-1] if history else None
+        state["fact"] = fact
+        state["fact_len"] = len(fact)
+        state["fact_tail"] = fact[-1] if fact else None
+        state["pending"] = json.loads(json.dumps(pending, ensure_ascii=False))
+        if system_prompt:
+            state["system_prompt"] = system_prompt
+
+    @staticmethod
+    def _appended_items(items: List[Dict], old_len: int, old_tail) -> Optional[List[Dict]]:
+        """
+        如果列表只是在上次保存的基础上追加了新元素，返回新追加的部分；否则返回None
+
+        通过上次保存时末尾元素的对象身份判断前缀是否保持不变。
+        """
+        if len(items) < old_len:
+            return None
+        if old_len and items[old_len - 1] is not old_tail:
+            return None
+        return items[old_len:]
+
+    def _diff_records(self, state: Dict, fields: Dict, history: List[Dict],
+                      fact: List[Dict], pending: List[Dict]) -> List[Dict]:
+        """计算与上次保存相比的增量日志记录"""
+        records = []
+
+        new_fact = self._appended_items(fact, state["fact_len"], state["fact_tail"])
+        new_history = self._appended_items(history, state["history_len"], state["history_tail"])
+
+        if new_fact is None:
+            records.append({"op": "fact", "action_history_fact": fact})
+            new_fact = []
+        if new_history is None:
+            records.append({"op": "history", "action_history": history})
+            new_history = []
+
+        # 同一个动作通常同时追加到完整轨迹和渲染历史，只写一次
+        fact_index = {id(action): i for i, action in enumerate(new_fact)}
+        next_fact = 0
+        for action in new_history:
+            i = fact_index.get(id(action))
+            if i is not None and i >= next_fact:
+                for fact_only in new_fact[next_fact:i]:
+                    records.append({"op": "action", "in": ["fact"], "action": fact_only})
+                records.append({"op": "action", "in": ["fact", "history"], "action": action})
+                next_fact = i + 1
+            else:
+                records.append({"op": "action", "in": ["history"], "action": action})
+        for fact_only in new_fact[next_fact:]:
+            records.append({"op": "action", "in": ["fact"], "action": fact_only})
+
+        if pending != state["pending"]:
+            records.append({"op": "pending", "pending_tools": pending})
+
+        changed = {
+            field: value for field, value in fields.items()
+            if state["fields"].get(field) != value
+        }
+        if changed:
+            records.append({"op": "state", "fields": changed})
+
+        return records
+
+    def _append_records(self, filepath: str, state: Dict, records: List[Dict]):
+        """追加日志记录（一次保存对应一次写入）"""
+        now = datetime.now().isoformat()
+        for record in records:
+            state["seq"] += 1
+            record["seq"] = state["seq"]
+            record["ts"] = now
+
+        store = get_state_store(state["task_id"])
+        if store is not None:
+            store.append_action_records(state["agent_id"], records)
+        else:
+            lines = [json.dumps(record, ensure_ascii=False) for record in records]
+            with open(self._journal_path(filepath), 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        state["journal_records"] += len(records)
+
+    def _write_snapshot(self, filepath: str, state: Dict):
+        """写入压缩快照（临时文件 + 原子替换），然后清空日志"""
+        history = state["history"]
+        fact = state["fact"]
+        data = {
+            "task_id": state["task_id"],
+            "agent_id": state["agent_id"],
+            "agent_name": state["fields"].get("agent_name"),
+            "task_input": state["fields"].get("task_input"),
+            "current_turn": state["fields"].get("current_turn"),
+            "action_history": history,  # 用于渲染（会压缩）
+            "action_history_fact": fact if fact else history,  # 完整轨迹
+            "pending_tools": state["pending"],  # 待执行的工具
+            "latest_thinking": state["fields"].get("latest_thinking", ""),
+            "first_thinking_done": state["fields"].get("first_thinking_done", False),
+            "tool_call_counter": state["fields"].get("tool_call_counter", 0),
+            "system_prompt": state["system_prompt"],
+            "journal_seq": state["seq"],
+            "last_updated": datetime.now().isoformat()
+        }
+
+        store = get_state_store(state["task_id"])
+        if store is not None:
+            store.write_action_snapshot(state["agent_id"], data, state["seq"])
+            state["journal_records"] = 0
+            return
+
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, filepath)
+
+        # 快照已包含所有记录，清空日志（即使此处中断，重放时也会按序号跳过）
+        with open(self._journal_path(filepath), 'w', encoding='utf-8'):
+            pass
+        state["journal_records"] = 0
+
 
 if __name__ == "__main__":
     # 测试存储器
     storage = ConversationStorage()
-    
+
     # 测试保存
     storage.save_actions(
         task_id="test",
@@ -125,8 +453,7 @@ if __name__ == "__main__":
         ],
         current_turn=1
     )
-    
+
     # 测试加载
     data = storage.load_actions("test", "agent_123")
     print(f"✅ 加载的数据: {data}")
-
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工作区状态库 - 基于SQLite（WAL模式）的层级状态与动作日志存储
+
+每个工作区一个数据库文件（~/mla_v3/conversations/{hash}_{folder}_state.db），
+Web UI、CLI（start.py子进程）和 state_cleaner 可以在不同进程中同时读写：
+- WAL模式：读者不阻塞写者，多个查看者可并发读取
+- 写操作在 BEGIN IMMEDIATE 事务中执行，跨进程串行化，不会互相覆盖或写坏文件
+- history 只追加新条目，动作日志按序号增量写入，不再整文件重写/重读
+
+通过环境变量 MLA_STATE_BACKEND=sqlite 启用，默认仍使用JSON文件。
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.windows_compat import safe_print
+
+
+STATE_BACKEND = os.environ.get("MLA_STATE_BACKEND", "json").strip().lower()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS instructions (
+    position INTEGER PRIMARY KEY,
+    instruction_id TEXT,
+    instruction TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_instructions_id ON instructions(instruction_id);
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    agent_name TEXT,
+    status TEXT,
+    parent_id TEXT,
+    level INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_agents_status ON agents(status);
+CREATE INDEX IF NOT EXISTS idx_agents_parent ON agents(parent_id);
+CREATE TABLE IF NOT EXISTS hierarchy (
+    agent_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    parent_id TEXT,
+    level INTEGER
+);
+CREATE TABLE IF NOT EXISTS edges (
+    parent_id TEXT NOT NULL,
+    child_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (parent_id, child_id)
+);
+CREATE INDEX IF NOT EXISTS idx_edges_child ON edges(child_id);
+CREATE TABLE IF NOT EXISTS agent_times (
+    agent_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    start_time TEXT,
+    end_time TEXT
+);
+CREATE TABLE IF NOT EXISTS stack (
+    position INTEGER PRIMARY KEY,
+    agent_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    round_id INTEGER PRIMARY KEY,
+    completion_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS actions (
+    agent_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    op TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (agent_id, seq)
+);
+CREATE TABLE IF NOT EXISTS action_snapshots (
+    agent_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# current / 顶层中单独建表的字段，其余字段（压缩缓存、时间戳等）以JSON存入meta
+_CURRENT_TABLE_KEYS = ("instructions", "hierarchy", "agents_status")
+_CONTEXT_TABLE_KEYS = ("current", "agent_time_history", "history")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def workspace_db_path(task_id: str) -> Path:
+    """工作区数据库路径（命名规则与层级/对话文件一致）"""
+    conversations_dir = Path.home() / "mla_v3" / "conversations"
+    conversations_dir.mkdir(parents=True, exist_ok=True)
+    task_hash = hashlib.md5(task_id.encode()).hexdigest()[:8]
+    # 跨平台路径处理：检查是否是路径（包含/或\）
+    task_folder = Path(task_id).name if (os.sep in task_id or '/' in task_id or '\\' in task_id) else task_id
+    return conversations_dir / f"{task_hash}_{task_folder}_state.db"
+
+
+class WorkspaceStateStore:
+    """单个工作区的SQLite状态库（进程内共享一个连接，操作由锁串行化）"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(
+            str(self.db_path), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(_SCHEMA)
+        self._data_version = self._read_data_version()
+        # 各表上次读取/写入的行：{表名: (data_version, {主键: 其余列})}，保存时只写变化的行
+        self._written: Dict[str, Tuple[int, Dict[tuple, tuple]]] = {}
+
+    # ------------------------------------------------------------------
+    # 事务与变更检测
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务（BEGIN IMMEDIATE，跨进程串行化写者）
+
+        同一线程内可嵌套，只有最外层提交或回滚。
+        """
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self._conn
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                    # 已记录的行可能未写入，下次保存时整表重写
+                    self._written.clear()
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+                self._data_version = self._read_data_version()
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed_externally(self) -> bool:
+        """自上次检查以来是否有其他进程提交了修改（不读取任何表）"""
+        with self._lock:
+            version = self._read_data_version()
+            changed = version != self._data_version
+            self._data_version = version
+            return changed
+
+    def is_empty(self) -> bool:
+        """数据库是否尚未写入过层级状态"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM meta WHERE key = 'task_id'").fetchone()
+            return row is None
+
+    def close(self):
+        """关闭数据库连接（之后不可再使用该实例）"""
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------------------------------------------
+    # 层级状态
+    # ------------------------------------------------------------------
+
+    def load_stack(self) -> List[Dict]:
+        """读取Agent栈"""
+        with self._lock:
+            version = self._read_data_version()
+            rows = self._conn.execute("SELECT data FROM stack ORDER BY position").fetchall()
+            stack = [json.loads(row[0]) for row in rows]
+            self._written["stack"] = (version, self._stack_rows(stack))
+            return stack
+
+    @staticmethod
+    def _stack_rows(stack: List[Dict]) -> Dict[tuple, tuple]:
+        return {(i,): (entry.get("agent_id"), _dumps(entry)) for i, entry in enumerate(stack)}
+
+    def save_stack(self, stack: List[Dict]):
+        """写入Agent栈（只写变化的位置）"""
+        with self.transaction() as conn:
+            self._sync_table(conn, "stack", ("position",), ("agent_id", "data"), self._stack_rows(stack))
+
+    def _sync_table(self, conn, table: str, key_columns: Tuple[str, ...], columns: Tuple[str, ...],
+                    rows: Dict[tuple, tuple]):
+        """
+        将表同步为 rows：只删除消失的行、写入新增或变化的行
+
+        其他进程在上次读取/写入后修改过数据库时（data_version 变化）整表重写。
+        """
+        version = self._read_data_version()
+        cached = self._written.get(table)
+        if cached is None or cached[0] != version:
+            conn.execute(f"DELETE FROM {table}")
+            written = {}
+        else:
+            written = cached[1]
+            removed = [key for key in written if key not in rows]
+            if removed:
+                where = " AND ".join(f"{column} = ?" for column in key_columns)
+                conn.executemany(f"DELETE FROM {table} WHERE {where}", removed)
+        changed = [key + row for key, row in rows.items() if written.get(key) != row]
+        if changed:
+            all_columns = key_columns + columns
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(all_columns)}) "
+                f"VALUES ({', '.join('?' * len(all_columns))})",
+                changed
+            )
+        self._written[table] = (version, rows)
+
+    def load_context(self) -> Dict:
+        """读取共享上下文（还原为与 _share_context.json 相同的结构）"""
+        with self._lock:
+            conn = self._conn
+            # 先记录版本：读取过程中其他进程提交的修改会使版本不一致，下次保存时整表重写
+            version = self._read_data_version()
+            meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+            context = json.loads(meta.get("context_extra") or "{}")
+            context.setdefault("task_id", meta.get("task_id"))
+            current = json.loads(meta.get("current_extra") or "{}")
+
+            current["instructions"] = [
+                json.loads(row[0])
+                for row in conn.execute("SELECT data FROM instructions ORDER BY position")
+            ]
+
+            children: Dict[str, List[str]] = {}
+            for parent_id, child_id in conn.execute(
+                "SELECT parent_id, child_id FROM edges ORDER BY parent_id, position"
+            ):
+                children.setdefault(parent_id, []).append(child_id)
+            current["hierarchy"] = {
+                agent_id: {"parent": parent_id, "children": children.get(agent_id, []), "level": level}
+                for agent_id, parent_id, level in conn.execute(
+                    "SELECT agent_id, parent_id, level FROM hierarchy ORDER BY position"
+                )
+            }
+
+            current["agents_status"] = {
+                agent_id: json.loads(data)
+                for agent_id, data in conn.execute(
+                    "SELECT agent_id, data FROM agents ORDER BY position"
+                )
+            }
+            context["current"] = current
+
+            times = {}
+            for agent_id, start_time, end_time in conn.execute(
+                "SELECT agent_id, start_time, end_time FROM agent_times ORDER BY position"
+            ):
+                times[agent_id] = {"start_time": start_time, "end_time": end_time}
+            context["agent_time_history"] = times
+
+            context["history"] = [
+                json.loads(row[0])
+                for row in conn.execute("SELECT data FROM history ORDER BY round_id")
+            ]
+            for table, rows in self._context_rows(context).items():
+                self._written[table] = (version, rows)
+            return context
+
+    @staticmethod
+    def _context_rows(context: Dict) -> Dict[str, Dict[tuple, tuple]]:
+        """共享上下文对应的各表行：{表名: {主键: 其余列}}"""
+        current = context.get("current", {})
+        context_extra = {k: v for k, v in context.items() if k not in _CONTEXT_TABLE_KEYS}
+        current_extra = {k: v for k, v in current.items() if k not in _CURRENT_TABLE_KEYS}
+        hierarchy = current.get("hierarchy", {})
+
+        edges: Dict[tuple, tuple] = {}
+        for agent_id, node in hierarchy.items():
+            for j, child_id in enumerate(node.get("children", [])):
+                edges.setdefault((agent_id, child_id), (j,))
+
+        return {
+            "meta": {
+                ("task_id",): (context.get("task_id"),),
+                ("context_extra",): (_dumps(context_extra),),
+                ("current_extra",): (_dumps(current_extra),),
+            },
+            "instructions": {
+                (i,): (entry.get("instruction_id"), entry.get("instruction"), _dumps(entry))
+                for i, entry in enumerate(current.get("instructions", []))
+            },
+            "hierarchy": {
+                (agent_id,): (i, node.get("parent"), node.get("level"))
+                for i, (agent_id, node) in enumerate(hierarchy.items())
+            },
+            "edges": edges,
+            "agents": {
+                (agent_id,): (i, info.get("agent_name"), info.get("status"),
+                              info.get("parent_id"), info.get("level"), _dumps(info))
+                for i, (agent_id, info) in enumerate(current.get("agents_status", {}).items())
+            },
+            "agent_times": {
+                (agent_id,): (i, value.get("start_time"), value.get("end_time"))
+                for i, (agent_id, value) in enumerate(context.get("agent_time_history", {}).items())
+            },
+        }
+
+    # 各表的主键列和其余列（与 _context_rows 的行结构对应）
+    _CONTEXT_TABLES = {
+        "meta": (("key",), ("value",)),
+        "instructions": (("position",), ("instruction_id", "instruction", "data")),
+        "hierarchy": (("agent_id",), ("position", "parent_id", "level")),
+        "edges": (("parent_id", "child_id"), ("position",)),
+        "agents": (("agent_id",), ("position", "agent_name", "status", "parent_id", "level", "data")),
+        "agent_times": (("agent_id",), ("position", "start_time", "end_time")),
+    }
+
+    def save_context(self, context: Dict):
+        """
+        写入共享上下文
+
+        各表只写入与上次读取/写入相比变化的行（通常只有被修改的agent和新增的指令、边），
+        history 只追加新条目。
+        """
+        rows_by_table = self._context_rows(context)
+        with self.transaction() as conn:
+            for table, (key_columns, columns) in self._CONTEXT_TABLES.items():
+                self._sync_table(conn, table, key_columns, columns, rows_by_table[table])
+            self._save_history(conn, context.get("history", []))
+
+    @staticmethod
+    def _save_history(conn, history: List[Dict]):
+        """history 只会追加：只插入库中尚未保存的条目（条目变少时整体重写）"""
+        stored = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        if stored > len(history):
+            conn.execute("DELETE FROM history")
+            stored = 0
+        conn.executemany(
+            "INSERT INTO history (round_id, completion_time, data) VALUES (?, ?, ?)",
+            [
+                (i, entry.get("completion_time"), _dumps(entry))
+                for i, entry in enumerate(history[stored:], start=stored)
+            ]
+        )
+
+    # ------------------------------------------------------------------
+    # 动作日志（与 ConversationStorage 的 快照 + 日志 格式对应）
+    # ------------------------------------------------------------------
+
+    def append_action_records(self, agent_id: str, records: List[Dict]):
+        """追加动作日志记录（记录需已带seq）"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO actions (agent_id, seq, op, record) VALUES (?, ?, ?, ?)",
+                [(agent_id, record["seq"], record.get("op"), _dumps(record)) for record in records]
+            )
+
+    def write_action_snapshot(self, agent_id: str, data: Dict, seq: int):
+        """写入动作快照并删除快照已包含的日志记录"""
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO action_snapshots (agent_id, seq, data) VALUES (?, ?, ?)",
+                (agent_id, seq, _dumps(data))
+            )
+            conn.execute("DELETE FROM actions WHERE agent_id = ? AND seq <= ?", (agent_id, seq))
+
+    def load_action_log(self, agent_id: str) -> Optional[Tuple[Optional[Dict], List[Dict]]]:
+        """
+        读取动作快照及其后的日志记录
+
+        Returns:
+            (快照数据或None, 按seq排序的日志记录)；该Agent没有任何数据时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT seq, data FROM action_snapshots WHERE agent_id = ?", (agent_id,)
+            ).fetchone()
+            snapshot_seq = row[0] if row else 0
+            records = [
+                json.loads(r[0]) for r in self._conn.execute(
+                    "SELECT record FROM actions WHERE agent_id = ? AND seq > ? ORDER BY seq",
+                    (agent_id, snapshot_seq)
+                )
+            ]
+        if row is None and not records:
+            return None
+        return (json.loads(row[1]) if row else None), records
+
+
+# 进程内每个数据库一个实例
+_stores: Dict[str, WorkspaceStateStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_state_store(task_id: str) -> Optional[WorkspaceStateStore]:
+    """
+    获取工作区的状态库
+
+    Returns:
+        WorkspaceStateStore；未启用SQLite后端或打开失败时返回None（使用JSON文件）
+    """
+    if STATE_BACKEND != "sqlite" or not task_id:
+        return None
+    db_path = str(workspace_db_path(task_id))
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            try:
+                store = WorkspaceStateStore(Path(db_path))
+            except Exception as e:
+                safe_print(f"⚠️ 打开工作区状态库失败，使用JSON文件: {e}")
+                return None
+            _stores[db_path] = store
+        return store
+
+
+def close_state_store(task_id: str):
+    """关闭并移除工作区的状态库实例（清除工作区、删除数据库文件前调用）"""
+    if not task_id:
+        return
+    db_path = str(workspace_db_path(task_id))
+    with _stores_lock:
+        store = _stores.pop(db_path, None)
+    if store is not None:
+        store.close()
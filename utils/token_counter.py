@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token计数 - 进程内共享的tiktoken编码器 + 动作历史的增量token账本
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from utils.windows_compat import safe_print
+
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    获取进程内共享的 cl100k_base 编码器（首次调用时加载）
+
+    Returns:
+        tiktoken编码器；tiktoken不可用时返回None（使用估算）
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except ImportError:
+                _encoding = None
+            except Exception as e:
+                safe_print(f"⚠️ tiktoken编码器加载失败，使用估算: {e}")
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """统计token数（无tiktoken时按中英文字符估算）"""
+    encoding = get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    chinese_chars = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+    other_chars = len(text) - chinese_chars
+    return int(chinese_chars / 1.5 + other_chars / 4)
+
+
+class TokenLedger:
+    """
+    动作历史的token账本
+
+    每条action只在首次出现时渲染并计数，账本维护当前历史的累计总数：
+    历史只是追加时只计算新增的action，检查是否需要压缩为O(新增条数)；
+    历史被替换（压缩、恢复）时按action对象复用已有计数重新累加。
+    """
+
+    def __init__(self, render: Callable[[Dict], str], separator_tokens: int = 1):
+        """
+        Args:
+            render: 将单条action渲染为文本的函数（与实际拼接进上下文的格式一致）
+            separator_tokens: action之间分隔符的token数
+        """
+        self.render = render
+        self.separator_tokens = separator_tokens
+        # 当前跟踪的历史：[(action, token数)]，通过对象身份判断是否为追加
+        self._entries: List[Tuple[Dict, int]] = []
+        self._total = 0
+        self._text_cache: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _count_action(self, action: Dict) -> int:
+        return count_tokens(self.render(action))
+
+    def total(self, actions: List[Dict]) -> int:
+        """
+        获取动作历史的总token数（增量更新）
+
+        Args:
+            actions: 当前的action_history
+
+        Returns:
+            所有action渲染文本的token数之和（含分隔符）
+        """
+        with self._lock:
+            entries = self._entries
+            tracked = len(entries)
+            appended = (
+                tracked <= len(actions)
+                and (tracked == 0 or actions[tracked - 1] is entries[-1][0])
+            )
+            if not appended:
+                # 历史被替换：复用仍存在的action的计数
+                known = {id(action): tokens for action, tokens in entries}
+                entries = []
+                self._total = 0
+                tracked = 0
+            else:
+                known = {}
+
+            for action in actions[tracked:]:
+                tokens = known.get(id(action))
+                if tokens is None:
+                    tokens = self._count_action(action)
+                entries.append((action, tokens))
+                self._total += tokens
+
+            self._entries = entries
+            separators = self.separator_tokens * max(0, len(entries) - 1)
+            return self._total + separators
+
+    def count_text(self, key: str, text: str) -> int:
+        """统计按key区分的文本（如thinking、task_input）的token数，文本未变化时直接复用"""
+        with self._lock:
+            cached = self._text_cache.get(key)
+            if cached and cached[0] == text:
+                return cached[1]
+        tokens = count_tokens(text) if text else 0
+        with self._lock:
+            self._text_cache[key] = (text, tokens)
+        return tokens
+
+    def reset(self):
+        """清空账本"""
+        with self._lock:
+            self._entries = []
+            self._total = 0
+            self._text_cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """账本状态"""
+        with self._lock:
+            return {"actions": len(self._entries), "tokens": self._total}
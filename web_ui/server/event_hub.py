@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task Event Hub
+
+Per-task broadcast hub for SSE output. The process reader thread publishes
+each event once; every SSE subscriber (multiple tabs, late joiners) reads the
+same numbered stream from a ring buffer and is woken on publish instead of
+polling. Subscribers reconnecting with Last-Event-ID replay what they missed.
+
+Author: Songmiao Wang
+MLA System: Chenlin Yu, Songmiao Wang"""
+
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+
+class EventHub:
+    """Broadcast hub for one running task"""
+
+    def __init__(self, task_id: str, buffer_size: int = 2000):
+        """
+        Args:
+            task_id: Task ID the events belong to
+            buffer_size: Number of recent events kept for replay
+        """
+        self.task_id = task_id
+        self._events = deque(maxlen=buffer_size)  # [(event_id, event)]
+        self._next_id = 1
+        self._closed = False
+        self.closed_at: Optional[float] = None
+        self._cond = threading.Condition()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
+
+    def publish(self, event: dict) -> int:
+        """Append an event and wake all subscribers. Returns the event ID."""
+        if event.get('timestamp') is None:
+            event['timestamp'] = datetime.now().isoformat()
+        with self._cond:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, event))
+            self._cond.notify_all()
+        return event_id
+
+    def close(self):
+        """Mark the stream as finished (subscribers drain the buffer, then stop)"""
+        with self._cond:
+            if not self._closed:
+                self._closed = True
+                self.closed_at = time.time()
+            self._cond.notify_all()
+
+    def subscribe(self, last_event_id: int = 0, heartbeat: float = 15.0) -> Iterator[Optional[tuple]]:
+        """
+        Iterate over events after last_event_id
+
+        Yields:
+            (event_id, event) tuples; None when heartbeat seconds pass without events.
+            Ends after the hub is closed and all buffered events were delivered.
+        """
+        cursor = max(0, int(last_event_id or 0))
+        while True:
+            with self._cond:
+                pending = self._pending_after(cursor)
+                if not pending and not self._closed:
+                    self._cond.wait(timeout=heartbeat)
+                    pending = self._pending_after(cursor)
+                finished = self._closed and not pending
+            if finished:
+                return
+            if not pending:
+                yield None
+                continue
+            for event_id, event in pending:
+                cursor = event_id
+                yield event_id, event
+
+    def _pending_after(self, cursor: int) -> list:
+        """Buffered events newer than cursor (caller holds the condition)"""
+        if not self._events or self._events[-1][0] <= cursor:
+            return []
+        # IDs are contiguous, so the start offset can be computed directly
+        first_id = self._events[0][0]
+        start = max(0, cursor + 1 - first_id)
+        return [self._events[i] for i in range(start, len(self._events))]
+
+    def sse_stream(self, last_event_id: int = 0, heartbeat: float = 15.0) -> Iterator[str]:
+        """Format subscribe() as SSE frames (id + data), ending with a final end event"""
+        for item in self.subscribe(last_event_id, heartbeat):
+            if item is None:
+                yield ": heartbeat\n\n"
+                continue
+            event_id, event = item
+            yield f"id: {event_id}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({'type': 'end', 'content': 'Task completed'}, ensure_ascii=False)}\n\n"
+
+
+# Hubs by task ID (the latest run of each task; replaced when the task is run again)
+_hubs: Dict[str, EventHub] = {}
+_hubs_lock = threading.Lock()
+# Seconds a finished run stays available for late joiners and reconnects
+HUB_RETENTION = 600
+
+
+def _prune_closed_hubs():
+    """Drop hubs closed longer than HUB_RETENTION ago (caller holds _hubs_lock)"""
+    cutoff = time.time() - HUB_RETENTION
+    for task_id in [t for t, hub in _hubs.items() if hub.closed_at is not None and hub.closed_at < cutoff]:
+        del _hubs[task_id]
+
+
+def create_hub(task_id: str, buffer_size: int = 2000) -> EventHub:
+    """Create a fresh hub for a new run of the task"""
+    hub = EventHub(task_id, buffer_size)
+    with _hubs_lock:
+        _prune_closed_hubs()
+        old = _hubs.get(task_id)
+        _hubs[task_id] = hub
+    if old is not None:
+        old.close()
+    return hub
+
+
+def get_hub(task_id: str) -> Optional[EventHub]:
+    """Hub of the task's latest run (may already be closed), or None once pruned"""
+    with _hubs_lock:
+        _prune_closed_hubs()
+        return _hubs.get(task_id)
@@ -31,6 +31,8 @@ sys.path.insert(0, str(project_root))
 server_dir = Path(__file__).parent
 sys.path.insert(0, str(server_dir))
 
+from event_hub import create_hub, get_hub
+
 # OutputCapture is no longer used - we directly parse JSONL events
 # from output_capture import OutputCapture
 
@@ -84,7 +86,7 @@ def get_user_execution(username: str) -> dict:
         current_executions[username] = {
             'running': False,
             'process': None,
-            'output_queue': None,
+            'event_hub': None,
             'stop_requested': False,
             'thread': None,
             'reader_thread': None,
@@ -505,9 +507,9 @@ def run_task():
     if user_execution['running']:
         return jsonify({"error": "Task already running"}), 409
     
-    # Create output queue
-    output_queue = queue.Queue()
-    user_execution['output_queue'] = output_queue
+    # Create broadcast hub (all SSE subscribers of this run share it)
+    event_hub = create_hub(task_id_absolute)
+    user_execution['event_hub'] = event_hub
     user_execution['running'] = True
     user_execution['stop_requested'] = False
     
@@ -699,14 +701,14 @@ def run_task():
                         
                         # Send event if valid
                         if frontend_event:
-                            output_queue.put(frontend_event)
+                            event_hub.publish(frontend_event)
                             
                     except json.JSONDecodeError:
                         # Non-JSON line, may be error output
                         json_line = json_line.strip()
                         if json_line and ("Error" in json_line or "Exception" in json_line):
                             # Only handle obvious error information
-                            output_queue.put({
+                            event_hub.publish({
                                 "type": "error",
                                 "agent": agent_name,
                                 "content": f"❌ {json_line}",
@@ -716,7 +718,7 @@ def run_task():
                     except Exception as e:
                         # 捕获其他所有异常，输出错误但继续读取
                         import traceback
-                        output_queue.put({
+                        event_hub.publish({
                             "type": "error",
                             "agent": agent_name,
                             "content": f"⚠️ 处理事件异常: {str(e)}",
@@ -734,7 +736,7 @@ def run_task():
                         end_event_received = True
                     frontend_event = convert_event_to_frontend_format(event, agent_name)
                     if frontend_event:
-                        output_queue.put(frontend_event)
+                        event_hub.publish(frontend_event)
                 except json.JSONDecodeError:
                     pass
                 
@@ -744,36 +746,34 @@ def run_task():
             # Send end message if not already received
             if not end_event_received:
                 if user_execution.get('stop_requested', False):
-                    output_queue.put({
+                    event_hub.publish({
                         "type": "error",
                         "agent": agent_name,
                         "content": "⏹️ 任务已停止",
                         "timestamp": datetime.now().isoformat()
                     })
                 elif process.returncode == 0:
-                    output_queue.put({
+                    event_hub.publish({
                         "type": "end",
                         "agent": agent_name,
                         "content": "✅ 任务完成",
                         "timestamp": datetime.now().isoformat()
                     })
                 else:
-                    output_queue.put({
+                    event_hub.publish({
                         "type": "error",
                         "agent": agent_name,
                         "content": f"⚠️ 进程退出码: {process.returncode}",
                         "timestamp": datetime.now().isoformat()
                     })
             
-                output_queue.put(None)  # End marker
-            
         except Exception as e:
             import traceback
             error_detail = f"{str(e)}\n{traceback.format_exc()}"
             print(f"❌ 读取输出循环异常: {error_detail}", flush=True)
             
             # 输出错误但不终止 - 等待进程结束
-            output_queue.put({
+            event_hub.publish({
                 "type": "error",
                 "agent": agent_name,
                 "content": f"⚠️ 读取输出异常: {str(e)}，等待进程结束...",
@@ -789,14 +789,14 @@ def run_task():
                 
                 # 发送最终状态
                 if process.returncode == 0:
-                    output_queue.put({
+                    event_hub.publish({
                         "type": "end",
                         "agent": agent_name,
                         "content": "✅ 进程完成",
                         "timestamp": datetime.now().isoformat()
                     })
                 else:
-                    output_queue.put({
+                    event_hub.publish({
                         "type": "error",
                         "agent": agent_name,
                         "content": f"⚠️ 进程退出码: {process.returncode}",
@@ -804,9 +804,9 @@ def run_task():
                     })
             except Exception as wait_err:
                 print(f"⚠️ 等待进程失败: {wait_err}", flush=True)
-            finally:
-                output_queue.put(None)  # 发送终止标记
         finally:
+            # End marker: subscribers drain the buffer and finish (also when the process sent its own end event)
+            event_hub.close()
             user_execution['running'] = False
     
     reader_thread = threading.Thread(target=read_process_output, daemon=True)
@@ -818,63 +818,110 @@ def run_task():
     connection_id = str(uuid.uuid4())
     user_execution['sse_connections'].add(connection_id)
     
+    last_event_id = _last_event_id()
+    
     def generate():
-        """Generate SSE event stream"""
+        """Generate SSE event stream (woken on publish, replays after Last-Event-ID)"""
+        disconnected = False
         try:
-            while True:
-                try:
-                    # Get message from queue (1 second timeout)
-                    msg = output_queue.get(timeout=1)
-                    
-                    if msg is None:  # End marker
-                        yield f"data: {json.dumps({'type': 'end', 'content': 'Task completed'}, ensure_ascii=False)}\n\n"
-                        break
-                    
-                    # Add timestamp
-                    if msg.get('timestamp') is None:
-                        from datetime import datetime
-                        msg['timestamp'] = datetime.now().isoformat()
-                    
-                    # Send SSE event
-                    yield f"data: {json.dumps(msg, ensure_ascii=False)}\n\n"
-                    
-                except queue.Empty:
-                    # Timeout, send heartbeat
-                    yield f": heartbeat\n\n"
-                    continue
-                    
+            yield from event_hub.sse_stream(last_event_id)
         except GeneratorExit:
             # Client disconnected (e.g., page refresh or new window)
-            # Remove this connection from active connections
-            user_execution['sse_connections'].discard(connection_id)
-            
-            # Only stop process if no active connections remain
-            if len(user_execution['sse_connections']) == 0:
-                process = user_execution.get('process')
-                if process and process.poll() is None:  # Process still running
-                    try:
-                        user_execution['stop_requested'] = True
-                        process.terminate()
-                        try:
-                            process.wait(timeout=2)
-                        except subprocess.TimeoutExpired:
-                            process.kill()
-                            process.wait()
-                    except:
-                        pass
-                    finally:
-                        user_execution['running'] = False
-                        user_execution['process'] = None
-                        user_execution['reader_thread'] = None
-                        user_execution['stop_requested'] = False
+            disconnected = True
+            raise
         finally:
-            # Remove connection on normal exit
-            user_execution['sse_connections'].discard(connection_id)
-            
-            # Only mark as not running if no active connections remain
-            if len(user_execution['sse_connections']) == 0:
-                user_execution['running'] = False
-                user_execution['stop_requested'] = False
+            _release_sse_connection(user_execution, connection_id, event_hub, disconnected)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            'Connection': 'keep-alive'
+        }
+    )
+
+
+def _release_sse_connection(user_execution: dict, connection_id: str, event_hub, disconnected: bool):
+    """
+    Remove an SSE connection (the tab that started the task or an observer)
+    
+    When the last connection watching the user's current task goes away, the task is
+    marked as not running; if that client disconnected, the still-running process is stopped.
+    """
+    connections = user_execution['sse_connections']
+    connections.discard(connection_id)
+    if connections or event_hub is not user_execution.get('event_hub'):
+        return
+    
+    process = user_execution.get('process')
+    if disconnected and process and process.poll() is None:
+        try:
+            user_execution['stop_requested'] = True
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        except:
+            pass
+        finally:
+            user_execution['process'] = None
+            user_execution['reader_thread'] = None
+    user_execution['running'] = False
+    user_execution['stop_requested'] = False
+
+
+def _last_event_id() -> int:
+    """Last-Event-ID from the reconnect header or the last_event_id query parameter"""
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+@app.route('/api/task/stream', methods=['GET'])
+@login_required
+def stream_task():
+    """Attach to a task's output stream (SSE) - extra tabs and reconnects replay after Last-Event-ID"""
+    username = session.get('username')
+    if not username:
+        return jsonify({"error": "User not authenticated"}), 401
+    
+    user_execution = get_user_execution(username)
+    task_id_input = request.args.get('task_id')
+    if task_id_input:
+        try:
+            task_path, _ = normalize_task_id(task_id_input, username)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        event_hub = get_hub(str(task_path))
+    else:
+        event_hub = user_execution.get('event_hub')
+    
+    if event_hub is None:
+        return jsonify({"error": "No task output to stream"}), 404
+    
+    last_event_id = _last_event_id()
+    
+    # Observers also count as active connections, so closing the tab that
+    # started the task does not stop it while another tab is watching
+    import uuid
+    connection_id = str(uuid.uuid4())
+    user_execution['sse_connections'].add(connection_id)
+    
+    def generate():
+        disconnected = False
+        try:
+            yield from event_hub.sse_stream(last_event_id)
+        except GeneratorExit:
+            disconnected = True
+            raise
+        finally:
+            _release_sse_connection(user_execution, connection_id, event_hub, disconnected)
     
     return Response(
         generate(),
@@ -1071,9 +1118,13 @@ def get_status():
             user_execution['running'] = False
             user_execution['process'] = None
     
+    # Observers attach to /api/task/stream after this event (earlier output is in the chat history)
+    event_hub = user_execution.get('event_hub')
+    
     return jsonify({
         "running": is_running,
-        "has_process": process is not None
+        "has_process": process is not None,
+        "last_event_id": event_hub.last_event_id if event_hub else 0
     })
 
 
@@ -1298,6 +1349,10 @@ def clear_task():
         import shutil
         shutil.rmtree(task_path)
         
+        # Drop this process's handle on the workspace state database before its files are deleted
+        from utils.state_store import close_state_store
+        close_state_store(str(task_path))
+        
         # Also delete corresponding conversation files in home directory
         # Generate task_hash and task_folder same way as hierarchy_manager
         # Use absolute path (task_path) to ensure hash matches what was used during storage
@@ -1314,9 +1369,10 @@ def clear_task():
         conversations_dir = Path.home() / "mla_v3" / "conversations"
         if conversations_dir.exists():
             deleted_files = []
-            # Pattern: {task_hash}_{task_folder}_*.json
-            pattern = f"{task_name}_*.json"
-            for file_path in conversations_dir.glob(pattern):
+            # Patterns: {task_hash}_{task_folder}_*.json (snapshots), *.jsonl (action journals)
+            # and the SQLite state database with its -wal/-shm files
+            patterns = (f"{task_name}_*.json*", f"{task_name}_state.db*")
+            for file_path in [p for pattern in patterns for p in conversations_dir.glob(pattern)]:
                 try:
                     file_path.unlink()
                     deleted_files.append(file_path.name)
@@ -1363,44 +1419,154 @@ def clear_copy_progress(username: str, task_id: str):
             del copy_progress[key]
 
 
-def copy_tree_with_progress(src: Path, dst: Path, username: str, task_id: str):
-    """Copy directory tree with progress tracking"""
-    import shutil
+# Reproducible directories that can be skipped (recreated on demand) or symlinked when copying a task
+COPY_HEAVY_DIRS = ('code_env/venv',)
+COPY_WORKERS = 8
+COPY_LINK_MODES = ('copy', 'auto', 'reflink')
+COPY_HEAVY_DIR_MODES = ('copy', 'skip', 'symlink')
+FICLONE = 0x40049409  # Linux ioctl: share extents copy-on-write (btrfs, xfs, ...)
+
+
+def _reflink_file(src: Path, dst: Path):
+    """Copy-on-write clone of a file (raises OSError where unsupported)"""
+    if not sys.platform.startswith('linux'):
+        raise OSError("reflink is only supported on Linux")
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+
+
+class _CopyEngine:
+    """Single-walk, parallel task copy with optional reflink and byte-throttled progress"""
     
-    # Count total files first
-    total_files = 0
-    for root, dirs, files in os.walk(src):
-        total_files += len(files)
+    def __init__(self, src: Path, dst: Path, username: str, task_id: str,
+                 link_mode: str = 'copy', heavy_dirs: str = 'copy'):
+        self.src = src
+        self.dst = dst
+        self.username = username
+        self.task_id = task_id
+        self.link_mode = link_mode
+        self.heavy_dirs = heavy_dirs
+        self.reflink_ok = link_mode in ('auto', 'reflink')
+        self.lock = threading.Lock()
+        self.total_files = 0
+        self.total_bytes = 0
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.reported_bytes = 0
+        self.methods = {}
     
-    if total_files == 0:
-        total_files = 1  # Avoid division by zero
+    def scan(self):
+        """Walk the source once: directories to create, files (with sizes), heavy directories"""
+        directories, files, heavy = [], [], []
+        for root, dirs, names in os.walk(self.src):
+            rel_root = Path(root).relative_to(self.src)
+            directories.append(rel_root)
+            for d in list(dirs):
+                if self.heavy_dirs != 'copy' and (rel_root / d).as_posix() in COPY_HEAVY_DIRS:
+                    dirs.remove(d)
+                    heavy.append(rel_root / d)
+                elif os.path.islink(os.path.join(root, d)):
+                    # Directory symlinks are recreated as links, not walked
+                    dirs.remove(d)
+                    names.append(d)
+            for name in names:
+                rel = rel_root / name
+                try:
+                    size = os.lstat(self.src / rel).st_size
+                except OSError:
+                    size = 0
+                files.append((rel, size))
+        self.total_files = len(files)
+        self.total_bytes = sum(size for _, size in files)
+        return directories, files, heavy
     
-    copied_files = 0
+    def _copy_one(self, rel: Path) -> str:
+        """Copy one file and return the method used"""
+        import shutil
+        src_file = self.src / rel
+        dst_file = self.dst / rel
+        if not src_file.is_symlink():
+            if self.reflink_ok:
+                try:
+                    _reflink_file(src_file, dst_file)
+                    shutil.copystat(src_file, dst_file)
+                    return 'reflink'
+                except OSError:
+                    # Filesystem without reflink support: stop trying for the remaining files
+                    self.reflink_ok = False
+        shutil.copy2(src_file, dst_file, follow_symlinks=False)
+        return 'copy'
     
-    # Create destination directory
-    dst.mkdir(parents=True, exist_ok=True)
+    def _done(self, size: int, method: str):
+        with self.lock:
+            self.copied_files += 1
+            self.copied_bytes += size
+            self.methods[method] = self.methods.get(method, 0) + 1
+            # Throttle progress updates by bytes (every 1% of the total, at least 4MB) or file count
+            step = max(self.total_bytes // 100, 4 * 1024 * 1024)
+            if (self.copied_bytes - self.reported_bytes < step
+                    and self.copied_files % 500 != 0):
+                return
+            self.reported_bytes = self.copied_bytes
+            copied_files, copied_bytes = self.copied_files, self.copied_bytes
+        self._report(copied_files, copied_bytes)
+    
+    def _report(self, copied_files: int, copied_bytes: int):
+        if self.total_bytes:
+            progress = int(copied_bytes * 100 / self.total_bytes)
+        else:
+            progress = int(copied_files * 100 / max(self.total_files, 1))
+        set_copy_progress(self.username, self.task_id, "copying", min(progress, 99),
+                          f"Copying files: {copied_files}/{self.total_files} "
+                          f"({copied_bytes / 1048576:.1f}/{self.total_bytes / 1048576:.1f} MB)")
     
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        directories, files, heavy = self.scan()
+        set_copy_progress(self.username, self.task_id, "copying", 0,
+                          f"Starting copy: {self.total_files} files to copy")
+        
+        for rel_dir in directories:
+            (self.dst / rel_dir).mkdir(parents=True, exist_ok=True)
+        
+        for rel_dir in heavy:
+            if self.heavy_dirs == 'symlink':
+                os.symlink(self.src / rel_dir, self.dst / rel_dir, target_is_directory=True)
+        
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="task-copy") as pool:
+            futures = [(pool.submit(self._copy_one, rel), size) for rel, size in files]
+            for future, size in futures:
+                self._done(size, future.result())
+        
+        summary = ", ".join(f"{count} {method}" for method, count in sorted(self.methods.items()))
+        action = 'symlinked' if self.heavy_dirs == 'symlink' else 'skipped'
+        skipped = f"; {action} {', '.join(p.as_posix() for p in heavy)}" if heavy else ""
+        set_copy_progress(self.username, self.task_id, "completed", 100,
+                          f"Copy completed: {self.total_files} files copied ({summary or 'empty'}{skipped})")
+
+
+def copy_tree_with_progress(src: Path, dst: Path, username: str, task_id: str,
+                            link_mode: str = 'copy', heavy_dirs: str = 'copy'):
+    """
+    Copy directory tree with progress tracking
+    
+    Args:
+        link_mode: 'copy' (default) or 'auto'/'reflink' (copy-on-write clone where the
+            filesystem supports it, otherwise copy). Hard links are not offered: the tool
+            server writes files in place, so edits would leak into the source task.
+        heavy_dirs: how to handle COPY_HEAVY_DIRS such as code_env/venv:
+            'copy' (default, keeps installed packages), 'skip' (recreated empty on first
+            use, packages must be reinstalled) or 'symlink' (share the source venv)
+    """
+    dst.mkdir(parents=True, exist_ok=True)
     try:
-        set_copy_progress(username, task_id, "copying", 0, f"Starting copy: {total_files} files to copy")
-        
-        # Walk through source directory and copy files
-        for root, dirs, files in os.walk(src):
-            # Calculate relative path
-            rel_path = Path(root).relative_to(src)
-            dst_dir = dst / rel_path
-            dst_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Copy files
-            for file in files:
-                src_file = Path(root) / file
-                dst_file = dst_dir / file
-                shutil.copy2(src_file, dst_file)
-                copied_files += 1
-                progress = int((copied_files / total_files) * 100)
-                set_copy_progress(username, task_id, "copying", progress, 
-                                 f"Copying files: {copied_files}/{total_files}")
-        
-        set_copy_progress(username, task_id, "completed", 100, f"Copy completed: {total_files} files copied")
+        _CopyEngine(src, dst, username, task_id, link_mode, heavy_dirs).run()
     except Exception as e:
         set_copy_progress(username, task_id, "error", 0, f"Copy failed: {str(e)}")
         raise
@@ -1447,6 +1613,13 @@ def copy_task():
         if not source_task_id or not target_task_id:
             return jsonify({"error": "Missing source_task_id or target_task_id"}), 400
         
+        link_mode = data.get('link_mode', 'copy')
+        heavy_dirs = data.get('heavy_dirs', 'copy')
+        if link_mode not in COPY_LINK_MODES:
+            return jsonify({"error": f"Invalid link_mode, expected one of {', '.join(COPY_LINK_MODES)}"}), 400
+        if heavy_dirs not in COPY_HEAVY_DIR_MODES:
+            return jsonify({"error": f"Invalid heavy_dirs, expected one of {', '.join(COPY_HEAVY_DIR_MODES)}"}), 400
+        
         # Normalize paths
         try:
             source_path, _ = normalize_task_id(source_task_id, username)
@@ -1471,7 +1644,8 @@ def copy_task():
         # Copy directory in background thread
         def copy_in_thread():
             try:
-                copy_tree_with_progress(source_path, target_path, username, target_task_id)
+                copy_tree_with_progress(source_path, target_path, username, target_task_id,
+                                        link_mode, heavy_dirs)
             except Exception as e:
                 import traceback
                 set_copy_progress(username, target_task_id, "error", 0, 
@@ -1510,10 +1684,111 @@ def get_copy_progress_api():
         return jsonify({"error": str(e)}), 500
 
 
+# Already-compressed formats are stored as-is instead of being deflated again
+ZIP_STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.pdf', '.zip', '.gz', '.tgz', '.bz2',
+    '.xz', '.7z', '.rar', '.whl', '.mp3', '.mp4', '.mov', '.docx', '.xlsx', '.pptx',
+}
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class _ZipStreamBuffer:
+    """Write-only, non-seekable sink for zipfile; chunks are drained by the generator"""
+    
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _is_excluded(rel_path: str, exclude_globs: list) -> bool:
+    """Match a POSIX relative path against exclusion globs (e.g. 'code_env', 'temp/browser', '*.log')"""
+    import fnmatch
+    return any(fnmatch.fnmatch(rel_path, pattern) for pattern in exclude_globs)
+
+
+def stream_zip(root: Path, exclude_globs: list = None):
+    """
+    Stream a directory as a ZIP archive
+    
+    Entries are written while walking the tree and each piece is yielded as soon as
+    it is produced, so memory stays constant regardless of workspace size.
+    """
+    import zipfile
+    
+    exclude_globs = [g.strip().strip('/') for g in (exclude_globs or []) if g and g.strip().strip('/')]
+    sink = _ZipStreamBuffer()
+    
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for current, dirs, files in os.walk(root):
+            rel_root = Path(current).relative_to(root)
+            rel_root_str = rel_root.as_posix() if rel_root != Path('.') else ''
+            
+            # Prune excluded directories so they are never walked
+            dirs[:] = sorted(
+                d for d in dirs
+                if not _is_excluded(f"{rel_root_str}/{d}" if rel_root_str else d, exclude_globs)
+            )
+            
+            # Skip chat_history.json file
+            valid_files = sorted(
+                f for f in files
+                if f != 'chat_history.json'
+                and not _is_excluded(f"{rel_root_str}/{f}" if rel_root_str else f, exclude_globs)
+            )
+            
+            # Empty leaf directory: add an explicit entry (parents are implied by their children)
+            if not valid_files and not dirs and rel_root_str:
+                zip_file.writestr(rel_root_str + '/', b'')
+                yield sink.drain()
+            
+            for name in valid_files:
+                file_path = Path(current) / name
+                arcname = f"{rel_root_str}/{name}" if rel_root_str else name
+                try:
+                    if not file_path.is_file():
+                        continue
+                    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                    if file_path.suffix.lower() in ZIP_STORED_EXTENSIONS:
+                        zinfo.compress_type = zipfile.ZIP_STORED
+                    else:
+                        zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    with open(file_path, 'rb') as src, zip_file.open(zinfo, 'w') as dst:
+                        while True:
+                            chunk = src.read(ZIP_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+                            yield sink.drain()
+                except OSError as e:
+                    print(f"⚠️ Skipping {arcname} in ZIP: {e}", flush=True)
+                    continue
+                yield sink.drain()
+    
+    # Central directory
+    yield sink.drain()
+
+
 @app.route('/api/task/download', methods=['GET'])
 @login_required
 def download_task():
-    """Download entire task directory as ZIP archive"""
+    """Download entire task directory as a streamed ZIP archive"""
     try:
         username = session.get('username')
         if not username:
@@ -1535,83 +1810,28 @@ def download_task():
         if not task_path.is_dir():
             return jsonify({"error": "Path is not a directory"}), 400
         
-        # Create ZIP file in memory
-        import zipfile
-        import io
-        from flask import send_file
-        
-        # Create in-memory ZIP file
-        zip_buffer = io.BytesIO()
-        
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Collect empty directories and files to include
-            empty_directories = set()
-            files_to_add = []
-            directories_with_files = set()  # Track directories that contain files
-            
-            # Walk through all files in task directory
-            for root, dirs, files in os.walk(task_path):
-                # Calculate relative path for current directory
-                rel_root = Path(root).relative_to(task_path)
-                rel_root_str = str(rel_root)
-                
-                # # Skip conversations directory and all its subdirectories
-                # if 'conversations' in rel_root_str.split(os.sep):
-                #     # Remove conversations from dirs to prevent further traversal
-                #     if 'conversations' in dirs:
-                #         dirs.remove('conversations')
-                #     continue
-                
-                # # Remove conversations directory from dirs to skip it during walk
-                # if 'conversations' in dirs:
-                #     dirs.remove('conversations')
-                
-                # Check if directory has any valid files (excluding chat_history.json)
-                valid_files = [f for f in files if f != 'chat_history.json']
-                
-                if not valid_files:
-                    # Directory is empty (or only contains chat_history.json)
-                    if rel_root != Path('.'):
-                        empty_directories.add(rel_root_str)
-                else:
-                    # Directory has files, mark it and its parents
-                    directories_with_files.add(rel_root_str)
-                    for parent in rel_root.parents:
-                        if parent != Path('.'):
-                            directories_with_files.add(str(parent))
-                
-                # Process files
-                for file in files:
-                    # Skip chat_history.json file
-                    if file == 'chat_history.json':
-                        continue
-                    
-                    file_path = Path(root) / file
-                    # Calculate relative path from task directory
-                    arcname = file_path.relative_to(task_path)
-                    files_to_add.append((file_path, arcname))
-            
-            # Add empty directories (excluding those that will be created by files)
-            for dir_path in sorted(empty_directories):
-                if dir_path not in directories_with_files:
-                    # Create empty directory entry by adding a path ending with /
-                    zip_file.writestr(dir_path + '/', b'')
-            
-            # Add all files
-            for file_path, arcname in files_to_add:
-                zip_file.write(file_path, arcname)
-        
-        zip_buffer.seek(0)
+        # Exclusion globs: ?exclude=code_env&exclude=temp/browser or ?exclude=code_env,temp/browser
+        exclude_globs = []
+        for value in request.args.getlist('exclude'):
+            exclude_globs.extend(value.split(','))
         
         # Generate filename (sanitize task_id for filename)
         safe_task_id = task_id.replace('/', '_').replace('\\', '_').replace('..', '_')
         zip_filename = f"{safe_task_id}.zip"
+        from urllib.parse import quote
         
-        return send_file(
-            zip_buffer,
+        def generate():
+            for chunk in stream_zip(task_path, exclude_globs):
+                if chunk:
+                    yield chunk
+        
+        return Response(
+            generate(),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name=zip_filename
+            headers={
+                'Content-Disposition': f"attachment; filename*=UTF-8''{quote(zip_filename)}",
+                'X-Accel-Buffering': 'no'
+            }
         )
     except Exception as e:
         import traceback
@@ -8,6 +8,10 @@
 // Global variables
 let currentEventSource = null;
 let isRunning = false;
+let lastEventId = 0;  // Last received SSE event ID (replayed after on reconnect)
+let sseReconnectAttempts = 0;
+let sseSaveToHistory = true;  // Observers (second tab) do not save messages; the tab that started the task does
+const SSE_MAX_RECONNECTS = 5;
 let currentHILTask = null;  // Current HIL task: {hil_id, instruction}
 let hilCheckInterval = null;  // Interval for checking HIL tasks
 
@@ -132,32 +136,37 @@ let currentBrowsePath = '';
 let currentViewingFile = null; // Currently viewing file path
 let confirmedTaskId = null;  // Currently confirmed taskid
 
-// Check and stop old task
-async function checkAndStopOldTask() {
+// Check for a running task (e.g. started in another tab)
+async function checkRunningTask() {
     try {
-        // Check status first
         const statusResponse = await fetch('/api/status', {
             credentials: 'include'
         });
-        const statusData = await statusResponse.json();
-        
-        // If there's a running task, stop it automatically
-        if (statusData.running) {
-            console.log('Detected running task, stopping automatically...');
-            await fetch('/api/stop', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                credentials: 'include'
-            });
-        }
+        return await statusResponse.json();
     } catch (error) {
         // Ignore error (server may not be started, etc.)
         console.log('Failed to check task status (may be normal):', error);
+        return { running: false };
     }
 }
 
+// Watch a running task's output as an observer (the task keeps running while any tab is watching)
+function attachToRunningTask(fromEventId) {
+    console.log('Attaching to running task output after event', fromEventId);
+    sseSaveToHistory = false;
+    lastEventId = fromEventId || 0;
+    isRunning = true;
+    sendBtn.disabled = true;
+    sendBtn.style.display = 'none';
+    stopBtn.style.display = 'inline-block';
+    userInput.disabled = true;
+    statusText.textContent = 'Running...';
+    statusText.style.color = '';
+    updateTaskButtonsState(); // Update task button state
+    startHILTaskChecking();
+    connectTaskStream();
+}
+
 // Check login status
 async function checkAuth() {
     try {
@@ -217,8 +226,8 @@ document.addEventListener('DOMContentLoaded', async () => {
         logoutBtn.addEventListener('click', logout);
     }
     
-    // Check and stop any existing old task on page load
-    await checkAndStopOldTask();
+    // A task that is still running (e.g. in another tab) is watched instead of stopped
+    const runningStatus = await checkRunningTask();
     
     // Restore task_id from localStorage (restore after refresh)
     const savedTaskId = localStorage.getItem('mla_task_id');
@@ -257,6 +266,9 @@ document.addEventListener('DOMContentLoaded', async () => {
                 welcomeMsgAfter.remove();
                 console.log('DOMContentLoaded: No history');
             }
+            if (runningStatus.running) {
+                attachToRunningTask(runningStatus.last_event_id);
+            }
         }, 500);
     } else {
         console.log('DOMContentLoaded: No saved taskId');
@@ -1947,6 +1959,9 @@ function startSSEConnection(taskId, agentName, userInputText, agentSystem) {
     if (currentEventSource) {
         currentEventSource.close();
     }
+    lastEventId = 0;
+    sseReconnectAttempts = 0;
+    sseSaveToHistory = true;
     
     // 使用 POST 方法（通过 fetch）进行流式读取
     fetch('/api/run', {
@@ -1962,20 +1977,62 @@ function startSSEConnection(taskId, agentName, userInputText, agentSystem) {
             agent_system: agentSystem
         })
     }).then(response => {
+        if (response.status === 409) {
+            // Task already running (started in another tab): watch its output instead
+            return checkRunningTask().then(status => {
+                showMessage('system', 'info', 'A task is already running, showing its output');
+                attachToRunningTask(status.last_event_id);
+            });
+        }
         if (!response.ok) {
             return response.json().then(data => {
                 throw new Error(data.error || `HTTP error! status: ${response.status}`);
             });
         }
         
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-        let buffer = '';
+        readSSEStream(response);
+    }).catch(error => {
+        console.error('请求失败:', error);
+        // Remove all loading animations
+        removeAllLoadingAnimations();
         
-        function readStream() {
-            reader.read().then(({ done, value }) => {
-                if (done) {
-                    // Task completed
+        isRunning = false;
+        sendBtn.disabled = false;
+        sendBtn.style.display = 'inline-block';
+        stopBtn.style.display = 'none';
+        userInput.disabled = false;
+        statusText.textContent = 'Error';
+        showMessage('system', 'error', `Request failed: ${error.message}`);
+    });
+}
+
+// 连接任务输出流（/api/task/stream），从 lastEventId 之后继续
+function connectTaskStream() {
+    fetch('/api/task/stream', {
+        credentials: 'include',
+        headers: {
+            'Last-Event-ID': String(lastEventId)
+        }
+    }).then(response => {
+        if (!response.ok) {
+            return response.json().then(data => {
+                throw new Error(data.error || `HTTP error! status: ${response.status}`);
+            });
+        }
+        readSSEStream(response);
+    }).catch(handleStreamError);
+}
+
+// 读取 SSE 流（记录事件ID，断开时自动重连）
+function readSSEStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    function readStream() {
+        reader.read().then(({ done, value }) => {
+            if (done) {
+                // Task completed
                 isRunning = false;
                 sendBtn.disabled = false;
                 sendBtn.style.display = 'inline-block';
@@ -1984,70 +2041,72 @@ function startSSEConnection(taskId, agentName, userInputText, agentSystem) {
                 statusText.textContent = 'Ready';
                 updateTaskButtonsState(); // Update task button state
                 updateSendButtonState(); // Update send button state
-                    return;
+                return;
+            }
+            
+            sseReconnectAttempts = 0;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() || ''; // 保留最后不完整的行
+            
+            for (const line of lines) {
+                if (line.trim() === '' || line.startsWith(':')) {
+                    continue; // 跳过空行和心跳
                 }
                 
-                buffer += decoder.decode(value, { stream: true });
-                const lines = buffer.split('\n');
-                buffer = lines.pop() || ''; // 保留最后不完整的行
+                if (line.startsWith('id: ')) {
+                    lastEventId = parseInt(line.slice(4), 10) || lastEventId;
+                    continue;
+                }
                 
-                for (const line of lines) {
-                    if (line.trim() === '' || line.startsWith(':')) {
-                        continue; // 跳过空行和心跳
-                    }
-                    
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const jsonStr = line.slice(6);
-                            const data = JSON.parse(jsonStr);
-                            // JSON.parse 应该已经将 \n 转换为真正的换行符
-                            // 但如果 content 中还有字符串形式的 \n，需要额外处理
-                            if (data.content && typeof data.content === 'string') {
-                                // 确保字符串中的 \n 是真正的换行符（JSON.parse 应该已经处理了）
-                                // 但如果还有转义的 \n（即 \\n），需要转换
-                                data.content = data.content.replace(/\\n/g, '\n');
-                                data.content = data.content.replace(/\\r\\n/g, '\r\n');
-                                data.content = data.content.replace(/\\r/g, '\r');
-                            }
-                            handleSSEMessage(data);
-                        } catch (e) {
-                            console.error('Parse SSE message failed:', e, line);
+                if (line.startsWith('data: ')) {
+                    try {
+                        const jsonStr = line.slice(6);
+                        const data = JSON.parse(jsonStr);
+                        // JSON.parse 应该已经将 \n 转换为真正的换行符
+                        // 但如果 content 中还有字符串形式的 \n，需要额外处理
+                        if (data.content && typeof data.content === 'string') {
+                            // 确保字符串中的 \n 是真正的换行符（JSON.parse 应该已经处理了）
+                            // 但如果还有转义的 \n（即 \\n），需要转换
+                            data.content = data.content.replace(/\\n/g, '\n');
+                            data.content = data.content.replace(/\\r\\n/g, '\r\n');
+                            data.content = data.content.replace(/\\r/g, '\r');
                         }
+                        handleSSEMessage(data);
+                    } catch (e) {
+                        console.error('Parse SSE message failed:', e, line);
                     }
                 }
-                
-                readStream();
-            }).catch(error => {
-                console.error('Read stream failed:', error);
-                // Remove all loading animations
-                removeAllLoadingAnimations();
-                
-                isRunning = false;
-                sendBtn.disabled = false;
-                sendBtn.style.display = 'inline-block';
-                stopBtn.style.display = 'none';
-                userInput.disabled = false;
-                statusText.textContent = 'Error';
-                updateTaskButtonsState(); // Update task button state
-                updateSendButtonState(); // Update send button state
-                showMessage('system', 'error', `Connection error: ${error.message}`);
-            });
-        }
-        
-        readStream();
-    }).catch(error => {
-        console.error('请求失败:', error);
-        // Remove all loading animations
-        removeAllLoadingAnimations();
-        
-        isRunning = false;
-        sendBtn.disabled = false;
-        sendBtn.style.display = 'inline-block';
-        stopBtn.style.display = 'none';
-        userInput.disabled = false;
-        statusText.textContent = 'Error';
-        showMessage('system', 'error', `Request failed: ${error.message}`);
-    });
+            }
+            
+            readStream();
+        }).catch(handleStreamError);
+    }
+    
+    readStream();
+}
+
+// 流读取失败：任务仍在运行时从最后收到的事件之后重连
+function handleStreamError(error) {
+    console.error('Read stream failed:', error);
+    if (isRunning && sseReconnectAttempts < SSE_MAX_RECONNECTS) {
+        sseReconnectAttempts += 1;
+        statusText.textContent = `Reconnecting (${sseReconnectAttempts}/${SSE_MAX_RECONNECTS})...`;
+        setTimeout(connectTaskStream, 1000 * sseReconnectAttempts);
+        return;
+    }
+    // Remove all loading animations
+    removeAllLoadingAnimations();
+    
+    isRunning = false;
+    sendBtn.disabled = false;
+    sendBtn.style.display = 'inline-block';
+    stopBtn.style.display = 'none';
+    userInput.disabled = false;
+    statusText.textContent = 'Error';
+    updateTaskButtonsState(); // Update task button state
+    updateSendButtonState(); // Update send button state
+    showMessage('system', 'error', `Connection error: ${error.message}`);
 }
 
 // 处理 SSE 消息
@@ -2075,8 +2134,8 @@ function handleSSEMessage(data) {
         // Refresh file list when task completes
         loadFiles();
     } else {
-        // All messages from SSE are agent messages（isUser = false，保存到历史记录）
-        addMessage(agent, type, content, false, true);
+        // All messages from SSE are agent messages（isUser = false；观察者不重复保存历史记录）
+        addMessage(agent, type, content, false, sseSaveToHistory);
         
         // Check if this is a human_in_loop tool call - trigger immediate check
         if (type === 'tool_call' && content.includes('human_in_loop')) {